@@ -3,24 +3,107 @@ import re
 import io
 import warnings
 import pandas as pd
-import uuid # Used to generate unique filenames for uploaded images
-import base64 # Used for decoding base64 image data
 import time # Used for generating unique barcodes if needed
 
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, g, request, jsonify, render_template, send_file, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
-from utils.inventory import load_inventory, save_inventory, get_alerts
-from utils.orders import load_orders, save_orders, create_order
-from utils.barcode import lookup_barcode
-from utils.analysis import process_data
+from utils.inventory import load_inventory, save_inventory
+from utils.storage import CSVBackend, SQLiteBackend
+from utils.sqlite_store import migrate_csv
+from utils.barcode import lookup_barcode, lookup_barcodes, normalize_barcode
+from utils.changes import sse_event
+from utils.lookup_cache import get_lookup_cache
+from utils.history import get_history_store, get_history_writer, parse_quantity, parse_timestamp
+from utils.rollups import get_history_rollups
+from utils.analysis import process_data, analyze_file, ANALYSIS_VERSION
+from utils.result_cache import get_result_cache, spool_and_hash
+from utils.images import HASHED_NAME, get_image_store
+from utils.importer import IMPORT_EXTS, coerce_import, read_table
+from utils.metrics import SIZE_BUCKETS, begin_request, get_profiler, metrics, request_stages, write_profile
+from utils.serialization import dumps, frame_json, records_json, choose_encoding, compress
+import click
 import requests
 from datetime import datetime
-import csv
 warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 app.config['INVENTORY_FILE'] = "data/inventory.csv"
 app.config['ORDERS_FILE'] = "data/orders.csv"
+# Where inventory and orders live: 'csv' (INVENTORY_FILE/ORDERS_FILE) or
+# 'sqlite' (SQLITE_DB, filled once from the CSV files with `flask migrate-sqlite`)
+app.config['STORAGE_BACKEND'] = 'csv'
+app.config['SQLITE_DB'] = "data/inventory.sqlite3"
+# Inventory writes go to an append-only journal (INVENTORY_FILE + '.journal');
+# it is folded into a new inventory.csv snapshot once it holds this many records,
+# checked every JOURNAL_COMPACT_INTERVAL seconds
+app.config['JOURNAL_COMPACT_RECORDS'] = 1000
+app.config['JOURNAL_COMPACT_INTERVAL'] = 10
+# Each snapshot is also written as a typed binary copy (Arrow/Feather, needs
+# pyarrow) that loads without parsing the CSV
+app.config['BINARY_SNAPSHOT'] = True
+# Expiry alerts fire this many days before a product's expiry date; overstock
+# alerts once quantity exceeds threshold * ALERT_OVERSTOCK_MULTIPLIER
+app.config['ALERT_EXPIRY_WINDOWS'] = (7, 3, 1)
+app.config['ALERT_OVERSTOCK_MULTIPLIER'] = 10
+# External barcode lookups (found / not found) are cached in SQLite for these
+# many seconds; the least recently used entries go beyond LOOKUP_CACHE_MAX_ENTRIES
+app.config['LOOKUP_CACHE_FILE'] = "data/lookup_cache.sqlite3"
+app.config['LOOKUP_CACHE_TTL'] = 7 * 24 * 3600
+app.config['LOOKUP_CACHE_NEGATIVE_TTL'] = 6 * 3600
+app.config['LOOKUP_CACHE_MAX_ENTRIES'] = 50000
+# Providers are queried concurrently: a lookup never takes longer than
+# LOOKUP_DEADLINE seconds, and lower-priority providers are only asked once
+# the top one has had LOOKUP_HEDGE_DELAY seconds to answer
+app.config['LOOKUP_DEADLINE'] = 5.0
+app.config['LOOKUP_HEDGE_DELAY'] = 0.25
+# Stock-level history lives in SQLite, indexed by (barcode, timestamp); rows of
+# the old append-only HISTORY_LEGACY_CSV are imported into it on first use
+app.config['HISTORY_DB'] = "data/stock_history.sqlite3"
+app.config['HISTORY_LEGACY_CSV'] = "data/stock_history.csv"
+# History events are queued and written by one background thread in batches of
+# up to HISTORY_BATCH_SIZE, at most HISTORY_FLUSH_INTERVAL seconds apart.
+# HISTORY_FSYNC: 'full' (fsync every batch), 'normal' or 'off'
+app.config['HISTORY_BATCH_SIZE'] = 500
+app.config['HISTORY_FLUSH_INTERVAL'] = 0.2
+app.config['HISTORY_FSYNC'] = 'normal'
+# Hourly/daily/weekly rollups of the history are caught up with new scans at
+# most every HISTORY_ROLLUP_INTERVAL seconds for alerts (always for charts).
+# Reorder alerts fire for products whose stock, at their average daily usage
+# over the last REORDER_USAGE_DAYS, runs out within REORDER_DAYS
+app.config['HISTORY_ROLLUP_INTERVAL'] = 60
+app.config['REORDER_USAGE_DAYS'] = 28
+app.config['REORDER_DAYS'] = 7
+# /analyze parses and aggregates uploads ANALYSIS_CHUNK_ROWS rows at a time;
+# with ANALYSIS_WORKERS > 1 chunks are aggregated in a process pool
+app.config['ANALYSIS_CHUNK_ROWS'] = 100_000
+app.config['ANALYSIS_WORKERS'] = 0
+# Analysis results (charts included) are cached on disk under a hash of the
+# uploaded content; least recently used ones go beyond ANALYSIS_CACHE_MAX_BYTES
+app.config['ANALYSIS_CACHE_DIR'] = "data/analysis_cache"
+app.config['ANALYSIS_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+# JSON responses larger than COMPRESS_MIN_SIZE bytes are brotli- (if installed)
+# or gzip-compressed at COMPRESS_LEVEL when the client accepts it
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_LEVEL'] = 6
+# Requests slower than PROFILE_SLOW_REQUESTS seconds leave a sampled profile
+# (collapsed stacks, one sample per PROFILE_INTERVAL seconds) in PROFILE_DIR;
+# 0 turns the profiler off
+app.config['PROFILE_SLOW_REQUESTS'] = 0
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_DIR'] = "data/profiles"
+# Change feed (/inventory/changes): streams end after CHANGE_FEED_MAX_SECONDS
+# (EventSource reconnects and resumes), changes made by other worker processes
+# are picked up every CHANGE_FEED_POLL seconds and idle streams get a
+# keepalive comment every CHANGE_FEED_KEEPALIVE seconds
+app.config['CHANGE_FEED_MAX_SECONDS'] = 300
+app.config['CHANGE_FEED_POLL'] = 1.0
+app.config['CHANGE_FEED_KEEPALIVE'] = 15
+# Largest number of barcodes / products accepted by the batch endpoints
+app.config['BATCH_MAX_ITEMS'] = 1000
+# /inventory/import takes files of up to IMPORT_MAX_ROWS rows and reports the
+# first IMPORT_MAX_ERRORS rejected rows
+app.config['IMPORT_MAX_ROWS'] = 500000
+app.config['IMPORT_MAX_ERRORS'] = 100
 # Updated ALLOWED_EXTS to explicitly include image types
 app.config['ALLOWED_EXTS'] = {'csv','xlsx','xls','json','tsv','pdf','png','jpg','jpeg','gif'}
 
@@ -30,6 +113,14 @@ app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'images', 'p
 
 # Ensure the upload directory exists when the application starts
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Uploaded images are stored under their content hash and served from
+# /images/products/ for IMAGE_MAX_AGE seconds as immutable; IMAGE_WORKERS
+# threads make their thumbnail/display variants. With IMAGE_CACHE_REMOTE,
+# external image URLs of products are copied there too
+app.config['IMAGE_MAX_AGE'] = 365 * 24 * 3600
+app.config['IMAGE_MAX_BYTES'] = 10 * 1024 * 1024
+app.config['IMAGE_WORKERS'] = 2
+app.config['IMAGE_CACHE_REMOTE'] = False
 
 
 def allowed_file(filename):
@@ -45,43 +136,391 @@ def fuzzy_column_match(col, aliases):
     cn = normalize(col)
     return any(cn == normalize(a) for a in aliases)
 
+# Column names /inventory/import recognizes for each inventory column
+# (compared by fuzzy_column_match, i.e. ignoring case, spaces and punctuation)
+IMPORT_COLUMN_ALIASES = {
+    'barcode': ['barcode', 'ean', 'ean13', 'upc', 'gtin', 'product code', 'item code', 'code', 'sku'],
+    'name': ['name', 'product', 'product name', 'item', 'item name', 'title'],
+    'category': ['category', 'department', 'product category'],
+    'quantity': ['quantity', 'qty', 'stock', 'on hand', 'units'],
+    'cost': ['cost', 'unit cost', 'cost price', 'purchase price', 'buy price'],
+    'price': ['price', 'unit price', 'retail price', 'sell price', 'selling price', 'msrp'],
+    'expiry': ['expiry', 'expiry date', 'expiration', 'expiration date', 'best before', 'use by'],
+    'threshold': ['threshold', 'reorder point', 'reorder level', 'min stock', 'minimum stock'],
+    'distributor': ['distributor', 'supplier', 'vendor'],
+    'manufacturer': ['manufacturer', 'brand', 'maker'],
+    'synced': ['synced'],
+    'image_url': ['image url', 'image', 'picture', 'photo'],
+    'description': ['description', 'details'],
+}
+
+def map_import_columns(columns):
+    """
+    Maps file columns to inventory columns with fuzzy_column_match; each
+    inventory column takes the first file column that matches.
+    """
+    mapping = {}
+    for target, aliases in IMPORT_COLUMN_ALIASES.items():
+        for col in columns:
+            if col not in mapping and fuzzy_column_match(str(col), aliases):
+                mapping[col] = target
+                break
+    return mapping
+
+def json_response(body, status=200, mimetype='application/json'):
+    """
+    Wraps already-encoded JSON bytes (see utils.serialization) in a response.
+    """
+    return Response(body, status=status, mimetype=mimetype)
+
+@app.before_request
+def start_request_metrics():
+    """
+    Starts timing the request (and its stages, see utils.metrics) and, if
+    slow-request profiling is on, sampling its stack.
+    """
+    g.request_started = time.perf_counter()
+    begin_request()
+    if app.config['PROFILE_SLOW_REQUESTS']:
+        get_profiler(app.config['PROFILE_INTERVAL']).begin()
+        g.profiling = True
+
+# Registered before compress_response so that it runs after it (Flask runs
+# after_request functions in reverse order) and sees the bytes actually sent
+@app.after_request
+def record_request_metrics(response):
+    """
+    Records the request's latency, count and payload sizes by endpoint, adds
+    a Server-Timing header with its stages and dumps its profile if slow.
+    Streamed responses are timed until their first byte.
+    """
+    elapsed, endpoint = count_request(response.status_code, response.content_length)
+    stages = request_stages()
+    if stages:
+        response.headers['Server-Timing'] = ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+    if g.pop('profiling', False):
+        samples = get_profiler(app.config['PROFILE_INTERVAL']).end()
+        if elapsed >= app.config['PROFILE_SLOW_REQUESTS'] and samples:
+            profile_name = f"{int(time.time() * 1000)}-{request.method}-{secure_filename(endpoint) or 'root'}.txt"
+            header = [f"{request.method} {request.full_path}", f"status {response.status_code}",
+                      f"duration {elapsed:.3f} s, {sum(samples.values())} samples"]
+            header += [f"stage {name} {seconds:.3f} s" for name, seconds in stages.items()]
+            write_profile(app.config['PROFILE_DIR'], profile_name, samples, header)
+    return response
+
+def count_request(status, response_size=None):
+    """
+    Records the request's count, latency and sizes by endpoint, once per
+    request. Returns (elapsed seconds, endpoint).
+    """
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if g.get('request_counted'):
+        return elapsed, endpoint
+    g.request_counted = True
+    labels = {'method': request.method, 'endpoint': endpoint}
+    metrics.inc('requests_total', dict(labels, status=status))
+    metrics.observe('request_duration_seconds', elapsed, labels)
+    if request.content_length:
+        metrics.observe('request_size_bytes', request.content_length, labels, buckets=SIZE_BUCKETS)
+    if response_size is not None:
+        metrics.observe('response_size_bytes', response_size, labels, buckets=SIZE_BUCKETS)
+    return elapsed, endpoint
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    """
+    Counts a request that ended in an unhandled error as a 500 (after_request
+    functions don't run when the error propagates) and stops sampling it.
+    """
+    if exc is not None and 'request_started' in g:
+        count_request(500)
+    if g.pop('profiling', False):
+        get_profiler(app.config['PROFILE_INTERVAL']).end()
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses large JSON responses for clients that accept br/gzip.
+    Streamed responses (NDJSON) are passed through as they are produced.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in ('application/json', 'application/x-ndjson')):
+        return response
+    body = response.get_data()
+    if len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding, app.config['COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def storage():
+    """
+    Returns the configured storage backend (see utils.storage).
+    """
+    if app.config['STORAGE_BACKEND'] == 'sqlite':
+        return SQLiteBackend(app.config['SQLITE_DB'])
+    return CSVBackend(app.config['INVENTORY_FILE'], app.config['ORDERS_FILE'],
+                      compact_records=app.config['JOURNAL_COMPACT_RECORDS'],
+                      compact_interval=app.config['JOURNAL_COMPACT_INTERVAL'],
+                      binary_snapshot=app.config['BINARY_SNAPSHOT'])
+
+def inventory_store():
+    """
+    Returns the shared in-memory store for the configured inventory.
+    Frames it returns are shared between requests: treat them as read-only
+    and change products through the store's upsert/adjust/sync methods.
+    """
+    return storage().inventory_store()
+
+def barcode_lookup_cache():
+    """
+    Returns the shared persistent cache for external barcode lookups.
+    """
+    return get_lookup_cache(app.config['LOOKUP_CACHE_FILE'],
+                            ttl=app.config['LOOKUP_CACHE_TTL'],
+                            negative_ttl=app.config['LOOKUP_CACHE_NEGATIVE_TTL'],
+                            max_entries=app.config['LOOKUP_CACHE_MAX_ENTRIES'])
+
+def analysis_cache():
+    """
+    Returns the shared on-disk cache of /analyze results.
+    """
+    return get_result_cache(app.config['ANALYSIS_CACHE_DIR'],
+                            max_bytes=app.config['ANALYSIS_CACHE_MAX_BYTES'])
+
+def image_store():
+    """
+    Returns the shared store of uploaded product images.
+    """
+    return get_image_store(app.config['UPLOAD_FOLDER'], '/images/products',
+                           workers=app.config['IMAGE_WORKERS'],
+                           max_bytes=app.config['IMAGE_MAX_BYTES'])
+
+def cache_remote_image(barcode, url):
+    """
+    With IMAGE_CACHE_REMOTE, copies a product's external image_url into the
+    image store in the background and points the product at the copy
+    (unless its image_url has changed meanwhile).
+    """
+    if not app.config['IMAGE_CACHE_REMOTE'] or not str(url).startswith(('http://', 'https://')):
+        return
+    store = inventory_store()
+    def localize(local_url):
+        product = store.get(barcode)
+        if product is not None and product.get('image_url') == url:
+            store.upsert({'barcode': barcode, 'image_url': local_url})
+    image_store().fetch_later(url, localize)
+
+def order_store():
+    """
+    Returns the shared order store of the configured backend.
+    """
+    return storage().order_store()
+
+def history_store():
+    """
+    Returns the shared stock-history store.
+    """
+    return get_history_store(app.config['HISTORY_DB'], legacy_csv=app.config['HISTORY_LEGACY_CSV'],
+                             fsync=app.config['HISTORY_FSYNC'])
+
+def history_writer():
+    """
+    Returns the background writer that batches stock-history events.
+    """
+    return get_history_writer(history_store(),
+                              batch_size=app.config['HISTORY_BATCH_SIZE'],
+                              flush_interval=app.config['HISTORY_FLUSH_INTERVAL'])
+
+def history_rollups(max_age=None):
+    """
+    Returns the stock-history rollups, caught up with scans logged more than
+    max_age seconds ago (all of them if None).
+    """
+    rollups = get_history_rollups(history_store())
+    if max_age is None:
+        # Scans logged just before must be counted
+        history_writer().flush(timeout=app.config['HISTORY_FLUSH_INTERVAL'] * 5)
+        rollups.update()
+    else:
+        rollups.refresh(max_age)
+    return rollups
+
+def product_usage():
+    """
+    Returns average daily consumption by normalized barcode, from rollups at
+    most HISTORY_ROLLUP_INTERVAL seconds behind.
+    """
+    return history_rollups(app.config['HISTORY_ROLLUP_INTERVAL']).usage(app.config['REORDER_USAGE_DAYS'])
+
+# Query parameters of /inventory/count that are not column filters
+LISTING_PARAMS = {'offset', 'limit', 'cursor', 'fields', 'sort', 'low_stock', 'format'}
+
 @app.route('/inventory/count', methods=['GET'])
 def inventory_count():
     """
-    Returns the entire inventory as a JSON list of product dictionaries.
+    Returns the inventory as a JSON list of product dictionaries.
     Handles NaN values by replacing them with empty strings.
+
+    Without parameters the whole list is returned, as before. Otherwise:
+    - 'limit' and 'offset', or 'cursor' (the 'next_cursor' of the previous
+      page), page through the products; the response is then
+      {'items', 'total', 'offset', 'limit', 'next_cursor', 'version'}
+    - 'fields' (comma-separated) projects the columns returned
+    - 'sort' orders by a column, '-column' descending
+    - any other column name filters on that value (e.g. category=Snacks);
+      'low_stock=1' keeps products at or below their (non-zero) threshold
+    - 'format=ndjson' streams every matching product as one JSON line each
+
+    Responses carry an ETag tied to the inventory version, so a client
+    revalidating with If-None-Match gets a 304 while nothing changed.
+    """
+    store = inventory_store()
+    etag = store.etag()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    columns = store.columns()
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or None
+    sort = request.args.get('sort', '').strip() or None
+    descending = bool(sort) and sort.startswith('-')
+    if descending:
+        sort = sort[1:]
+    unknown = [c for c in (fields or []) + ([sort] if sort else []) if c not in columns]
+    filters = {k: v for k, v in request.args.items() if k not in LISTING_PARAMS}
+    unknown += [c for c in filters if c not in columns]
+    if unknown:
+        return jsonify({'error': f"Unknown column(s): {', '.join(unknown)}"}), 400
+    selection = dict(fields=fields, filters=filters, sort=sort, descending=descending,
+                     low_stock=request.args.get('low_stock', '').lower() in ('1', 'true', 'yes'))
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            # One line per product, produced chunk by chunk
+            for chunk in store.iter_products(**selection):
+                yield frame_json(chunk, lines=True)
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    elif not request.args:
+        # Legacy full listing
+        _, items, _ = store.list_products()
+        response = json_response(frame_json(items))
+    else:
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        cursor = request.args.get('cursor', type=int)
+        if (limit is not None and limit <= 0) or offset < 0:
+            return jsonify({'error': 'limit must be positive and offset non-negative.'}), 400
+        total, items, next_cursor = store.list_products(offset=offset, limit=limit, after=cursor, **selection)
+        response = json_response(records_json(items, {'total': total, 'offset': offset, 'limit': limit,
+                                                      'next_cursor': next_cursor, 'version': store.version}))
+    response.set_etag(etag, weak=True)
+    # Let browsers keep the listing but revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/inventory/changes', methods=['GET'])
+def inventory_changes():
+    """
+    Follows inventory changes instead of refetching the catalog: a stream of
+    server-sent events, one per changed row (see ChangeFeed for the types),
+    each with a '<epoch>-<version>' id.
+
+    A client that reconnects (EventSource sends Last-Event-ID by itself, or
+    pass 'since') first gets the events it missed; when those are no longer
+    available it gets a 'reset' event and should refetch. A new connection
+    starts with a 'hello' event carrying the current version: fetch the
+    catalog after it, events that overlap the fetch are harmless to apply.
+
+    With 'wait' (seconds) it answers as a long poll instead: JSON
+    {'epoch', 'version', 'reset', 'events'} as soon as there are events after
+    'since', or when wait runs out.
     """
-    df = load_inventory(app.config['INVENTORY_FILE'])
-    # Replace NaN with an empty string (or another valid value, like 0 or null)
-    df = df.fillna('')
-    return jsonify(df.to_dict(orient='records'))
+    store = inventory_store()
+    store.frame()
+    feed = store.changes
+    position = feed.position(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    wait = request.args.get('wait', type=float)
+
+    if wait is not None:
+        with feed.listen():
+            if position is not None:
+                feed.wait(position, min(max(wait, 0), app.config['CHANGE_FEED_MAX_SECONDS']))
+                store.frame()
+            events = feed.since(position) if position is not None else None
+            return json_response(dumps({'epoch': feed.epoch, 'version': feed.version,
+                                        'reset': events is None, 'events': events or []}))
+
+    def generate():
+        with feed.listen():
+            version = position
+            if version is None or feed.since(version) is None:
+                version = feed.version
+                yield sse_event({'type': 'hello' if position is None else 'reset', 'version': version}, feed.epoch)
+            yield b"retry: 3000\n\n"
+            deadline = time.monotonic() + app.config['CHANGE_FEED_MAX_SECONDS']
+            last_sent = time.monotonic()
+            while True:
+                # Applies what other workers journaled, which puts it on the feed
+                store.frame()
+                events = feed.since(version)
+                if events is None:
+                    version = feed.version
+                    events = [{'type': 'reset', 'version': version}]
+                for event in events:
+                    yield sse_event(event, feed.epoch)
+                    version = event['version']
+                now = time.monotonic()
+                if events:
+                    last_sent = now
+                elif now - last_sent >= app.config['CHANGE_FEED_KEEPALIVE']:
+                    yield b": keepalive\n\n"
+                    last_sent = now
+                if now >= deadline:
+                    return
+                feed.wait(version, min(app.config['CHANGE_FEED_POLL'], deadline - now))
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies (nginx) from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/inventory/search', methods=['GET'])
 def inventory_search():
     """
-    Searches the inventory based on a query string (barcode, name, or category).
-    Returns a JSON list of matching products, including their image_url.
+    Searches the inventory based on a query string (barcode, or free text over
+    name, category, manufacturer, distributor and description).
+    Returns a JSON list of matching products, including their image_url,
+    ranked by relevance and capped by the optional 'limit' parameter.
     If no query, returns all products.
     """
     q = request.args.get('q', '').strip().lower()
-    df = load_inventory(app.config['INVENTORY_FILE'])
+    limit = request.args.get('limit', 50, type=int)
+    store = inventory_store()
 
     try:
         if not q:
-            return jsonify(df.fillna('').to_dict(orient='records'))
+            return json_response(frame_json(store.frame()))
 
-        # Search by barcode first (exact match for numeric barcodes)
-        # Ensure barcode column is treated as string for consistent comparison
-        if q.isdigit(): # If query is purely numeric, assume it's a barcode
-            results = df[df['barcode'].astype(str) == q]
-            if not results.empty:
-                return jsonify(results.fillna('').to_dict(orient='records'))
+        # Exact barcode match first; the store's barcode index also matches
+        # EAN-8/UPC-A/EAN-13/GTIN-14 variants and MANUAL_ codes
+        idx = store.find(q)
+        if idx is not None:
+            return json_response(frame_json(store.rows([idx])))
 
-        # If not found by exact barcode, or query is not numeric, search by name (contains)
-        # Fallback to searching by name if barcode lookup fails or query is not a barcode
-        results = df[df['name'].str.lower().str.contains(q, na=False)]
-        return jsonify(results.fillna('').to_dict(orient='records'))
+        # Otherwise rank products with the full-text index (prefix and typo tolerant)
+        labels = store.search(q, limit=limit)
+        return json_response(frame_json(store.rows(labels)))
 
     except Exception as e:
         app.logger.error(f"Error in inventory_search: {e}", exc_info=True)
@@ -103,15 +542,13 @@ def inventory_add():
     if 'product_image' in request.files:
         file = request.files['product_image']
         if file.filename != '': # Check if a file was actually sent
-            filename = secure_filename(f"{uuid.uuid4().hex}_{file.filename}") # Generate unique name
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
             try:
-                file.save(filepath)
-                image_url = f"/static/images/products/{filename}"
-                print(f"Server: Image saved to {filepath}, URL: {image_url}")
+                # Named by content hash: the same photo uploaded again reuses the file
+                image_url = image_store().url(image_store().save(file.stream))
+                app.logger.debug(f"Image saved, URL: {image_url}")
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             except Exception as e:
-                print(f"Server: Error saving image file: {e}")
                 app.logger.error(f"Error saving image file: {e}", exc_info=True)
                 # Keep image_url as empty string on save error
     
@@ -123,64 +560,142 @@ def inventory_add():
     if 'barcode' not in product_data or not product_data['barcode']:
         product_data['barcode'] = f"MANUAL_{int(time.time())}"
 
-    # Load inventory using your utility function
-    df = load_inventory(app.config['INVENTORY_FILE'])
-
     try:
-        # Check if product exists by barcode (case-insensitive for robustness)
-        existing_product_df = df[df['barcode'].astype(str).str.lower() == str(product_data['barcode']).lower()]
-
-        if not existing_product_df.empty:
-            # Update existing product
-            idx = existing_product_df.index[0]
-            # Iterate through product_data to update fields
-            for key, value in product_data.items():
-                if key in df.columns: # Only update if column exists in DataFrame
-                    if key in ['quantity', 'threshold']:
-                        df.at[idx, key] = int(value) if value else 0
-                    elif key in ['cost', 'price']:
-                        df.at[idx, key] = float(value) if value else 0.0
-                    else:
-                        df.at[idx, key] = str(value) if value is not None else ''
-            print(f"Server: Product {product_data['barcode']} updated. New image_url: {product_data['image_url']}")
-
+        # Update the product if its barcode is already known (the store's barcode
+        # index matches case-insensitively and across EAN/UPC forms), else add it
+        created = inventory_store().upsert(product_data)
+        if created:
+            app.logger.info(f"New product {product_data['barcode']} added. Image_url: {product_data['image_url']}")
         else:
-            # Add new product
-            new_product_row = {
-                'barcode': str(product_data.get('barcode')),
-                'name': str(product_data.get('name', '')),
-                'category': str(product_data.get('category', 'Uncategorized')),
-                'quantity': int(product_data.get('quantity', 0)),
-                'cost': float(product_data.get('cost', 0.0)),
-                'price': float(product_data.get('price', 0.0)),
-                'expiry': str(product_data.get('expiry', '')),
-                'threshold': int(product_data.get('threshold', 0)),
-                'distributor': str(product_data.get('distributor', '')),
-                'manufacturer': str(product_data.get('manufacturer', '')),
-                'synced': bool(product_data.get('synced', False)),
-                'image_url': str(product_data.get('image_url', '')),
-                'description': str(product_data.get('description', ''))
-            }
-            # Ensure all columns exist in the new row DataFrame, add missing ones with default empty values
-            new_product_df = pd.DataFrame([new_product_row], columns=df.columns if not df.empty else list(new_product_row.keys()))
-            df = pd.concat([df, new_product_df], ignore_index=True)
-            print(f"Server: New product {product_data['barcode']} added. Image_url: {product_data['image_url']}")
-
-        save_inventory(app.config['INVENTORY_FILE'], df) # Save using your utility function
+            app.logger.info(f"Product {product_data['barcode']} updated. New image_url: {product_data['image_url']}")
+        cache_remote_image(product_data['barcode'], product_data['image_url'])
+
         return jsonify({'status': 'ok', 'message': 'Product added/updated successfully.'})
 
     except Exception as e:
         app.logger.error(f"Error adding/updating product: {e}", exc_info=True) # Log full traceback
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/inventory/add/batch', methods=['POST'])
+def inventory_add_batch():
+    """
+    Adds or updates many products in one request (e.g. a pallet of receipts).
+    Expects JSON {"products": [...]} (or a bare list) of product dicts keyed by
+    barcode; a product may carry an 'adjustment' to add to its quantity.
+    All rows go into the inventory as one write.
+    """
+    data = request.json or {}
+    products = data if isinstance(data, list) else data.get('products', [])
+    if not isinstance(products, list) or not products:
+        return jsonify({'error': 'A non-empty list of products is required.'}), 400
+    if len(products) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_ITEMS']} products per batch."}), 413
+
+    # Products without a barcode can't be matched or received; report their positions
+    rejected, valid = [], []
+    for i, p in enumerate(products):
+        if isinstance(p, dict) and str(p.get('barcode') or '').strip():
+            valid.append(p)
+        else:
+            rejected.append(i)
+    try:
+        results = inventory_store().upsert_many(valid) if valid else []
+        for p in valid:
+            if p.get('image_url'):
+                cache_remote_image(str(p['barcode']), p['image_url'])
+        created = sum(1 for r in results if r['created'])
+        return json_response(dumps({
+            'status': 'ok',
+            'created': created,
+            'updated': len(results) - created,
+            'rejected': rejected,
+            'results': results,
+        }))
+    except Exception as e:
+        app.logger.error(f"Error in batch add: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
     
+@app.route('/images/products/<name>')
+def product_image(name):
+    """
+    Serves an uploaded product image; ?size=thumb or ?size=display serves its
+    resized variant. Content-hashed files never change, so they are cached as
+    immutable; an original standing in for a variant that is still being made
+    is only cached briefly.
+    """
+    store = image_store()
+    size = request.args.get('size')
+    served = store.resolve(name, size)
+    standing_in = store.resizing and size in store.variants and served == name
+    final = HASHED_NAME.match(served) is not None and not standing_in
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], served,
+                                   max_age=app.config['IMAGE_MAX_AGE'] if final else 60)
+    if final:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+@app.route('/images/stats')
+def image_stats():
+    """
+    Returns counters of the product image store.
+    """
+    return jsonify(image_store().stats())
+
+@app.route('/inventory/import', methods=['POST'])
+def inventory_import():
+    """
+    Merges a product file ('file': CSV, TSV, XLSX or JSON) into the inventory
+    by barcode: known products get the file's non-empty values, new ones are
+    added. Columns are recognized by name (IMPORT_COLUMN_ALIASES), values
+    validated column by column, and everything is written as one snapshot.
+    With ?dry_run=1 nothing is written. Returns inserted/updated/rejected
+    counts and the first rejected rows.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided.'}), 400
+    f = request.files['file']
+    name = secure_filename(f.filename.lower())
+    if not name.endswith(IMPORT_EXTS):
+        return jsonify({'error': f"Unsupported file type; use one of {', '.join(IMPORT_EXTS)}."}), 400
+    try:
+        df = read_table(f.stream, name)
+    except Exception as e:
+        app.logger.error(f"Error reading import file: {e}", exc_info=True)
+        return jsonify({'error': f"Could not read the file: {e}"}), 400
+    if len(df) > app.config['IMPORT_MAX_ROWS']:
+        return jsonify({'error': f"At most {app.config['IMPORT_MAX_ROWS']} rows per import."}), 413
+    mapping = map_import_columns(df.columns)
+    if 'barcode' not in mapping.values():
+        return jsonify({'error': 'No barcode column found.', 'columns': [str(c) for c in df.columns]}), 400
+
+    rows, errors = coerce_import(df[list(mapping)].rename(columns=mapping))
+    try:
+        inserted = updated = 0
+        if len(rows) and not request.args.get('dry_run'):
+            inserted, updated = inventory_store().merge(rows)
+        return jsonify({
+            'status': 'ok',
+            'rows': len(df),
+            'inserted': inserted,
+            'updated': updated,
+            'rejected': len(errors),
+            'errors': errors[:app.config['IMPORT_MAX_ERRORS']],
+            'columns': {str(k): v for k, v in mapping.items()},
+        })
+    except Exception as e:
+        app.logger.error(f"Error importing products: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/inventory/categories', methods=['GET'])
 def inventory_categories():
     """
     Returns a JSON list of unique categories present in the inventory.
     """
     try:
-        df = load_inventory(app.config['INVENTORY_FILE'])
+        df = inventory_store().frame()
         categories = df['category'].dropna().unique().tolist()
         # Remove empty categories and sort
         categories = [cat for cat in categories if cat.strip()]
@@ -194,23 +709,100 @@ def inventory_categories():
 @app.route('/inventory/alerts', methods=['GET'])
 def inventory_alerts():
     """
-    Returns a JSON object containing different types of inventory alerts (expiry, understock, overstock).
+    Returns a JSON object containing different types of inventory alerts (expiry, understock, overstock,
+    and reorder for products forecast to run out within REORDER_DAYS at their recent usage).
+    Served from the store's precomputed alert index rather than a scan of the inventory.
+    """
+    return json_response(dumps(inventory_store().alerts(
+        expiry_windows=app.config['ALERT_EXPIRY_WINDOWS'],
+        overstock_multiplier=app.config['ALERT_OVERSTOCK_MULTIPLIER'],
+        usage=product_usage(),
+        reorder_days=app.config['REORDER_DAYS'],
+    )))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Returns request counts, latency/size histograms and stage timings in the
+    Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/summary')
+def metrics_summary():
+    """
+    Returns the same metrics as JSON, with estimated p50/p95/p99 per histogram.
     """
-    df = load_inventory(app.config['INVENTORY_FILE'])
-    return jsonify(get_alerts(df))
+    return jsonify(metrics.summary())
+
+@app.route('/inventory/store-stats', methods=['GET'])
+def inventory_store_stats():
+    """
+    Returns hit/miss/reload counters of the in-memory inventory store.
+    """
+    return jsonify(inventory_store().stats())
 
 @app.route('/inventory/order', methods=['POST'])
 def inventory_order():
     """
     Handles placing an order.
+    The order is appended to the order log under a new time-ordered, unique ID.
     """
     data = request.json or {}
-    order = create_order(data)
-    df = load_orders(app.config['ORDERS_FILE'])
-    df = pd.concat([df, pd.DataFrame([order])], ignore_index=True)
-    save_orders(app.config['ORDERS_FILE'], df)
+    order = order_store().place([data])[0]
     return jsonify({'status':'ok','order': order})
 
+@app.route('/inventory/orders/batch', methods=['POST'])
+def inventory_orders_batch():
+    """
+    Places a multi-line purchase order. Expects JSON {"lines": [{"barcode", "quantity"}, ...]}
+    and an optional "po_id"; all lines are appended with one write and share the po_id.
+    """
+    data = request.json or {}
+    lines = data if isinstance(data, list) else data.get('lines', [])
+    if not isinstance(lines, list) or not lines:
+        return jsonify({'error': 'A non-empty list of order lines is required.'}), 400
+    if len(lines) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_ITEMS']} lines per order."}), 413
+    invalid = [i for i, line in enumerate(lines)
+               if not isinstance(line, dict) or not str(line.get('barcode') or '').strip()
+               or parse_quantity(line.get('quantity')) is None or parse_quantity(line.get('quantity')) <= 0]
+    if invalid:
+        return jsonify({'error': 'Every line needs a barcode and a positive quantity.', 'invalid': invalid}), 400
+    po_id = data.get('po_id') if isinstance(data, dict) else None
+    orders = order_store().place(lines, po_id=po_id)
+    return jsonify({'status': 'ok', 'po_id': orders[0]['po_id'], 'orders': orders})
+
+@app.route('/inventory/orders', methods=['GET'])
+def inventory_orders():
+    """
+    Lists orders, oldest first, filtered by optional 'barcode' (any EAN/UPC form),
+    'status' and 'open=1' (not yet received). 'limit' keeps the most recent N.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
+    orders = order_store().query(
+        barcode=request.args.get('barcode'),
+        status=request.args.get('status'),
+        open_only=request.args.get('open', '').lower() in ('1', 'true', 'yes'),
+        limit=limit,
+    )
+    return json_response(dumps(orders))
+
+@app.route('/inventory/orders/<order_id>/status', methods=['POST'])
+def inventory_order_status(order_id):
+    """
+    Sets an order's status (e.g. 'received', 'cancelled'). Expects JSON {"status": ...}.
+    """
+    status = str((request.json or {}).get('status') or '').strip()
+    if not status:
+        return jsonify({'error': 'status is required.'}), 400
+    order = order_store().set_status(order_id, status)
+    if order is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify({'status': 'ok', 'order': order})
+
 @app.route('/inventory/sync', methods=['POST'])
 def inventory_sync():
     """
@@ -218,13 +810,8 @@ def inventory_sync():
     """
     data = request.json or {}
     barcode = data.get('barcode')
-    df = load_inventory(app.config['INVENTORY_FILE'])
-    idx = df.index[df['barcode']==barcode]
-    if len(idx)==0:
+    if not inventory_store().set_synced(barcode):
         return jsonify({'error':'not found'}),404
-    i=idx[0]
-    df.at[i,'synced']='True'
-    save_inventory(app.config['INVENTORY_FILE'], df)
     return jsonify({'status':'synced','barcode':barcode})
 
 @app.route('/analyze', methods=['POST'])
@@ -239,30 +826,42 @@ def analyze():
         return jsonify({'error':'No selected file or unsupported'}),400
     
     name = secure_filename(f.filename.lower())
-    content = f.read()
-    
-    # Excel
-    if name.endswith(('.xls','xlsx')):
-        df = pd.read_excel(io.BytesIO(content))
-    # JSON
-    elif name.endswith('.json'):
-        df = pd.read_json(io.BytesIO(content))
-    # TSV
-    elif name.endswith('.tsv'):
-        df = pd.read_csv(io.StringIO(content.decode('utf-8','ignore')), sep='\t')
-    # CSV
-    else:
-        for enc in ['utf-8','latin1','ISO-8859-1','cp1252','utf-16']:
-            try:
-                df = pd.read_csv(io.StringIO(content.decode(enc)))
-                break
-            except:
-                continue
-        else:
-            return jsonify({'error':'Failed to decode'}),400
-    
-    results = process_data(df)
-    return jsonify(results)
+    # The upload is hashed while it is spooled to a temporary file; an upload
+    # seen before is answered from the result cache without parsing it again
+    spool, content_hash = spool_and_hash(f.stream)
+    with spool:
+        cache = analysis_cache()
+        # Only the format affects the result (chunking and workers don't)
+        key = cache.key(content_hash, format=name.rsplit('.', 1)[-1], version=ANALYSIS_VERSION)
+        results = cache.get(key)
+        if results is not None:
+            response = jsonify(results)
+            response.headers['X-Analysis-Cache'] = 'hit'
+            return response
+        # Parsed and aggregated in chunks, so memory doesn't grow with the file size
+        try:
+            results = analyze_file(spool, name,
+                                   chunk_rows=app.config['ANALYSIS_CHUNK_ROWS'],
+                                   workers=app.config['ANALYSIS_WORKERS'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            app.logger.error(f"Error analyzing {name}: {e}", exc_info=True)
+            return jsonify({'error': 'Failed to parse file'}), 400
+    try:
+        cache.put(key, results)
+    except OSError as e:
+        app.logger.error(f"Error caching analysis of {name}: {e}", exc_info=True)
+    response = jsonify(results)
+    response.headers['X-Analysis-Cache'] = 'miss'
+    return response
+
+@app.route('/analyze/cache-stats')
+def analyze_cache_stats():
+    """
+    Returns size and hit/miss counters of the /analyze result cache.
+    """
+    return jsonify(analysis_cache().stats())
 
 @app.route('/sample', methods=['GET'])
 def sample():
@@ -297,63 +896,85 @@ def api_barcode_lookup(barcode_val):
     Provides dummy data for specific barcodes or a 'not found' response.
     Includes fallback to local inventory if not found externally.
     """
-    # First try public databases (using your utils.barcode.lookup_barcode)
-    result = lookup_barcode(barcode_val)
+    # First try public databases (using your utils.barcode.lookup_barcode);
+    # repeat scans are answered from the lookup cache without a network call
+    result = lookup_barcode(barcode_val, cache=barcode_lookup_cache(),
+                            deadline=app.config['LOOKUP_DEADLINE'],
+                            hedge_delay=app.config['LOOKUP_HEDGE_DELAY'])
     if result and result.get('name'):
         # If found, return the result
         return jsonify(result)
     
     # If not found in public databases, check local inventory
-    df = load_inventory(app.config['INVENTORY_FILE'])
-    # Ensure barcode column is string for consistent comparison
-    product = df[df['barcode'].astype(str) == barcode_val] 
-    if not product.empty:
+    product = inventory_store().get(barcode_val)
+    if product is not None:
         # If found in local inventory, return its details
-        return jsonify(product.iloc[0].to_dict())
+        return jsonify(product)
     
     # If not found anywhere
     return jsonify({"message": "Product not found"}), 404
 
 
+@app.route('/api/barcode/batch', methods=['POST'])
+def api_barcode_batch():
+    """
+    Resolves a list of scanned barcodes (JSON {"barcodes": [...]}) for bulk receiving.
+    Codes already in the local inventory are answered from one index pass; only
+    the misses go to the external databases, concurrently. Results are streamed
+    as NDJSON lines {"barcode", "source", "product"} as they complete, where
+    source is "inventory", "external" or null (not found).
+    """
+    data = request.json or {}
+    barcodes = list(dict.fromkeys(str(b).strip() for b in data.get('barcodes', []) if str(b).strip()))
+    if not barcodes:
+        return jsonify({'error': 'A non-empty list of barcodes is required.'}), 400
+    if len(barcodes) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_ITEMS']} barcodes per batch."}), 413
+
+    local = inventory_store().get_many(barcodes)
+    misses = [b for b in barcodes if b not in local]
+    cache = barcode_lookup_cache()
+    deadline, hedge_delay = app.config['LOOKUP_DEADLINE'], app.config['LOOKUP_HEDGE_DELAY']
+
+    def generate():
+        for barcode, product in local.items():
+            yield dumps({'barcode': barcode, 'source': 'inventory', 'product': product}) + b'\n'
+        for barcode, product in lookup_barcodes(misses, cache=cache, deadline=deadline, hedge_delay=hedge_delay):
+            source = 'external' if product and product.get('name') else None
+            yield dumps({'barcode': barcode, 'source': source, 'product': product if source else None}) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/barcode/cache-stats')
+def api_barcode_cache_stats():
+    """
+    Returns size and hit/miss counters of the external barcode lookup cache.
+    """
+    return jsonify(barcode_lookup_cache().stats())
+
+
 @app.route('/inventory/adjust-stock', methods=['POST'])
 def adjust_stock():
     """
     Adjusts the quantity of a product based on its barcode.
     Expects JSON input with 'barcode' and 'adjustment' (integer).
-    Logs adjustment to stock_history.csv.
+    Logs the new stock level to the stock history.
     """
     try:
         data = request.json
         barcode = str(data.get('barcode')) # Ensure barcode is string
         adjustment = int(data.get('adjustment', 0))
         
-        df = load_inventory(app.config['INVENTORY_FILE']) # Use your util function
-
-        # Check if the product exists using string comparison
-        if barcode not in df['barcode'].astype(str).values:
+        # Updates the quantity in place (floored at 0) via the store's barcode index
+        new_qty = inventory_store().adjust_quantity(barcode, adjustment)
+        if new_qty is None:
             return jsonify({
                 'status': 'error',
                 'message': f'Product with barcode {barcode} not found. Add it first.'
             }), 404
         
-        # Find and update the product's quantity:
-        # Use .loc for safe label-based indexing
-        idx = df.index[df['barcode'].astype(str) == barcode].tolist()[0]
-        
-        # Convert to int, handle potential NaN or non-numeric values
-        current_qty_str = df.at[idx, 'quantity']
-        current_qty = int(current_qty_str) if pd.notna(current_qty_str) and str(current_qty_str).isdigit() else 0
-        
-        new_qty = max(0, current_qty + adjustment)
-        df.at[idx, 'quantity'] = str(new_qty) # Store back as string for CSV compatibility
-        
-        save_inventory(app.config['INVENTORY_FILE'], df)
-        
-        # Ensure the "data" folder exists before writing stock history
-        os.makedirs("data", exist_ok=True)
-        with open("data/stock_history.csv", mode="a", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow([barcode, datetime.now().isoformat(), new_qty])
+        history_writer().submit([(barcode, datetime.now().isoformat(), new_qty)])
         
         return jsonify({
             'status': 'success',
@@ -368,6 +989,37 @@ def adjust_stock():
             'message': str(e)
         }), 500
 
+@app.cli.command('migrate-sqlite')
+@click.option('--db', default=None, help="Target database (default: SQLITE_DB).")
+def migrate_sqlite(db):
+    """
+    Copies the CSV inventory (including unfolded journal records) and order
+    log into the SQLite database, replacing its contents. Afterwards set
+    STORAGE_BACKEND = 'sqlite'.
+    """
+    db = db or app.config['SQLITE_DB']
+    products, orders, dropped = migrate_csv(app.config['INVENTORY_FILE'], app.config['ORDERS_FILE'], db)
+    click.echo(f"Migrated {products} products and {orders} orders into {db}")
+    if dropped:
+        click.echo(f"Columns not in the schema were left out: {', '.join(dropped)}")
+
+@app.cli.command('cache-images')
+def cache_images():
+    """
+    Copies every product's external image_url into the image store and
+    points the product at the local copy.
+    """
+    store = inventory_store()
+    df = store.frame()
+    remote = df.loc[df['image_url'].astype(str).str.match(r'https?://'), ['barcode', 'image_url']]
+    cached = 0
+    for barcode, url in zip(remote['barcode'], remote['image_url']):
+        name = image_store().fetch(url)
+        if name is not None:
+            store.upsert({'barcode': barcode, 'image_url': image_store().url(name)})
+            cached += 1
+    click.echo(f"Cached {cached} of {len(remote)} external images")
+
 @app.route('/')
 def index():
     """Renders the main index.html template."""
@@ -394,39 +1046,47 @@ def notebook_demo():
 @app.route('/inventory/stock-history', methods=['GET'])
 def stock_history():
     """
-    Retrieves stock history for a given barcode from stock_history.csv.
+    Retrieves stock history for a given barcode, oldest first.
+    Optional 'since'/'until' (inclusive ISO dates or timestamps) narrow the range;
+    'limit' keeps only the most recent N entries. With 'bucket' (hour, day or week)
+    one entry per bucket is returned instead of every scan: the level at its end,
+    its low/high, net change and units consumed.
     """
     barcode = request.args.get('barcode')
     if not barcode:
         return jsonify({'error': 'Barcode parameter is required.'}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
 
-    history = []
-    # Check if the history file exists
-    if os.path.exists("data/stock_history.csv"):
-        with open("data/stock_history.csv", mode="r", newline="") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                # Expect each row to have at least 3 fields: barcode, date, quantity
-                if len(row) >= 3 and row[0] == barcode:
-                    try:
-                        history.append({
-                            'date': row[1],
-                            'quantity': int(row[2])
-                        })
-                    except Exception as e:
-                        # If a conversion error occurs, skip this row.
-                        app.logger.error(f"Error reading stock history row: {row}. Error: {e}")
-                        continue
-    # Optionally sort the history by date
-    history.sort(key=lambda x: x['date'])
+    bucket = request.args.get('bucket')
+    if bucket:
+        try:
+            return jsonify(history_rollups().query(
+                barcode,
+                bucket=bucket,
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                limit=limit,
+            ))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
+    # Scans logged just before (e.g. by showProductDetails) must be visible
+    history_writer().flush(timeout=app.config['HISTORY_FLUSH_INTERVAL'] * 5)
+    history = history_store().query(
+        barcode,
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        limit=limit,
+    )
     return jsonify(history)
 
 
 @app.route('/inventory/log-scan', methods=['POST'])
 def log_scan():
     """
-    Logs barcode scans to stock_history.csv.
+    Logs barcode scans (the product's current stock level) to the stock history.
     """
     try:
         data = request.json
@@ -436,19 +1096,84 @@ def log_scan():
         if not barcode or current_qty is None:
             return jsonify({'status': 'error', 'message': 'Both barcode and current_qty are required.'}), 400
 
-        # Append the log entry to our CSV file:
-        # Ensure the "data" folder exists first.
-        os.makedirs("data", exist_ok=True)
-        with open("data/stock_history.csv", mode="a", newline="") as file:
-            writer = csv.writer(file)
-            # Log the barcode, current timestamp, and current quantity.
-            writer.writerow([barcode, datetime.now().isoformat(), current_qty])
+        if parse_quantity(current_qty) is None:
+            return jsonify({'status': 'error', 'message': 'current_qty must be a number.'}), 400
+
+        # Queue the barcode, current timestamp, and current quantity for the history writer.
+        history_writer().submit([(barcode, datetime.now().isoformat(), current_qty)])
         
         return jsonify({'status': 'success', 'message': 'Scan logged successfully'})
     except Exception as e:
         app.logger.error(f"Error logging scan: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': str(e)}), 500
-    
+
+
+
+@app.route('/inventory/log-scan/batch', methods=['POST'])
+def log_scan_batch():
+    """
+    Logs many scans at once, e.g. from a scanner that buffered them offline.
+    Expects JSON {"scans": [{"barcode", "current_qty", "timestamp"?}, ...]};
+    scans without a timestamp are stamped with the time of the request. Scans whose
+    timestamp is not an ISO 8601 date or timestamp are rejected (listed by index).
+    """
+    data = request.json or {}
+    scans = data if isinstance(data, list) else data.get('scans', [])
+    if not isinstance(scans, list) or not scans:
+        return jsonify({'status': 'error', 'message': 'A non-empty list of scans is required.'}), 400
+
+    now = datetime.now().isoformat()
+    events, rejected = [], []
+    for i, scan in enumerate(scans):
+        if not isinstance(scan, dict) or not scan.get('barcode') or parse_quantity(scan.get('current_qty')) is None:
+            rejected.append(i)
+            continue
+        timestamp = parse_timestamp(scan['timestamp']) if scan.get('timestamp') else now
+        if timestamp is None:
+            rejected.append(i)
+            continue
+        events.append((scan['barcode'], timestamp, scan['current_qty']))
+    history_writer().submit(events)
+    return jsonify({'status': 'success', 'accepted': len(events), 'rejected': rejected})
+
+
+@app.route('/inventory/forecast', methods=['GET'])
+def stock_forecast():
+    """
+    Returns each product's average daily usage over the last REORDER_USAGE_DAYS
+    and how many days its current stock lasts at that rate, soonest stockout
+    first. 'barcode' narrows it to one product; 'limit' caps the list.
+    Products without recorded consumption are left out.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
+    usage = product_usage()
+    barcode = request.args.get('barcode')
+    if barcode:
+        usage = usage[usage.index == normalize_barcode(barcode)]
+    forecast = []
+    for key, product in inventory_store().get_many(list(usage.index)).items():
+        daily_usage = usage[key]
+        quantity = max(parse_quantity(product.get('quantity')) or 0, 0)
+        forecast.append({
+            'barcode': product['barcode'],
+            'name': product.get('name', ''),
+            'quantity': quantity,
+            'daily_usage': round(float(daily_usage), 2),
+            'days_to_stockout': round(quantity / daily_usage, 1),
+        })
+    forecast.sort(key=lambda item: item['days_to_stockout'])
+    return jsonify(forecast[:limit] if limit else forecast)
+
+
+@app.route('/inventory/history-writer-stats', methods=['GET'])
+def history_writer_stats():
+    """
+    Returns queue and batch counters of the background stock-history writer.
+    """
+    return jsonify(history_writer().stats())
+
 
 if __name__ == '__main__':
     # Ensure data folder exists at startup
@@ -0,0 +1,85 @@
+"""
+Compares two bench.load reports, e.g. of the main branch and of a change:
+
+    python -m bench.compare reports/main.json reports/change.json --threshold 0.15
+
+Prints the relative change of throughput and latency percentiles per
+scenario. A scenario regresses when its p50 or p95 latency grows, or its
+throughput drops, by more than --threshold (and latency by at least
+--min-ms, so sub-millisecond jitter doesn't count). Exits non-zero if any
+scenario regressed or failed requests, so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+# Settings that must match for the numbers to be comparable
+COMPARABLE = ('mode', 'workers', 'concurrency', 'skus', 'history', 'orders', 'sales', 'seed', 'cpus')
+
+
+def change(before, after):
+    return (after - before) / before if before else 0.0
+
+
+def compare(base, head, threshold=0.15, min_ms=0.5):
+    """Returns [(scenario, {metric: (before, after, change)}, problems)] for the scenarios of both reports."""
+    rows = []
+    for name, new in head['scenarios'].items():
+        old = base['scenarios'].get(name)
+        if old is None:
+            continue
+        metrics = {'throughput_rps': (old['throughput_rps'], new['throughput_rps'],
+                                      change(old['throughput_rps'], new['throughput_rps']))}
+        for q in ('p50', 'p95', 'p99'):
+            before, after = old['latency_ms'][q], new['latency_ms'][q]
+            metrics[q] = (before, after, change(before, after))
+        problems = []
+        if new['errors']:
+            problems.append(f"{new['errors']} errors")
+        if metrics['throughput_rps'][2] < -threshold:
+            problems.append("throughput")
+        for q in ('p50', 'p95'):
+            before, after, relative = metrics[q]
+            if relative > threshold and after - before >= min_ms:
+                problems.append(q)
+        rows.append((name, metrics, problems))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.15)
+    parser.add_argument('--min-ms', type=float, default=0.5)
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    for report, path in ((base, args.base), (head, args.head)):
+        meta = report['meta']
+        print(f"{path}: {(meta.get('commit') or 'unknown')[:12]}{' (dirty)' if meta.get('dirty') else ''}, "
+              f"{meta['date']}, {meta['mode']}")
+    differing = [key for key in COMPARABLE if base['meta'].get(key) != head['meta'].get(key)]
+    if differing:
+        print(f"Warning: the runs differ in {', '.join(differing)}; the numbers may not be comparable")
+
+    rows = compare(base, head, args.threshold, args.min_ms)
+    print(f"{'scenario':16s} {'req/s':>18s} {'p50 ms':>20s} {'p95 ms':>20s} {'p99 ms':>20s}")
+    regressed = 0
+    for name, metrics, problems in rows:
+        cells = [f"{after:9.2f} {relative:+8.1%}" for before, after, relative in metrics.values()]
+        print(f"{name:16s} {cells[0]:>18s} {cells[1]:>20s} {cells[2]:>20s} {cells[3]:>20s}"
+              f"{'  REGRESSED: ' + ', '.join(problems) if problems else ''}")
+        regressed += bool(problems)
+    missing = sorted(set(base['scenarios']) - set(head['scenarios']))
+    if missing:
+        print(f"Not in {args.head}: {', '.join(missing)}")
+    print(f"{regressed} of {len(rows)} scenarios regressed (threshold {args.threshold:.0%})")
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
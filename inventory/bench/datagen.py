@@ -0,0 +1,183 @@
+"""
+Synthetic data at configurable scale: inventory, stock history and orders
+shaped like what the app stores, plus a sales file for /analyze.
+
+Run from the inventory directory:
+
+    python -m bench.datagen --skus 100000 --history 1000000 --orders 20000 --out /tmp/inventory-data
+
+writes inventory.csv, stock_history.sqlite3, orders.csv and sales.csv to
+--out, which can then stand in for data/. The same --seed always gives the
+same files.
+
+Barcodes are mostly EAN-13, then UPC-A, EAN-8 and a few MANUAL_ codes, all
+with valid check digits. Categories, scans and orders follow a Zipf-like
+skew: a handful of categories and best sellers account for most rows.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.history import HistoryStore
+from utils.inventory import enforce_schema, save_inventory
+from utils.orders import ORDER_COLUMNS, save_orders
+
+CATEGORIES = ['Beverages', 'Snacks', 'Dairy', 'Canned Goods', 'Bakery', 'Frozen', 'Household', 'Produce',
+              'Personal Care', 'Cereal', 'Condiments', 'Pasta & Rice', 'Baby', 'Pet Supplies', 'Deli',
+              'Meat', 'Seafood', 'Spices', 'Baking', 'Health', 'Paper Goods', 'Cleaning', 'Candy',
+              'International', 'Wine & Beer', 'Pharmacy', 'Stationery', 'Electronics', 'Seasonal', 'Garden']
+DISTRIBUTORS = ['Sysco', 'McLane', 'Core-Mark', 'US Foods', 'UNFI', '']
+MANUFACTURERS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Soylent', 'Stark', '']
+# Share of EAN-13, UPC-A, EAN-8 and MANUAL_ codes
+BARCODE_MIX = (0.70, 0.20, 0.07, 0.03)
+START = np.datetime64('2024-01-01T00:00:00')
+
+
+def zipf_weights(n, s=1.1):
+    """Probabilities of n ranks falling off as 1 / rank**s."""
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _with_check_digit(bodies, digits):
+    # GS1 check digit: weights 3, 1, 3... from the rightmost body digit
+    total = np.zeros(len(bodies), dtype=np.int64)
+    rest = bodies.copy()
+    for position in range(digits - 1):
+        total += (rest % 10) * (3 if position % 2 == 0 else 1)
+        rest //= 10
+    return bodies * 10 + (10 - total % 10) % 10
+
+
+def synthetic_barcodes(n, rng):
+    """n distinct barcodes in the BARCODE_MIX of formats, as strings."""
+    kinds = rng.choice(len(BARCODE_MIX), size=n, p=BARCODE_MIX)
+    codes = np.empty(n, dtype=object)
+    for kind, digits in ((0, 13), (1, 12), (2, 8)):
+        where = np.flatnonzero(kinds == kind)
+        # Distinct bodies, so every code is unique within its format
+        bodies = rng.choice(10 ** (digits - 1) - 10 ** (digits - 2), size=len(where), replace=False) + 10 ** (digits - 2)
+        codes[where] = pd.Series(_with_check_digit(bodies, digits)).astype(str).str.zfill(digits).to_numpy()
+    where = np.flatnonzero(kinds == 3)
+    codes[where] = [f"MANUAL_{1700000000000 + i}" for i in range(len(where))]
+    return codes
+
+
+def synthetic_inventory(rows, seed=0):
+    """An inventory DataFrame of rows products (same columns and dtypes as load_inventory)."""
+    rng = np.random.default_rng(seed)
+    barcodes = synthetic_barcodes(rows, rng)
+    category = pd.Series(np.take(CATEGORIES, rng.choice(len(CATEGORIES), size=rows, p=zipf_weights(len(CATEGORIES)))))
+    cost = np.round(rng.lognormal(1.2, 0.8, size=rows), 2)
+    names = pd.Series(rng.choice(['Classic', 'Light', 'Family Size', 'Organic', 'Original', 'Zero'], size=rows))
+    return enforce_schema(pd.DataFrame({
+        'barcode': barcodes,
+        'name': (category + ' ' + names + ' #' + pd.Series(np.arange(rows)).astype(str)).to_numpy(),
+        'category': category.to_numpy(),
+        'quantity': rng.integers(0, 500, size=rows),
+        'cost': cost,
+        'price': np.round(cost * rng.uniform(1.1, 2.0, size=rows), 2),
+        'expiry': START + rng.integers(0, 2 * 365, size=rows).astype('timedelta64[D]'),
+        'threshold': rng.integers(0, 25, size=rows),
+        'distributor': rng.choice(DISTRIBUTORS, size=rows),
+        'manufacturer': rng.choice(MANUFACTURERS, size=rows),
+        'synced': rng.random(rows) < 0.5,
+        'image_url': np.where(rng.random(rows) < 0.6, '/images/products/' + pd.Series(barcodes).astype(str) + '.jpg', ''),
+        'description': '',
+    }))
+
+
+def popular(barcodes, size, rng):
+    """size barcodes drawn with a best-seller skew (earlier barcodes more often)."""
+    return np.asarray(barcodes, dtype=object)[rng.choice(len(barcodes), size=size, p=zipf_weights(len(barcodes), 0.9))]
+
+
+def synthetic_history(barcodes, rows, days=180, seed=0):
+    """
+    rows stock-history events (barcode, timestamp, quantity) spread over
+    days from START, oldest first per product: stock runs down a few units per scan
+    and is refilled when it would go negative.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'barcode': popular(barcodes, rows, rng),
+        'ts': START + rng.integers(0, days * 86400, size=rows).astype('timedelta64[s]'),
+    }).sort_values(['barcode', 'ts'], kind='stable', ignore_index=True)
+    used = rng.integers(0, 6, size=rows)
+    restock = 50 + (pd.util.hash_array(df['barcode'].to_numpy()) % 450).astype(np.int64)
+    df['quantity'] = restock - df.assign(used=used).groupby('barcode')['used'].cumsum().to_numpy() % restock
+    df['ts'] = np.datetime_as_string(df['ts'].to_numpy(), unit='s')
+    return df
+
+
+def synthetic_orders(barcodes, rows, seed=0):
+    """rows orders (ORDER_COLUMNS) of popular products, in order ID order."""
+    rng = np.random.default_rng(seed)
+    ms = np.sort(int(START.astype('datetime64[ms]').astype(np.int64)) + rng.integers(0, 180 * 86400000, size=rows))
+    status = rng.choice(['placed', 'received', 'cancelled'], size=rows, p=[0.3, 0.6, 0.1])
+    return pd.DataFrame({
+        'order_id': [f"{m:013d}-{i % 1000:03d}" for i, m in enumerate(ms)],
+        'barcode': popular(barcodes, rows, rng),
+        'quantity': rng.integers(1, 48, size=rows).astype(str),
+        'timestamp': np.datetime_as_string(ms.astype('datetime64[ms]'), unit='s'),
+        'status': status,
+        'po_id': '',
+    }, columns=ORDER_COLUMNS)
+
+
+def synthetic_sales(rows, products=500, seed=0):
+    """A sales export (date, product, quantity, price) of rows lines, as CSV bytes."""
+    rng = np.random.default_rng(seed)
+    product = rng.choice(products, size=rows, p=zipf_weights(products))
+    return pd.DataFrame({
+        'date': np.datetime_as_string(START + rng.integers(0, 365, size=rows).astype('timedelta64[D]'), unit='D'),
+        'product': 'Product ' + pd.Series(product).astype(str),
+        'quantity': rng.integers(1, 10, size=rows),
+        'price': np.round(rng.lognormal(1.5, 0.7, size=rows), 2),
+    }).to_csv(index=False).encode('utf-8')
+
+
+def write_dataset(directory, skus, history=0, orders=0, sales=0, seed=0):
+    """
+    Writes inventory.csv, stock_history.sqlite3, orders.csv and sales.csv
+    (the last three only when asked for rows) to directory. Returns the
+    inventory DataFrame.
+    """
+    os.makedirs(directory, exist_ok=True)
+    inventory = synthetic_inventory(skus, seed)
+    save_inventory(os.path.join(directory, 'inventory.csv'), inventory)
+    barcodes = inventory['barcode'].to_numpy()
+    if history:
+        events = synthetic_history(barcodes, history, seed=seed + 1)
+        store = HistoryStore(os.path.join(directory, 'stock_history.sqlite3'), fsync='off')
+        for start in range(0, len(events), 100_000):
+            store.append_many(events.iloc[start:start + 100_000].itertuples(index=False, name=None))
+    if orders:
+        save_orders(os.path.join(directory, 'orders.csv'), synthetic_orders(barcodes, orders, seed=seed + 2))
+    if sales:
+        with open(os.path.join(directory, 'sales.csv'), 'wb') as f:
+            f.write(synthetic_sales(sales, seed=seed + 3))
+    return inventory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--skus', type=int, default=100000)
+    parser.add_argument('--history', type=int, default=1000000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--sales', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    write_dataset(args.out, args.skus, args.history, args.orders, args.sales, args.seed)
+    print(f"{args.skus} products, {args.history} history rows, {args.orders} orders and "
+          f"{args.sales} sales lines written to {args.out} in {time.perf_counter() - began:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Load benchmark of the API: drives every route with synthetic data and
+reports throughput and latency percentiles per scenario as JSON, so runs
+can be compared between commits (python -m bench.compare).
+
+Run from the inventory directory:
+
+    python -m bench.load --skus 100000 --history 1000000 --requests 300 --output reports/$(git rev-parse --short HEAD).json
+    python -m bench.load --server --workers 4 --concurrency 16 --skus 1000000
+
+By default requests go one at a time through the Flask test client in this
+process, which measures the app's own cost route by route. With --server
+the app runs as --workers forked werkzeug servers sharing one listening
+socket (as gunicorn's workers would) and --concurrency client threads
+drive it over HTTP.
+
+The data (see bench.datagen, same --seed, same data) lives in a temporary
+directory. External barcode lookups are stubbed, so nothing leaves the
+machine. --scenarios runs a subset, e.g. --scenarios search-text,alerts.
+"""
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+
+from bench.datagen import CATEGORIES, popular, synthetic_sales, write_dataset
+
+SOURCE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_WORDS = ['cola', 'organic', 'family', 'chips', 'milk', 'frozen', 'beverage', 'snack', 'zero', 'clasic']
+
+
+def stub_lookup(barcode, cache=None, deadline=None, hedge_delay=None):
+    """Stands in for utils.barcode.lookup_barcode: answers at once, without the network."""
+    return {'barcode': str(barcode), 'name': f"Product {barcode}", 'brand': 'Bench', 'category': 'Snacks',
+            'image_url': '', 'description': ''}
+
+
+def install_stubs(inventory_app):
+    import utils.barcode
+    utils.barcode.lookup_barcode = stub_lookup
+    inventory_app.lookup_barcode = stub_lookup
+
+
+class Workload:
+    """
+    The request each scenario sends next. Scenarios are functions of a
+    random generator returning (method, path, options), where options are
+    'json' or 'file' (name, bytes) for a multipart upload.
+    """
+
+    def __init__(self, inventory, sales, seed=0):
+        self.barcodes = inventory['barcode'].to_numpy()
+        self.sales = sales
+        self.rng = np.random.default_rng(seed)
+        self._uploads = 0
+        self.scenarios = {
+            'search-barcode': lambda rng: ('GET', f"/inventory/search?q={self.barcode(rng)}", {}),
+            'search-text': lambda rng: ('GET', f"/inventory/search?q={rng.choice(SEARCH_WORDS)}&limit=50", {}),
+            'count-page': lambda rng: ('GET', f"/inventory/count?limit=100&offset={rng.integers(0, max(len(self.barcodes) - 100, 1))}", {}),
+            'count-filtered': lambda rng: ('GET', f"/inventory/count?category={rng.choice(CATEGORIES[:10])}&sort=-quantity&limit=100", {}),
+            'count-full': lambda rng: ('GET', '/inventory/count', {}),
+            'alerts': lambda rng: ('GET', '/inventory/alerts', {}),
+            'adjust-stock': lambda rng: ('POST', '/inventory/adjust-stock',
+                                         {'json': {'barcode': self.barcode(rng), 'adjustment': int(rng.choice([-1, 1]))}}),
+            'log-scan': lambda rng: ('POST', '/inventory/log-scan',
+                                     {'json': {'barcode': self.barcode(rng), 'current_qty': int(rng.integers(0, 500))}}),
+            'stock-history': lambda rng: ('GET', f"/inventory/stock-history?barcode={self.barcode(rng)}&limit=200", {}),
+            'stock-history-daily': lambda rng: ('GET', f"/inventory/stock-history?barcode={self.barcode(rng)}&bucket=day", {}),
+            'forecast': lambda rng: ('GET', '/inventory/forecast?limit=100', {}),
+            'barcode-lookup': lambda rng: ('GET', f"/api/barcode/{rng.integers(10**11, 10**12)}", {}),
+            'analyze': lambda rng: ('POST', '/analyze', {'file': ('sales.csv', self.upload())}),
+        }
+
+    def barcode(self, rng):
+        # Scans and lookups favour best sellers, like the history does
+        return popular(self.barcodes, 1, rng)[0]
+
+    def upload(self):
+        # A line of its own makes every upload new to the /analyze result cache
+        self._uploads += 1
+        return self.sales + f"2024-12-31,Bench {self._uploads},1,1.0\n".encode()
+
+    def requests(self, name, count):
+        """The next count requests of scenario name (made up front, so sending them costs nothing extra)."""
+        return [self.scenarios[name](self.rng) for _ in range(count)]
+
+
+def client_sender(flask_app):
+    """send(method, path, options) -> (status, body bytes) through the Flask test client."""
+    client = flask_app.test_client()
+
+    def send(method, path, options):
+        kwargs = {'json': options['json']} if 'json' in options else {}
+        if 'file' in options:
+            name, body = options['file']
+            kwargs['data'] = {'file': (io.BytesIO(body), name)}
+        response = client.open(path, method=method, headers={'Accept-Encoding': 'gzip'}, **kwargs)
+        return response.status_code, response.get_data()
+    return send
+
+
+def http_sender(base_url):
+    """send(method, path, options) -> (status, body bytes) over HTTP, one session per thread."""
+    local = threading.local()
+
+    def send(method, path, options):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        kwargs = {'json': options['json']} if 'json' in options else {}
+        if 'file' in options:
+            kwargs['files'] = {'file': options['file']}
+        response = local.session.request(method, base_url + path, timeout=120, **kwargs)
+        return response.status_code, response.content
+    return send
+
+
+def run_scenario(send, batch, concurrency):
+    """Sends batch, concurrency requests at a time. Returns the scenario's report entry."""
+    def one(request):
+        method, path, options = request
+        start = time.perf_counter()
+        try:
+            status, body = send(method, path, options)
+        except Exception:
+            status, body = None, b''
+        return time.perf_counter() - start, status, len(body)
+
+    began = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(one, batch))
+    else:
+        results = [one(request) for request in batch]
+    elapsed = time.perf_counter() - began
+    latencies = np.array([r[0] for r in results]) * 1000
+    errors = sum(1 for r in results if r[1] is None or r[1] >= 400)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput_rps': round(len(results) / elapsed, 2),
+        'latency_ms': {'mean': round(float(latencies.mean()), 3),
+                       **{f"p{q}": round(float(np.percentile(latencies, q)), 3) for q in (50, 90, 95, 99)},
+                       'max': round(float(latencies.max()), 3)},
+        'response_bytes': int(np.mean([r[2] for r in results])),
+    }
+
+
+def serve(directory, sock):
+    """Worker process of --server: one threaded werkzeug server on the shared socket."""
+    os.chdir(directory)
+    sys.path.insert(0, SOURCE)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    from werkzeug.serving import make_server
+    import app as inventory_app
+    install_stubs(inventory_app)
+    host, port = sock.getsockname()
+    make_server(host, port, inventory_app.app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+def start_servers(directory, workers):
+    """Forks workers servers on one listening socket; returns (base URL, processes)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(512)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=serve, args=(directory, sock), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"http://127.0.0.1:{port}", processes
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SOURCE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SOURCE,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--skus', type=int, default=10000)
+    parser.add_argument('--history', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--sales', type=int, default=20000, help="rows of the file uploaded to /analyze")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help="measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=5, help="unmeasured requests per scenario (and worker)")
+    parser.add_argument('--scenarios', help="comma-separated subset of the scenarios")
+    parser.add_argument('--server', action='store_true', help="run forked HTTP servers instead of the test client")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help="write the JSON report to this file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    directory = tempfile.mkdtemp(prefix='inventory-load-')
+    processes = []
+    try:
+        began = time.perf_counter()
+        inventory = write_dataset(os.path.join(directory, 'data'), args.skus, args.history, args.orders, seed=args.seed)
+        print(f"{args.skus} products, {args.history} history rows, {args.orders} orders generated "
+              f"in {time.perf_counter() - began:.1f} s")
+        workload = Workload(inventory, synthetic_sales(args.sales, seed=args.seed), seed=args.seed)
+        names = args.scenarios.split(',') if args.scenarios else list(workload.scenarios)
+        unknown = [name for name in names if name not in workload.scenarios]
+        if unknown:
+            parser.error(f"unknown scenario(s): {', '.join(unknown)}; known: {', '.join(workload.scenarios)}")
+
+        if args.server:
+            base_url, processes = start_servers(directory, args.workers)
+            send, concurrency, warmup = http_sender(base_url), args.concurrency, args.warmup * args.workers
+        else:
+            os.chdir(directory)
+            sys.path.insert(0, SOURCE)
+            import app as inventory_app
+            install_stubs(inventory_app)
+            send, concurrency, warmup = client_sender(inventory_app.app), 1, args.warmup
+
+        # The first request loads the inventory (cold start)
+        began = time.perf_counter()
+        while True:
+            try:
+                status, _ = send('GET', '/inventory/count?limit=1', {})
+                if status == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if time.perf_counter() - began > 300:
+                raise RuntimeError("The server did not come up")
+            time.sleep(0.05)
+        cold_start = time.perf_counter() - began
+
+        scenarios = {}
+        print(f"{'scenario':16s} {'req/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'errors':>7s}")
+        for name in names:
+            run_scenario(send, workload.requests(name, warmup), concurrency)
+            report = scenarios[name] = run_scenario(send, workload.requests(name, args.requests), concurrency)
+            latency = report['latency_ms']
+            print(f"{name:16s} {report['throughput_rps']:9.1f} {latency['p50']:9.2f} {latency['p95']:9.2f} "
+                  f"{latency['p99']:9.2f} {report['errors']:7d}")
+
+        commit, dirty = git_revision()
+        report = {
+            'meta': {
+                'commit': commit,
+                'dirty': dirty,
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'mode': 'server' if args.server else 'client',
+                'workers': args.workers if args.server else 1,
+                'concurrency': concurrency,
+                'skus': args.skus,
+                'history': args.history,
+                'orders': args.orders,
+                'sales': args.sales,
+                'seed': args.seed,
+                'cold_start_ms': round(cold_start * 1000, 1),
+            },
+            'scenarios': scenarios,
+        }
+        if output:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.output}")
+        return 1 if any(s['errors'] for s in scenarios.values()) else 0
+    finally:
+        for process in processes:
+            process.terminate()
+        os.chdir(SOURCE)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
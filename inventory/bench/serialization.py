@@ -0,0 +1,60 @@
+"""
+Compares the ways product lists can be turned into (compressed) JSON.
+
+Run from the inventory directory:
+
+    python -m bench.serialization --rows 50000 --repeat 5
+
+Prints the best time of --repeat runs for each encoder and each compressor,
+plus the body sizes.
+"""
+import argparse
+import gzip
+import json
+import time
+
+from bench.datagen import synthetic_inventory
+from utils import serialization
+from utils.inventory import plain_frame
+from utils.serialization import dumps, frame_json
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    df = synthetic_inventory(args.rows)
+    encoders = {
+        # What the routes used to do (jsonify = json.dumps of to_dict records)
+        'to_dict + json.dumps': lambda: json.dumps(plain_frame(df).to_dict(orient='records')).encode('utf-8'),
+        'to_dict + dumps': lambda: dumps(plain_frame(df).to_dict(orient='records')),
+        'frame_json (DataFrame.to_json)': lambda: frame_json(df),
+    }
+    print(f"{args.rows} rows, best of {args.repeat}; orjson "
+          f"{'installed' if serialization.orjson else 'not installed'}")
+    body = None
+    for name, fn in encoders.items():
+        elapsed, body = best_of(args.repeat, fn)
+        print(f"  {name:32s} {elapsed * 1000:9.1f} ms  {len(body) / 1024:9.0f} KiB")
+
+    compressors = {f'gzip -{level}': (lambda level=level: gzip.compress(body, compresslevel=level)) for level in (1, 6)}
+    if serialization.brotli is not None:
+        compressors.update({f'brotli q{q}': (lambda q=q: serialization.brotli.compress(body, quality=q)) for q in (4, 6)})
+    for name, fn in compressors.items():
+        elapsed, compressed = best_of(args.repeat, fn)
+        print(f"  {name:32s} {elapsed * 1000:9.1f} ms  {len(compressed) / 1024:9.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
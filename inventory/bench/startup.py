@@ -0,0 +1,61 @@
+"""
+Compares cold-start loads of the inventory snapshot: parsing the CSV
+(load_inventory) against the typed binary snapshot, plus the memory the
+typed frame takes next to the all-object frame the app used to keep.
+
+Run from the inventory directory:
+
+    python -m bench.startup --rows 200000 --repeat 3
+
+The snapshot files are written to a temporary directory.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from bench.datagen import synthetic_inventory
+from bench.serialization import best_of
+from utils import inventory
+from utils.inventory import load_binary_snapshot, load_inventory, save_binary_snapshot, save_inventory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='inventory-startup-')
+    try:
+        path = os.path.join(directory, 'inventory.csv')
+        save_inventory(path, synthetic_inventory(args.rows))
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        typed = load_inventory(path)
+        save_binary_snapshot(path, typed, signature)
+
+        print(f"{args.rows} rows, best of {args.repeat}; binary snapshot: "
+              f"{'feather' if inventory.pyarrow is not None else 'none (pyarrow is not installed)'}")
+        loads = {
+            'CSV, all object (old)': lambda: pd.read_csv(path, dtype=str),
+            'CSV + schema (load_inventory)': lambda: load_inventory(path),
+        }
+        if inventory.pyarrow is not None:
+            loads['binary snapshot'] = lambda: load_binary_snapshot(path, signature)
+        for name, fn in loads.items():
+            elapsed, df = best_of(args.repeat, fn)
+            memory = df.memory_usage(deep=True).sum()
+            print(f"  {name:32s} {elapsed * 1000:9.1f} ms  {memory / 2**20:9.1f} MiB in memory")
+        for name in ('inventory.csv', os.path.basename(inventory.binary_snapshot_path(path))):
+            if not os.path.exists(os.path.join(directory, name)):
+                continue
+            print(f"  {name:32s} {os.path.getsize(os.path.join(directory, name)) / 2**20:9.1f} MiB on disk")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Multi-process stress check: several worker processes, each running the app
+as a separate gunicorn worker would, hammer the same data files at once.
+
+Run from the inventory directory:
+
+    python -m bench.stress --workers 8 --adjustments 200 --orders 50
+
+Every worker adds +1 to one product's stock --adjustments times (with the
+journal compacting every few dozen records meanwhile) and places --orders
+orders. Afterwards the quantity must have grown by exactly
+workers * adjustments (no lost increments), every order ID must be unique
+and the stock history must hold one row per adjustment. Exits non-zero
+otherwise. The work happens in a temporary data/ directory.
+tests/test_multiprocess.py runs a smaller version of it.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BARCODE = '0000000000017'
+
+
+def worker(directory, adjustments, orders, start):
+    os.chdir(directory)
+    import app as inventory_app
+    inventory_app.app.config.update(JOURNAL_COMPACT_RECORDS=40, JOURNAL_COMPACT_INTERVAL=0.05)
+    client = inventory_app.app.test_client()
+    start.wait()
+    for i in range(max(adjustments, orders)):
+        if i < adjustments:
+            response = client.post('/inventory/adjust-stock', json={'barcode': BARCODE, 'adjustment': 1})
+            assert response.status_code == 200, response.get_json()
+        if i < orders:
+            response = client.post('/inventory/order', json={'barcode': BARCODE, 'quantity': 1})
+            assert response.status_code == 200, response.get_json()
+    inventory_app.history_writer().flush()
+
+
+def run(directory, workers, adjustments, orders):
+    """
+    Runs the check with its data/ in directory. Returns a dict of elapsed
+    (seconds), failed_workers, quantity, order_ids and history_rows.
+    """
+    source = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    previous = os.getcwd()
+    os.makedirs(os.path.join(directory, 'data'))
+    if source not in sys.path:
+        sys.path.insert(0, source)
+    os.chdir(directory)
+    try:
+        from utils.store import InventoryStore
+        from utils.orders import OrderStore
+        from utils.history import HistoryStore
+
+        store = InventoryStore('data/inventory.csv', compact_interval=0)
+        store.upsert({'barcode': BARCODE, 'name': 'Stress test', 'quantity': 0})
+        store.compact(force=True)
+        store._journal.close()
+
+        context = multiprocessing.get_context('spawn')
+        start = context.Event()
+        processes = [context.Process(target=worker, args=(directory, adjustments, orders, start))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        time.sleep(2)  # let every worker import the app before they start together
+        began = time.perf_counter()
+        start.set()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - began
+
+        return {
+            'elapsed': elapsed,
+            'failed_workers': sum(1 for process in processes if process.exitcode),
+            'quantity': int(InventoryStore('data/inventory.csv', compact_interval=0).get(BARCODE)['quantity']),
+            'order_ids': [o['order_id'] for o in OrderStore('data/orders.csv').query()],
+            'history_rows': HistoryStore('data/stock_history.sqlite3').count(),
+        }
+    finally:
+        os.chdir(previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--adjustments', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='inventory-stress-')
+    try:
+        result = run(directory, args.workers, args.adjustments, args.orders)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    if result['failed_workers']:
+        print("A worker failed")
+        return 1
+
+    expected = args.workers * args.adjustments
+    order_ids = result['order_ids']
+    print(f"{args.workers} workers, {expected} adjustments and {len(order_ids)} orders in {result['elapsed']:.2f} s")
+    print(f"  quantity: {result['quantity']} (expected {expected})")
+    print(f"  orders:   {len(set(order_ids))} unique of {args.workers * args.orders} expected")
+    print(f"  history:  {result['history_rows']} rows (expected {expected})")
+    ok = (result['quantity'] == expected and len(set(order_ids)) == len(order_ids) == args.workers * args.orders
+          and result['history_rows'] == expected)
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -527,6 +527,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Correctly activate the first tab on load without interfering with camera setup
     showTab('count-inventory'); // Or whatever your default starting tab is
     loadInventoryList(); // Load inventory for search/count tab
+    followInventoryChanges(); // Keep it current from the server's change feed
 });
 
 // --- MODIFIED: handleProductPhotoTrigger ---
@@ -597,7 +598,7 @@ function showTab(tabId) {
 
     if (tabId === 'search-inventory') {
         document.getElementById('searchInput').value = '';
-        searchInventory(); // Ensure inventory list is loaded/reloaded
+        showInventoryListing(); // Ensure inventory list is loaded (the change feed keeps it current)
     } else if (tabId === 'add-product') {
         loadCategories();
         // Reset photo UI when entering add-product tab
@@ -709,6 +710,12 @@ function fetchProductInfo(e) {
         });
 }
 
+// Uploaded images (/images/products/...) come in resized variants: 'thumb' for
+// table rows, 'display' for product panels. Other URLs are used as they are.
+function imageVariant(url, size) {
+    return url && url.startsWith('/images/products/') ? `${url}?size=${size}` : url;
+}
+
 function displayProductInfo(product) {
     productInfoSection.classList.remove('hidden');
     document.getElementById('productName').textContent = product.name || 'New Product';
@@ -720,7 +727,7 @@ function displayProductInfo(product) {
     
     const img = document.getElementById('productImage');
     if (product.image_url) {
-        img.src = product.image_url;
+        img.src = imageVariant(product.image_url, 'display');
     } else {
         // Correct way to use Flask's url_for in JS is to have the template render it directly
         // Ensure you have a placeholder.png in static/images
@@ -778,6 +785,39 @@ function showLoader(show) {
   document.getElementById('searchResultsTable').classList.add('hidden');
 }
 
+// One row of the inventory table; data-barcode lets change events find it again
+function inventoryRow(item) {
+  const row = document.createElement('tr');
+  row.dataset.barcode = item.barcode || '';
+  row.innerHTML = `
+    <td class="px-6 py-4 whitespace-nowrap">
+      <div class="flex items-center">
+        <div class="flex-shrink-0 h-10 w-10">
+          <img class="h-10 w-10 rounded" src="${imageVariant(item.image_url, 'thumb') || 'https://placehold.co/40x40/cccccc/ffffff?text=NO+IMG'}" alt="">
+        </div>
+        <div class="ml-4">
+          <div class="text-sm font-medium text-gray-900">${item.name || 'Unnamed Product'}</div>
+        </div>
+      </div>
+    </td>
+    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${item.barcode || ''}</td>
+    <td class="px-6 py-4 whitespace-nowrap">
+      <span data-field="quantity" class="px-2 inline-flex text-xs leading-5 font-semibold rounded-full bg-green-100 text-green-800">
+        ${item.quantity || 0} in stock
+      </span>
+    </td>
+    <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${item.category || ''}</td>
+    <td class="px-6 py-4 whitespace-nowrap text-right text-sm font-medium">
+      <button onclick="showProductDetails('${item.barcode}')" class="text-indigo-600 hover:text-indigo-900 mr-3">Details</button>
+      <button onclick="showTab('place-order')" class="text-green-600 hover:text-green-900">Order</button>
+    </td>
+  `;
+  return row;
+}
+
+// What the inventory table currently shows: nothing yet, the full listing ('') or a search
+let inventoryView = { loaded: false, query: '' };
+
 function searchInventory(query = '') {
   showLoader(true);
 
@@ -785,6 +825,7 @@ function searchInventory(query = '') {
     .then(res => res.json())
     .then(data => {
       showLoader(false);
+      inventoryView = { loaded: true, query: query };
 
       const table = document.getElementById('searchResultsTable');
       const empty = document.getElementById('searchEmpty');
@@ -801,31 +842,7 @@ function searchInventory(query = '') {
       empty.classList.add('hidden');
 
       data.forEach(item => {
-        const row = document.createElement('tr');
-        row.innerHTML = `
-          <td class="px-6 py-4 whitespace-nowrap">
-            <div class="flex items-center">
-              <div class="flex-shrink-0 h-10 w-10">
-                <img class="h-10 w-10 rounded" src="${item.image_url || 'https://placehold.co/40x40/cccccc/ffffff?text=NO+IMG'}" alt="">
-              </div>
-              <div class="ml-4">
-                <div class="text-sm font-medium text-gray-900">${item.name || 'Unnamed Product'}</div>
-              </div>
-            </div>
-          </td>
-          <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${item.barcode || ''}</td>
-          <td class="px-6 py-4 whitespace-nowrap">
-            <span class="px-2 inline-flex text-xs leading-5 font-semibold rounded-full bg-green-100 text-green-800">
-              ${item.quantity || 0} in stock
-            </span>
-          </td>
-          <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${item.category || ''}</td>
-          <td class="px-6 py-4 whitespace-nowrap text-right text-sm font-medium">
-            <button onclick="showProductDetails('${item.barcode}')" class="text-indigo-600 hover:text-indigo-900 mr-3">Details</button>
-            <button onclick="showTab('place-order')" class="text-green-600 hover:text-green-900">Order</button>
-          </td>
-        `;
-        tbody.appendChild(row);
+        tbody.appendChild(inventoryRow(item));
         console.log(`Search Result: ${item.name}, Image URL: ${item.image_url}`); // Debugging log
       });
     })
@@ -942,8 +959,7 @@ function handleAddProduct(e) {
           if (data.status === 'ok') {
             showToast('Product added successfully');
             resetAddProductForm(); // This will clear and reset the photo UI
-            showTab('search-inventory'); // Direct to search after adding
-            searchInventory(); // Re-load inventory to show new product with image
+            showTab('search-inventory'); // Direct to search after adding; the new row arrives as a change event
           } else {
             showToast('Error adding product: ' + (data.error || 'Unknown error'));
           }
@@ -992,7 +1008,7 @@ function showProductDetails(barcode) {
       
       const img = document.getElementById('detailsProductImage');
       if (p.image_url) {
-          img.src = p.image_url;
+          img.src = imageVariant(p.image_url, 'display');
       } else {
           img.src = "/static/images/placeholder.png"; // Fallback to a static path
       }
@@ -1040,6 +1056,19 @@ function getTimeUnitForRange(range) {
   }
 }
 
+// Longer ranges are charted from server-side rollups (one point per bucket)
+// instead of every scan; the last 24 hours still show each scan
+function getHistoryBucketForRange(range) {
+  switch (range) {
+    case '24hours': return null;
+    case 'week':    return 'hour';
+    case 'month':
+    case '3months':
+    case '6months': return 'day';
+    default:        return 'week';
+  }
+}
+
 function getRangeMin(range) {
   const now = new Date();
   switch (range) {
@@ -1078,7 +1107,14 @@ function generateSimulatedStockHistory(range) {
 }
 
 function loadStockHistory(barcode, range) {
-  fetch(`/inventory/stock-history?barcode=${barcode}`)
+  const params = new URLSearchParams({ barcode: barcode });
+  const bucket = getHistoryBucketForRange(range);
+  if (bucket) {
+    const since = getRangeMin(range);
+    params.set('bucket', bucket);
+    params.set('since', `${since.getFullYear()}-${String(since.getMonth() + 1).padStart(2, '0')}-${String(since.getDate()).padStart(2, '0')}`);
+  }
+  fetch(`/inventory/stock-history?${params}`)
     .then(res => res.json())
     .then(data => {
       const rangeMin = getRangeMin(range);
@@ -1456,10 +1492,79 @@ function adjustStock(barcode, adjustment) {
     });
 }
 
+// --- LIVE INVENTORY CHANGES ---
+// The server streams one event per changed product (/inventory/changes), so
+// tables are patched in place instead of refetching the catalog after every
+// add, adjustment or scan. EventSource reconnects by itself and resumes from
+// the last event it saw; 'hello' (new connection) and 'reset' (missed events
+// are gone) are the only times the listing is fetched again.
+const changeFeed = { source: null, live: false };
+
+function followInventoryChanges() {
+  if (!window.EventSource || changeFeed.source) return;
+  const source = new EventSource('/inventory/changes');
+  changeFeed.source = source;
+  source.onopen = () => { changeFeed.live = true; };
+  source.onerror = () => { changeFeed.live = false; };
+  const refetch = () => {
+    changeFeed.live = true;
+    // Whatever changed while nobody was listening is in the fresh copy
+    if (inventoryView.loaded) searchInventory(inventoryView.query);
+  };
+  source.addEventListener('hello', refetch);
+  source.addEventListener('reset', refetch);
+  source.addEventListener('upsert', e => applyProductChange(JSON.parse(e.data).product));
+  source.addEventListener('quantity', e => {
+    const change = JSON.parse(e.data);
+    applyQuantityChange(change.barcode, change.quantity);
+  });
+  source.addEventListener('alert', e => {
+    const alert = JSON.parse(e.data);
+    const label = alert.kind === 'understock' ? 'Low stock' : 'Overstock';
+    showToast(`${label}: ${alert.barcode} (${alert.quantity} in stock, threshold ${alert.threshold})`);
+  });
+}
+
+// Redraws the inventory table unless the change feed already keeps the full listing current
+function showInventoryListing() {
+  if (changeFeed.live && inventoryView.loaded && inventoryView.query === '') return;
+  searchInventory();
+}
+
+function inventoryTableRow(barcode) {
+  return document.querySelector(`#searchResultsBody tr[data-barcode="${CSS.escape(String(barcode))}"]`);
+}
+
+function applyProductChange(product) {
+  const row = inventoryTableRow(product.barcode);
+  if (row) {
+    row.replaceWith(inventoryRow(product));
+  } else if (inventoryView.loaded && inventoryView.query === '') {
+    // New products join the full listing; search results stay as searched
+    document.getElementById('searchResultsBody').appendChild(inventoryRow(product));
+    document.getElementById('searchResultsTable').classList.remove('hidden');
+    document.getElementById('searchEmpty').classList.add('hidden');
+  }
+  applyQuantityChange(product.barcode, product.quantity);
+}
+
+function applyQuantityChange(barcode, quantity) {
+  const cell = inventoryTableRow(barcode)?.querySelector('[data-field="quantity"]');
+  if (cell) cell.textContent = `${quantity || 0} in stock`;
+  // The open product panels show the same product
+  if (window.currentBarcode === barcode && !window.isEditing) {
+    document.getElementById('detailsCurrentStock').textContent = quantity;
+  }
+  if (barcodeInput && barcodeInput.value.trim() === barcode && !productInfoSection.classList.contains('hidden')) {
+    document.getElementById('currentStock').textContent = quantity;
+  }
+}
+
 function loadInventoryList() {
   fetch('/inventory/count')
     .then(res => res.json())
     .then(data => {
+      inventoryView = { loaded: true, query: '' };
       const tbody = document.getElementById('searchResultsBody');
       // No change here for searchResultsTable visibility on initial load if data is empty
       // As per previous, searchInventory handles the empty state
@@ -1473,33 +1578,7 @@ function loadInventoryList() {
       }
 
 
-      data.forEach(item => {
-        const row = document.createElement('tr');
-        row.innerHTML = `
-          <td class="px-6 py-4 whitespace-nowrap">
-            <div class="flex items-center">
-              <div class="flex-shrink-0 h-10 w-10">
-                <img class="h-10 w-10 rounded" src="${item.image_url || 'https://placehold.co/40x40/cccccc/ffffff?text=NO+IMG'}" alt="">
-              </div>
-              <div class="ml-4">
-                <div class="text-sm font-medium text-gray-900">${item.name || 'Unnamed Product'}</div>
-              </div>
-            </div>
-          </td>
-          <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-900">${item.barcode || ''}</td>
-          <td class="px-6 py-4 whitespace-nowrap">
-            <span class="px-2 inline-flex text-xs leading-5 font-semibold rounded-full bg-green-100 text-green-800">
-              ${item.quantity || 0} in stock
-            </span>
-          </td>
-          <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${item.category || ''}</td>
-          <td class="px-6 py-4 whitespace-nowrap text-right text-sm font-medium">
-            <button onclick="showProductDetails('${item.barcode}')" class="text-indigo-600 hover:text-indigo-900 mr-3">Details</button>
-            <button onclick="showTab('place-order')" class="text-green-600 hover:text-green-900">Order</button>
-          </td>
-        `;
-        tbody.appendChild(row);
-      });
+      data.forEach(item => tbody.appendChild(inventoryRow(item)));
     })
     .catch(error => {
       console.error('Error loading inventory list:', error);
@@ -1508,7 +1587,7 @@ function loadInventoryList() {
 }
 
 function afterProductAdded() {
-  loadInventoryList();
+  showInventoryListing();
   clearAddProductForm();
 }
 
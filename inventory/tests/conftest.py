@@ -0,0 +1,33 @@
+import os
+import sys
+
+# The app imports its modules as top-level packages (utils, bench) from the inventory directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def app_client(tmp_path, monkeypatch):
+    """Flask test client of the app with all its data files in tmp_path/data."""
+    import app as inventory_app
+    data = tmp_path / 'data'
+    data.mkdir(exist_ok=True)
+    for key, name in (('INVENTORY_FILE', 'inventory.csv'), ('ORDERS_FILE', 'orders.csv'),
+                      ('SQLITE_DB', 'inventory.sqlite3'), ('LOOKUP_CACHE_FILE', 'lookup_cache.sqlite3'),
+                      ('HISTORY_DB', 'stock_history.sqlite3'), ('HISTORY_LEGACY_CSV', 'stock_history.csv'),
+                      ('ANALYSIS_CACHE_DIR', 'analysis_cache'), ('PROFILE_DIR', 'profiles'),
+                      ('UPLOAD_FOLDER', 'images')):
+        monkeypatch.setitem(inventory_app.app.config, key, str(data / name))
+    monkeypatch.setitem(inventory_app.app.config, 'JOURNAL_COMPACT_INTERVAL', 0)
+    return inventory_app.app.test_client()
+
+
+@pytest.fixture
+def seed_inventory(tmp_path):
+    """Writes rows (dicts) as the inventory CSV that app_client serves; call before the first request."""
+    def seed(rows):
+        (tmp_path / 'data').mkdir(exist_ok=True)
+        pd.DataFrame(rows).to_csv(tmp_path / 'data' / 'inventory.csv', index=False)
+    return seed
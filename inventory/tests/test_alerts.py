@@ -0,0 +1,97 @@
+"""
+The alert index: the same alerts as a full get_alerts() scan, kept current
+one row at a time, with newly raised understock/overstock alerts put on the
+change feed.
+"""
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from utils.inventory import AlertIndex, _alert_columns, _alert_values, enforce_schema, get_alerts
+from utils.store import InventoryStore
+
+
+def day(offset):
+    return (datetime.utcnow().date() + timedelta(days=offset)).isoformat()
+
+
+@pytest.fixture
+def frame():
+    return enforce_schema(pd.DataFrame({
+        'barcode': ['A', 'B', 'C', 'D', 'E'],
+        'quantity': [1, 50, 200, 5, 0],
+        'threshold': [2, 5, 10, 0, 3],
+        'expiry': [day(7), day(3), '', day(1), 'not a date'],
+    }))
+
+
+def test_matches_a_full_scan(frame):
+    index = AlertIndex(frame)
+    for windows in ((7, 3, 1), (3,), ()):
+        assert index.alerts(windows) == get_alerts(frame, windows)
+    assert [a['barcode'] for a in index.alerts()['understock']] == ['A', 'E']
+    assert [a['barcode'] for a in index.alerts()['overstock']] == ['C']
+    assert [(a['barcode'], a['days_to_expiry']) for a in index.alerts()['expiry']] == [('A', 7), ('B', 3), ('D', 1)]
+
+
+def test_update_returns_newly_raised_alerts(frame):
+    index = AlertIndex(frame)
+    assert index.update(1, {'barcode': 'B', 'quantity': 4, 'threshold': 5, 'expiry': day(3)}) == [
+        {'kind': 'understock', 'barcode': 'B', 'quantity': 4, 'threshold': 5}]
+    # Already understock: nothing new
+    assert index.update(1, {'barcode': 'B', 'quantity': 3, 'threshold': 5, 'expiry': day(3)}) == []
+    assert index.update(1, {'barcode': 'B', 'quantity': 60, 'threshold': 5, 'expiry': ''}) == [
+        {'kind': 'overstock', 'barcode': 'B', 'quantity': 60, 'threshold': 5}]
+    assert 'B' not in [a['barcode'] for a in index.alerts()['expiry']]
+    assert 'B' not in [a['barcode'] for a in index.alerts()['understock']]
+
+
+def test_new_rows_join_the_index(frame):
+    index = AlertIndex(frame)
+    raised = index.update(10, {'barcode': 'F', 'quantity': '1', 'threshold': '4', 'expiry': day(7)})
+    assert raised == [{'kind': 'understock', 'barcode': 'F', 'quantity': 1, 'threshold': 4}]
+    assert ('F', 7) in [(a['barcode'], a['days_to_expiry']) for a in index.alerts()['expiry']]
+
+
+def test_overstock_multiplier_can_change(frame):
+    index = AlertIndex(frame)
+    index.set_overstock_multiplier(5)
+    assert [a['barcode'] for a in index.alerts()['overstock']] == ['B', 'C']
+    assert index.alerts() == get_alerts(frame, overstock_multiplier=5)
+
+
+def test_reorder_alerts_use_daily_usage(frame):
+    index = AlertIndex(frame)
+    alerts = index.alerts(usage={1: 10.0, 2: 1.0, 4: 2.0}, reorder_days=7)
+    assert alerts['reorder'] == [
+        {'barcode': 'E', 'quantity': 0, 'daily_usage': 2.0, 'days_to_stockout': 0.0},
+        {'barcode': 'B', 'quantity': 50, 'daily_usage': 10.0, 'days_to_stockout': 5.0},
+    ]
+
+
+@pytest.mark.parametrize('expiry', ['2025-01-02', '2025-01-02T10:00', 'bad', '', None, pd.NaT,
+                                    pd.Timestamp('2024-02-03 13:00')])
+@pytest.mark.parametrize('quantity', [3, '4', '4.7', -2.5, '', None, pd.NA, True, 'x'])
+def test_row_values_match_the_vectorized_parse(expiry, quantity):
+    row = {'barcode': 'A', 'expiry': expiry, 'quantity': quantity, 'threshold': quantity}
+    expiry_day, qty, thr = _alert_columns(pd.DataFrame([row]))
+    day_value = expiry_day.iloc[0]
+    assert _alert_values(row) == [None if day_value != day_value else int(day_value),
+                                  int(qty.iloc[0]), int(thr.iloc[0])]
+
+
+def test_store_puts_raised_alerts_on_the_feed(tmp_path):
+    path = str(tmp_path / 'inventory.csv')
+    pd.DataFrame({'barcode': ['4006381333931'], 'name': ['Pen'], 'quantity': [5], 'threshold': [2]}).to_csv(
+        path, index=False)
+    store = InventoryStore(path, compact_interval=0)
+    store.frame()
+    with store.changes.listen():
+        version = store.changes.version
+        store.adjust_quantity('4006381333931', -4)
+        store.upsert({'barcode': '5449000000996', 'name': 'Cola', 'quantity': 1, 'threshold': 6})
+        alerts = [e for e in store.changes.since(version) if e['type'] == 'alert']
+    assert [(a['kind'], a['barcode'], a['quantity']) for a in alerts] == [
+        ('understock', '4006381333931', 1), ('understock', '5449000000996', 1)]
+    assert [a['barcode'] for a in store.alerts()['understock']] == ['4006381333931', '5449000000996']
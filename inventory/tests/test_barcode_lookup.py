@@ -0,0 +1,180 @@
+"""
+External barcode lookups against a local stub of the two providers: caching
+(hits, "not found" answers and their expiry), hedging and failures.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from utils import barcode
+from utils.lookup_cache import LookupCache
+
+KNOWN = '3017620422003'
+
+
+class StubProviders:
+    """
+    Serves Open Food Facts (/off/<code>.json) and UPCitemdb (/upc?upc=<code>)
+    style answers. Per provider: status (200 answers, anything else fails),
+    delay in seconds, and the codes it knows. Counts the requests it gets.
+    """
+
+    def __init__(self):
+        self.status = {'off': 200, 'upc': 200}
+        self.delay = {'off': 0.0, 'upc': 0.0}
+        self.known = {'off': {KNOWN}, 'upc': {KNOWN}}
+        self.requests = {'off': 0, 'upc': 0}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.startswith('/off/'):
+                    provider, code = 'off', url.path[len('/off/'):-len('.json')]
+                else:
+                    provider, code = 'upc', parse_qs(url.query)['upc'][0]
+                with stub._lock:
+                    stub.requests[provider] += 1
+                time.sleep(stub.delay[provider])
+                status = stub.status[provider]
+                if status != 200:
+                    body = b'{}'
+                elif provider == 'off':
+                    body = json.dumps({'status': 1, 'product': {'product_name': 'Spread (OFF)'}}
+                                      if code in stub.known['off'] else {'status': 0}).encode()
+                else:
+                    body = json.dumps({'items': [{'title': 'Spread (UPC)'}] if code in stub.known['upc'] else []}).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # the client gave up on a slow answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    providers = StubProviders()
+    monkeypatch.setattr(barcode, 'OPENFOODFACTS_URL', providers.url + '/off/{barcode}.json')
+    monkeypatch.setattr(barcode, 'UPCITEMDB_URL', providers.url + '/upc?upc={barcode}')
+    yield providers
+    providers.close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LookupCache(str(tmp_path / 'lookup_cache.sqlite3'), ttl=60, negative_ttl=60)
+
+
+def test_hit_is_served_from_cache(stub, cache):
+    first = barcode.lookup_barcode(KNOWN, cache=cache, deadline=2, hedge_delay=0.5)
+    assert first['name'] == 'Spread (OFF)'
+    # The top provider answered within the hedge delay: the other was never asked
+    assert stub.requests == {'off': 1, 'upc': 0}
+
+    # Any EAN/UPC form of the code shares the entry
+    assert barcode.lookup_barcode('0' + KNOWN, cache=cache, deadline=2, hedge_delay=0.5) == first
+    assert stub.requests == {'off': 1, 'upc': 0}
+    assert cache.stats()['hits'] == 1
+
+
+def test_miss_is_cached_as_not_found(stub, cache):
+    assert barcode.lookup_barcode('4006381333931', cache=cache, deadline=2, hedge_delay=0.5) == {}
+    assert stub.requests == {'off': 1, 'upc': 1}
+
+    assert barcode.lookup_barcode('4006381333931', cache=cache, deadline=2, hedge_delay=0.5) == {}
+    assert stub.requests == {'off': 1, 'upc': 1}
+    stats = cache.stats()
+    assert (stats['negative_entries'], stats['negative_hits']) == (1, 1)
+
+
+def test_not_found_expires_after_negative_ttl(stub, tmp_path):
+    cache = LookupCache(str(tmp_path / 'lookup_cache.sqlite3'), ttl=60, negative_ttl=0.2)
+    assert barcode.lookup_barcode('4006381333931', cache=cache, deadline=2, hedge_delay=0.5) == {}
+    stub.known['upc'].add('4006381333931')
+    time.sleep(0.3)
+
+    product = barcode.lookup_barcode('4006381333931', cache=cache, deadline=2, hedge_delay=0.5)
+    assert product['name'] == 'Spread (UPC)'
+    assert stub.requests == {'off': 2, 'upc': 2}
+    assert cache.stats()['expired'] == 1
+
+
+def test_slow_provider_loses_the_hedge(stub, cache):
+    stub.delay['off'] = 2.0
+    began = time.monotonic()
+    product = barcode.lookup_barcode(KNOWN, cache=cache, deadline=0.5, hedge_delay=0.05)
+    elapsed = time.monotonic() - began
+
+    assert product['name'] == 'Spread (UPC)'
+    # Bounded by the deadline, not by the slow provider
+    assert elapsed < 1.5
+    assert stub.requests == {'off': 1, 'upc': 1}
+    assert cache.get(KNOWN) == (True, product)
+
+
+def test_top_provider_wins_when_it_answers_after_the_hedge(stub, cache):
+    stub.delay['off'] = 0.2
+    product = barcode.lookup_barcode(KNOWN, cache=cache, deadline=2, hedge_delay=0.05)
+    assert product['name'] == 'Spread (OFF)'
+    assert stub.requests == {'off': 1, 'upc': 1}
+
+
+def test_all_providers_failing_is_not_cached(stub, cache):
+    stub.status = {'off': 500, 'upc': 503}
+    assert barcode.lookup_barcode(KNOWN, cache=cache, deadline=2, hedge_delay=0.05) == {}
+    assert cache.stats()['entries'] == 0
+
+    # Once they recover, the code is looked up again rather than remembered as unknown
+    stub.status = {'off': 200, 'upc': 200}
+    assert barcode.lookup_barcode(KNOWN, cache=cache, deadline=2, hedge_delay=0.05)['name'] == 'Spread (OFF)'
+    assert stub.requests['off'] == 2
+
+
+def test_batch_lookups_share_the_cache(stub, cache):
+    barcode.lookup_barcode(KNOWN, cache=cache, deadline=2, hedge_delay=0.5)
+    results = dict(barcode.lookup_barcodes([KNOWN, '4006381333931', KNOWN], cache=cache, deadline=2, hedge_delay=0.5))
+
+    assert results[KNOWN]['name'] == 'Spread (OFF)'
+    assert results['4006381333931'] == {}
+    assert stub.requests == {'off': 2, 'upc': 1}
+
+
+def test_provider_requests_end_with_the_lookup_deadline(stub, monkeypatch):
+    stub.delay = {'off': 3.0, 'upc': 3.0}
+    finished = []
+
+    def timed_lookup(code):
+        try:
+            return barcode.lookup_openfoodfacts(code)
+        finally:
+            finished.append(time.monotonic())
+
+    monkeypatch.setattr(barcode, '_providers', [(10, 'openfoodfacts', timed_lookup)])
+    began = time.monotonic()
+    assert barcode.lookup_barcode(KNOWN, deadline=0.3, hedge_delay=0.05) == {}
+
+    # The HTTP request times out with the lookup instead of holding a worker for LOOKUP_DEADLINE
+    deadline = time.monotonic() + 2
+    while not finished and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert finished and finished[0] - began < 1.0
@@ -0,0 +1,110 @@
+"""
+Product imports: reading uploads as text, validating and typing each
+column, and POST /inventory/import merging the valid rows by barcode.
+"""
+import io
+
+import pandas as pd
+import pytest
+
+from utils.importer import coerce_import, read_table
+
+
+def table(**columns):
+    return pd.DataFrame(columns, dtype=object)
+
+
+def test_numbers_are_cleaned_and_rounded():
+    rows, errors = coerce_import(table(barcode=['1', '2', '3'], quantity=['4', ' 7.6 ', '12 units'],
+                                       price=['$1,234.50', '2.5', '€3']))
+    assert errors == []
+    assert rows['quantity'].tolist() == [4, 8, 12]
+    assert str(rows['quantity'].dtype) == 'Int64'
+    assert rows['price'].tolist() == [1234.5, 2.5, 3.0]
+
+
+def test_first_problem_of_each_row_is_reported():
+    rows, errors = coerce_import(table(
+        barcode=['1', '', '3', '4', '5'],
+        quantity=['1', '2', 'lots', '4', '5'],
+        expiry=['2025-01-02', '2025-01-02', '31/12/2025', '31/12/2025', '2025-02-30'],
+        synced=['yes', 'no', 'maybe', 'maybe', 'off'],
+    ))
+    assert errors == [
+        {'row': 2, 'error': 'missing barcode'},
+        {'row': 3, 'error': 'invalid quantity'},
+        {'row': 4, 'error': 'invalid expiry (expected YYYY-MM-DD)'},
+        {'row': 5, 'error': 'invalid expiry (expected YYYY-MM-DD)'},
+    ]
+    assert rows['barcode'].tolist() == ['1']
+    assert rows['synced'].tolist() == [True]
+    assert rows['expiry'].tolist() == [pd.Timestamp('2025-01-02')]
+
+
+def test_blank_cells_stay_missing():
+    rows, errors = coerce_import(table(barcode=['1'], name=['  '], quantity=[''], synced=[''], expiry=['']))
+    assert errors == []
+    assert rows[['name', 'quantity', 'synced', 'expiry']].isna().all(axis=None)
+
+
+def test_unknown_columns_are_dropped():
+    rows, _ = coerce_import(table(barcode=['1'], colour=['red']))
+    assert list(rows.columns) == ['barcode']
+
+
+@pytest.mark.parametrize('filename, data', [
+    ('products.csv', b'barcode,quantity\n0067800002467,3\n'),
+    ('products.tsv', b'barcode\tquantity\n0067800002467\t3\n'),
+    ('products.json', b'[{"barcode": "0067800002467", "quantity": 3}]'),
+    ('products.json', b'{"barcode": "0067800002467", "quantity": 3}\n'),
+])
+def test_read_table_keeps_codes_as_text(filename, data):
+    df = read_table(io.BytesIO(data), filename)
+    assert df.to_dict('records') == [{'barcode': '0067800002467', 'quantity': '3'}]
+
+
+@pytest.fixture
+def client(app_client, seed_inventory):
+    seed_inventory([{'barcode': '4006381333931', 'name': 'Ballpoint Pen', 'category': 'Office', 'quantity': 5}])
+    return app_client
+
+
+def upload(client, data, filename='products.csv', query=''):
+    return client.post(f'/inventory/import{query}', data={'file': (io.BytesIO(data), filename)},
+                       content_type='multipart/form-data')
+
+
+def products(client):
+    return {p['barcode']: p for p in client.get('/inventory/count').get_json()}
+
+
+def test_import_merges_by_barcode(client):
+    response = upload(client, b'EAN,Product Name,Qty,Category\n'
+                              b'4006381333931,,9,\n'
+                              b'5449000000996,Cola,12,Drinks\n'
+                              b'3017620422003,Spread,lots,Food\n')
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['rows'], body['inserted'], body['updated'], body['rejected']) == (3, 1, 1, 1)
+    assert body['errors'] == [{'row': 3, 'error': 'invalid quantity'}]
+    assert body['columns'] == {'EAN': 'barcode', 'Product Name': 'name', 'Qty': 'quantity', 'Category': 'category'}
+
+    stored = products(client)
+    # Blank cells leave the stored values alone
+    assert (stored['4006381333931']['name'], stored['4006381333931']['category']) == ('Ballpoint Pen', 'Office')
+    assert stored['4006381333931']['quantity'] == 9
+    assert stored['5449000000996']['name'] == 'Cola'
+    assert '3017620422003' not in stored
+
+
+def test_dry_run_writes_nothing(client):
+    body = upload(client, b'barcode,quantity\n5449000000996,12\n', query='?dry_run=1').get_json()
+    assert (body['rows'], body['inserted'], body['rejected']) == (1, 0, 0)
+    assert list(products(client)) == ['4006381333931']
+
+
+def test_files_without_a_barcode_column_are_rejected(client):
+    response = upload(client, b'name,quantity\nCola,12\n')
+    assert response.status_code == 400
+    assert response.get_json()['columns'] == ['name', 'quantity']
+    assert upload(client, b'barcode\n1\n', filename='products.txt').status_code == 400
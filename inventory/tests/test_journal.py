@@ -0,0 +1,124 @@
+"""
+The mutation journal: writes survive a restart by replay, a torn last
+record is ignored, compaction folds the journal into a new snapshot (also
+after a compaction died half-way), and other store instances tail it.
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from utils.journal import MutationJournal, read_journal
+from utils.store import InventoryStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'inventory.csv')
+    pd.DataFrame({
+        'barcode': ['4006381333931', '3017620422003'],
+        'name': ['Ballpoint Pen', 'Hazelnut Spread'],
+        'quantity': [5, 3],
+        'threshold': [1, 1],
+    }).to_csv(path, index=False)
+    return path
+
+
+def open_store(path):
+    return InventoryStore(path, compact_interval=0)
+
+
+def test_appended_records_are_read_back(tmp_path):
+    journal = MutationJournal(str(tmp_path / 'journal'))
+    journal.commit(journal.append([{'op': 'quantity', 'barcode': '1', 'quantity': 2}]))
+    journal.commit(journal.append([{'op': 'synced', 'barcode': '1', 'synced': True},
+                                   {'op': 'quantity', 'barcode': '1', 'quantity': 1}]))
+    assert [r['op'] for r in read_journal(journal.path)] == ['quantity', 'synced', 'quantity']
+    assert journal.records == 3
+    journal.close()
+
+
+def test_writes_are_replayed_after_a_restart(path):
+    store = open_store(path)
+    store.adjust_quantity('4006381333931', -2)
+    store.upsert({'barcode': '5449000000996', 'name': 'Cola', 'quantity': 12})
+    store.set_synced('3017620422003')
+
+    # Only the journal holds the changes: the CSV snapshot is untouched
+    assert len(pd.read_csv(path)) == 2
+    restarted = open_store(path)
+    assert restarted.get('4006381333931')['quantity'] == 3
+    assert restarted.get('5449000000996')['name'] == 'Cola'
+    assert restarted.get('3017620422003')['synced'] is True
+    assert restarted.stats()['replayed_records'] == 3
+
+
+def test_torn_last_record_is_ignored(path):
+    store = open_store(path)
+    store.adjust_quantity('4006381333931', 1)
+    with open(store.journal_path, 'ab') as f:
+        f.write(b'{"op":"quantity","barcode":"4006381333931","quan')
+
+    restarted = open_store(path)
+    assert restarted.get('4006381333931')['quantity'] == 6
+    # The next write cuts the torn bytes off instead of appending after them
+    restarted.adjust_quantity('4006381333931', 1)
+    assert [r['quantity'] for r in read_journal(restarted.journal_path)] == [6, 7]
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(path):
+    store = open_store(path)
+    store.adjust_quantity('3017620422003', 4)
+    store.upsert({'barcode': '5449000000996', 'name': 'Cola', 'quantity': 12})
+
+    assert store.compact()
+    assert os.path.getsize(store.journal_path) == 0
+    assert not os.path.exists(f"{store.journal_path}.compacting")
+    on_disk = pd.read_csv(path, dtype={'barcode': str}).set_index('barcode')
+    assert on_disk.loc['3017620422003', 'quantity'] == 7
+    assert on_disk.loc['5449000000996', 'name'] == 'Cola'
+    # Nothing left to fold in
+    assert not store.compact()
+
+
+def test_journal_left_by_a_dead_compaction_is_replayed(path):
+    store = open_store(path)
+    store.adjust_quantity('4006381333931', -5)
+    store._journal.close()
+    # The compactor rotated the journal away and died before the snapshot was written
+    os.replace(store.journal_path, f"{store.journal_path}.compacting")
+
+    restarted = open_store(path)
+    assert restarted.get('4006381333931')['quantity'] == 0
+    restarted.adjust_quantity('3017620422003', 1)
+    assert restarted.compact()
+    assert not os.path.exists(f"{store.journal_path}.compacting")
+    assert open_store(path).get('4006381333931')['quantity'] == 0
+
+
+def test_other_instances_tail_the_journal(path):
+    writer, reader = open_store(path), open_store(path)
+    assert reader.get('4006381333931')['quantity'] == 5
+
+    writer.adjust_quantity('4006381333931', 10)
+    writer.upsert({'barcode': '5449000000996', 'name': 'Cola'})
+    assert reader.get('4006381333931')['quantity'] == 15
+    assert reader.get('5449000000996')['name'] == 'Cola'
+    assert reader.stats()['tailed_records'] == 2
+
+    # After the writer compacts, the reader reloads the new snapshot
+    writer.compact(force=True)
+    writer.adjust_quantity('4006381333931', -1)
+    assert reader.get('4006381333931')['quantity'] == 14
+
+
+def test_string_values_from_other_writers_are_coerced(path):
+    store = open_store(path)
+    store.frame()
+    with open(store.journal_path, 'a') as f:
+        f.write(json.dumps({'op': 'quantity', 'barcode': '4006381333931', 'quantity': '8'}) + '\n')
+        f.write(json.dumps({'op': 'synced', 'barcode': '4006381333931', 'synced': 'false'}) + '\n')
+    product = open_store(path).get('4006381333931')
+    assert product['quantity'] == 8
+    assert product['synced'] is False
@@ -0,0 +1,17 @@
+"""
+Cross-process locking: worker processes running the app against the same
+data files lose no stock increments, never reuse an order ID and log one
+history row per adjustment, with the journal compacting meanwhile. A
+smaller run of bench/stress.py.
+"""
+from bench import stress
+
+
+def test_concurrent_workers_lose_no_updates(tmp_path):
+    workers, adjustments, orders = 4, 40, 10
+    result = stress.run(str(tmp_path), workers, adjustments, orders)
+
+    assert result['failed_workers'] == 0
+    assert result['quantity'] == workers * adjustments
+    assert len(result['order_ids']) == len(set(result['order_ids'])) == workers * orders
+    assert result['history_rows'] == workers * adjustments
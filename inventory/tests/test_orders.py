@@ -0,0 +1,93 @@
+"""
+Order IDs: time-ordered and unique within a millisecond, across a clock
+step back, between store instances sharing the log and after legacy
+whole-second IDs. Also the order log's status changes and filters.
+"""
+import threading
+
+import pytest
+
+from utils import orders
+from utils.orders import OrderIdGenerator, OrderStore, order_id_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable stand-in for time.time() as orders.py sees it."""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(orders.time, 'time', lambda: now[0])
+    return now
+
+
+def test_ids_within_one_millisecond_get_a_sequence(clock):
+    ids = OrderIdGenerator()
+    assert [ids.next() for _ in range(3)] == ['1700000000000-000', '1700000000000-001', '1700000000000-002']
+
+
+def test_sequence_rolls_over_into_the_next_millisecond(clock):
+    ids = OrderIdGenerator('1700000000000-998')
+    assert [ids.next() for _ in range(3)] == ['1700000000000-999', '1700000000001-000', '1700000000001-001']
+
+
+def test_ids_never_go_backwards_with_the_clock(clock):
+    ids = OrderIdGenerator()
+    first = ids.next()
+    clock[0] -= 5
+    second = ids.next()
+    assert order_id_key(second) > order_id_key(first)
+    assert second > first
+
+
+def test_legacy_ids_sort_with_new_ones():
+    assert order_id_key('1700000000') == (1_700_000_000_000, 0)
+    assert order_id_key('garbage') == (-1, 0)
+    ids = OrderIdGenerator('9999999999')
+    assert order_id_key(ids.next()) > order_id_key('9999999999')
+
+
+def test_ids_are_unique_across_threads():
+    ids = OrderIdGenerator()
+    made = []
+
+    def place():
+        made.extend(ids.next() for _ in range(500))
+
+    threads = [threading.Thread(target=place) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(made)) == len(made) == 4000
+
+
+def test_stores_sharing_a_log_continue_after_each_other(tmp_path, clock):
+    path = str(tmp_path / 'orders.csv')
+    first, second = OrderStore(path), OrderStore(path)
+    a = first.place([{'barcode': '4006381333931', 'quantity': 1}])[0]
+    # Same millisecond: the second store reads the first one's order before numbering
+    b = second.place([{'barcode': '4006381333931', 'quantity': 2}])[0]
+    assert order_id_key(b['order_id']) > order_id_key(a['order_id'])
+    assert [o['order_id'] for o in first.query()] == [a['order_id'], b['order_id']]
+
+
+def test_lines_placed_together_share_a_po_id(tmp_path):
+    store = OrderStore(str(tmp_path / 'orders.csv'))
+    placed = store.place([{'barcode': '4006381333931', 'quantity': 1}, {'barcode': '3017620422003', 'quantity': 2}])
+    assert {o['po_id'] for o in placed} == {placed[0]['order_id']}
+    assert store.place([{'barcode': '1', 'quantity': 1}])[0]['po_id'] == ''
+
+
+def test_status_changes_and_filters(tmp_path):
+    path = str(tmp_path / 'orders.csv')
+    store = OrderStore(path)
+    first = store.place([{'barcode': '0067800002467', 'quantity': 1}])[0]
+    second = store.place([{'barcode': '3017620422003', 'quantity': 1}])[0]
+    assert store.set_status(first['order_id'], 'received')['status'] == 'received'
+    assert store.set_status('nope', 'received') is None
+
+    # Any EAN/UPC form of the barcode finds the order
+    assert [o['order_id'] for o in store.query(barcode='067800002467')] == [first['order_id']]
+    assert [o['order_id'] for o in store.query(open_only=True)] == [second['order_id']]
+    assert [o['order_id'] for o in store.query(limit=1)] == [second['order_id']]
+    # The status change was appended; a fresh reader sees the last row win
+    assert OrderStore(path).get(first['order_id'])['status'] == 'received'
@@ -0,0 +1,89 @@
+"""
+GET /inventory/count: offset and cursor paging, sorting, filtering and
+projection, and ETag revalidation against the inventory version.
+"""
+import pytest
+
+PRODUCTS = [
+    {'barcode': f'400638133{i:04d}', 'name': f'Product {i}', 'category': 'Snacks' if i % 2 else 'Drinks',
+     'quantity': i, 'threshold': 3, 'price': 10 - i}
+    for i in range(7)
+]
+
+
+@pytest.fixture
+def client(app_client, seed_inventory):
+    seed_inventory(PRODUCTS)
+    return app_client
+
+
+def barcodes(items):
+    return [item['barcode'] for item in items]
+
+
+def test_without_parameters_the_whole_list_is_returned(client):
+    response = client.get('/inventory/count')
+    assert response.status_code == 200
+    assert barcodes(response.get_json()) == [p['barcode'] for p in PRODUCTS]
+
+
+def test_offset_pages(client):
+    page = client.get('/inventory/count?limit=3&offset=3').get_json()
+    assert barcodes(page['items']) == [p['barcode'] for p in PRODUCTS[3:6]]
+    assert (page['total'], page['offset'], page['limit']) == (7, 3, 3)
+    assert client.get('/inventory/count?limit=3&offset=6').get_json()['next_cursor'] is None
+
+
+def test_cursor_pages_cover_everything_once_while_products_are_added(client):
+    seen = []
+    page = client.get('/inventory/count?limit=3').get_json()
+    seen += barcodes(page['items'])
+    # Added mid-listing: it lands after the cursor, so nothing shifts or repeats
+    client.post('/inventory/add', data={'barcode': '5449000000996', 'name': 'Cola'})
+    while page['next_cursor'] is not None:
+        page = client.get(f"/inventory/count?limit=3&cursor={page['next_cursor']}").get_json()
+        seen += barcodes(page['items'])
+    assert seen == [p['barcode'] for p in PRODUCTS] + ['5449000000996']
+
+
+def test_sort_filter_and_fields(client):
+    page = client.get('/inventory/count?sort=-quantity&category=snacks&fields=barcode,quantity&limit=2').get_json()
+    assert page['items'] == [{'barcode': PRODUCTS[5]['barcode'], 'quantity': 5},
+                             {'barcode': PRODUCTS[3]['barcode'], 'quantity': 3}]
+    assert page['total'] == 3
+    # Sorted listings page by offset only
+    assert page['next_cursor'] is None
+
+    low = client.get('/inventory/count?low_stock=1&limit=10').get_json()
+    assert barcodes(low['items']) == [p['barcode'] for p in PRODUCTS[:4]]
+
+
+def test_bad_parameters_are_rejected(client):
+    assert client.get('/inventory/count?fields=nope').status_code == 400
+    assert client.get('/inventory/count?sort=-nope').status_code == 400
+    assert client.get('/inventory/count?colour=red').status_code == 400
+    assert client.get('/inventory/count?limit=0').status_code == 400
+    assert client.get('/inventory/count?limit=2&offset=-1').status_code == 400
+
+
+def test_ndjson_streams_one_product_per_line(client):
+    response = client.get('/inventory/count?format=ndjson&category=Drinks')
+    lines = response.get_data(as_text=True).splitlines()
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(lines) == 4
+
+
+def test_etag_revalidation(client):
+    first = client.get('/inventory/count?limit=2')
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    unchanged = client.get('/inventory/count?limit=2', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers['ETag'] == etag
+
+    client.post('/inventory/adjust-stock', json={'barcode': PRODUCTS[0]['barcode'], 'adjustment': 1})
+    changed = client.get('/inventory/count?limit=2', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['items'][0]['quantity'] == 1
@@ -0,0 +1,140 @@
+"""
+Stock-history rollups: hourly/daily/weekly buckets (level, low/high, net
+change, units consumed), rolled up incrementally and without counting late
+scans as changes; daily usage from them, and GET /inventory/forecast.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.barcode import normalize_barcode
+from utils.history import HistoryStore
+from utils.rollups import StockRollups, bucket_labels, bucket_starts
+
+BARCODE = '0067800002467'
+
+SCANS = [
+    (BARCODE, '2024-01-01T08:00:00', 10),
+    (BARCODE, '2024-01-01T12:00:00', 7),
+    # A restock consumes nothing
+    (BARCODE, '2024-01-01T15:00:00', 9),
+    (BARCODE, '2024-01-02T09:00:00', 4),
+    ('5449000000996', '2024-01-02T10:00:00', 20),
+]
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.sqlite3'))
+    history.append_many(SCANS)
+    return history
+
+
+def test_weeks_start_on_monday():
+    seconds = pd.to_datetime(['2024-01-03T10:00', '2024-01-07T23:00', '2024-01-08T00:00']).to_numpy()
+    starts = bucket_starts(seconds.astype('datetime64[s]').astype(np.int64), 'week')
+    assert bucket_labels(starts, 'week').tolist() == ['2024-01-01', '2024-01-01', '2024-01-08']
+    assert bucket_labels(starts[:1], 'hour').tolist() == ['2024-01-01T00:00:00']
+
+
+def test_daily_and_weekly_buckets(history):
+    rollups = StockRollups(history.path)
+    assert rollups.update() == len(SCANS)
+    assert rollups.query(BARCODE) == [
+        {'date': '2024-01-01', 'quantity': 9, 'low': 7, 'high': 10, 'change': -1, 'consumed': 3, 'samples': 3},
+        {'date': '2024-01-02', 'quantity': 4, 'low': 4, 'high': 4, 'change': -5, 'consumed': 5, 'samples': 1},
+    ]
+    assert rollups.query(BARCODE, bucket='week') == [
+        {'date': '2024-01-01', 'quantity': 4, 'low': 4, 'high': 10, 'change': -6, 'consumed': 8, 'samples': 4},
+    ]
+    assert [b['date'] for b in rollups.query(BARCODE, bucket='hour')] == [
+        '2024-01-01T08:00:00', '2024-01-01T12:00:00', '2024-01-01T15:00:00', '2024-01-02T09:00:00']
+
+
+def test_query_bounds_limit_and_barcode_forms(history):
+    rollups = StockRollups(history.path)
+    rollups.update()
+    # Any EAN/UPC form of the barcode; bounds select the buckets they overlap
+    assert [b['date'] for b in rollups.query('067800002467', since='2024-01-02T18:00')] == ['2024-01-02']
+    assert [b['date'] for b in rollups.query(BARCODE, until='2024-01-01T23:59')] == ['2024-01-01']
+    assert [b['date'] for b in rollups.query(BARCODE, bucket='hour', limit=2)] == [
+        '2024-01-01T15:00:00', '2024-01-02T09:00:00']
+    with pytest.raises(ValueError):
+        rollups.query(BARCODE, bucket='month')
+    with pytest.raises(ValueError):
+        rollups.query(BARCODE, since='yesterday-ish')
+
+
+def test_incremental_updates_match_one_pass(tmp_path, history):
+    whole = StockRollups(history.path)
+    whole.update()
+    other = HistoryStore(str(tmp_path / 'other.sqlite3'))
+    batched = StockRollups(other.path, batch_rows=2)
+    for scan in SCANS:
+        other.append_many([scan])
+        batched.update()
+    for bucket in ('hour', 'day', 'week'):
+        assert batched.query(BARCODE, bucket) == whole.query(BARCODE, bucket)
+    assert batched.stats()['rolled_up_to_id'] == len(SCANS)
+    # Nothing new: nothing rolled up twice
+    assert batched.update() == 0
+
+
+def test_late_scans_count_no_change(history):
+    rollups = StockRollups(history.path)
+    rollups.update()
+    history.append_many([(BARCODE, '2024-01-01T10:00:00', 1)])
+    rollups.update()
+    [first_day, _] = rollups.query(BARCODE)
+    assert (first_day['quantity'], first_day['low'], first_day['consumed'], first_day['samples']) == (9, 1, 3, 4)
+
+
+def test_usage_averages_daily_consumption(history):
+    rollups = StockRollups(history.path)
+    rollups.update()
+    usage = rollups.usage(days=28, now=datetime(2024, 1, 3, 12))
+    # 8 units consumed since the first scan's day, 2.5 days before
+    assert usage.to_dict() == {normalize_barcode(BARCODE): pytest.approx(3.2)}
+    # Outside the window nothing was consumed
+    assert rollups.usage(days=28, now=datetime(2024, 3, 1)).empty
+
+
+@pytest.fixture
+def client(app_client, seed_inventory):
+    seed_inventory([
+        {'barcode': '4006381333931', 'name': 'Ballpoint Pen', 'quantity': 4},
+        {'barcode': '3017620422003', 'name': 'Hazelnut Spread', 'quantity': 30},
+        {'barcode': '5449000000996', 'name': 'Cola', 'quantity': 12},
+    ])
+    return app_client
+
+
+def log_scans(client, scans):
+    now = datetime.now()
+    response = client.post('/inventory/log-scan/batch', json={'scans': [
+        {'barcode': barcode, 'current_qty': quantity, 'timestamp': (now - timedelta(days=days_ago)).isoformat()}
+        for barcode, days_ago, quantity in scans
+    ]})
+    assert response.get_json()['rejected'] == []
+    # Bucketed history flushes the writer and catches the rollups up
+    assert client.get(f'/inventory/stock-history?barcode={scans[0][0]}&bucket=day').status_code == 200
+
+
+def test_forecast_orders_by_stockout(client):
+    log_scans(client, [
+        ('4006381333931', 2, 10), ('4006381333931', 1, 4),
+        ('3017620422003', 2, 32), ('3017620422003', 1, 30),
+        # Restocked only: no usage, so no forecast
+        ('5449000000996', 1, 12),
+    ])
+    forecast = client.get('/inventory/forecast').get_json()
+    assert [item['barcode'] for item in forecast] == ['4006381333931', '3017620422003']
+    for item in forecast:
+        assert item['days_to_stockout'] == pytest.approx(item['quantity'] / item['daily_usage'], rel=0.01, abs=0.1)
+    assert forecast[0]['daily_usage'] == pytest.approx(3 * forecast[1]['daily_usage'], abs=0.01)
+
+    assert client.get('/inventory/forecast?limit=1').get_json() == forecast[:1]
+    assert client.get('/inventory/forecast?barcode=3017620422003').get_json() == forecast[1:]
+    assert client.get('/inventory/forecast?limit=0').status_code == 400
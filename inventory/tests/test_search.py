@@ -0,0 +1,101 @@
+"""
+Full-text product search: tokenizing, ranking (field weights, exact over
+prefix over fuzzy matches), typo tolerance and keeping the index current
+as products change.
+"""
+import pandas as pd
+import pytest
+
+from utils.search import SearchIndex, edit_distance, tokenize
+from utils.store import InventoryStore
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    products = {
+        1: {'name': 'Dark Chocolate Bar', 'category': 'Sweets', 'manufacturer': 'Lindt'},
+        2: {'name': 'Chocolate Milk', 'category': 'Dairy', 'manufacturer': 'Nestle'},
+        3: {'name': 'Whole Milk', 'category': 'Dairy', 'description': 'fresh chocolate-free milk'},
+        4: {'name': 'Crème Fraîche', 'category': 'Dairy'},
+        5: {'name': 'Chocolatier Selection', 'category': 'Sweets'},
+        6: {'name': 'Coke 330ml', 'category': 'Drinks', 'description': 'code 5449000000996'},
+    }
+    for doc_id, record in products.items():
+        index.add(doc_id, record)
+    return index
+
+
+def test_tokenize_lowercases_and_strips_accents():
+    assert tokenize('Crème Fraîche, 200g!') == ['creme', 'fraiche', '200g']
+    assert tokenize(None) == []
+    assert tokenize(float('nan')) == []
+
+
+def test_edit_distance_stops_past_the_limit():
+    assert edit_distance('chocolate', 'choclate', 2) == 1
+    assert edit_distance('milk', 'chocolate', 2) == 3
+
+
+def test_every_term_must_match(index):
+    assert index.search('chocolate milk') == [2, 3]
+    assert index.search('chocolate sweets lindt') == [1]
+    assert index.search('chocolate xylophone') == []
+    assert index.search('') == []
+
+
+def test_name_outranks_description(index):
+    results = index.search('chocolate')
+    # A name match weighs more than the same word in the description
+    assert results.index(2) < results.index(3)
+
+
+def test_exact_match_outranks_prefix(index):
+    results = index.search('chocolate', limit=10)
+    assert results.index(1) < results.index(5)
+    # 'chocolatier' only matches as a prefix
+    assert 5 in index.search('chocola')
+
+
+def test_typos_match_fuzzily(index):
+    assert index.search('choclate bar') == [1]
+    assert index.search('mlk whole') == [3]
+    assert index.search('creme fraiche') == [4]
+
+
+def test_numeric_terms_are_not_fuzzy(index):
+    assert index.search('5449000000996') == [6]
+    assert index.search('5449000000997') == []
+
+
+def test_limit_caps_results(index):
+    assert len(index.search('dairy', limit=2)) == 2
+
+
+def test_readding_a_document_replaces_its_tokens(index):
+    index.add(2, {'name': 'Oat Drink', 'category': 'Drinks'})
+    assert 2 not in index.search('chocolate')
+    assert index.search('oat') == [2]
+    index.remove(2)
+    assert index.search('oat') == []
+    assert len(index) == 5
+
+
+def test_store_search_follows_upserts(tmp_path):
+    path = str(tmp_path / 'inventory.csv')
+    pd.DataFrame({
+        'barcode': ['4006381333931', '3017620422003'],
+        'name': ['Ballpoint Pen', 'Hazelnut Spread'],
+        'category': ['Office', 'Food'],
+        'quantity': [5, 3],
+    }).to_csv(path, index=False)
+    store = InventoryStore(path, compact_interval=0)
+
+    [label] = store.search('hazlenut')
+    assert store.frame().at[label, 'barcode'] == '3017620422003'
+
+    store.upsert({'barcode': '3017620422003', 'name': 'Cocoa Spread'})
+    store.upsert({'barcode': '5449000000996', 'name': 'Hazelnut Wafers', 'category': 'Food'})
+    names = [store.frame().at[label, 'name'] for label in store.search('hazelnut')]
+    assert names == ['Hazelnut Wafers']
+    assert len(store.search('spread')) == 1
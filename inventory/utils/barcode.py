@@ -1,41 +1,281 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import timed
+
+
+def gtin_check_digit(body):
+    """Computes the GS1 check digit for a GTIN body (all digits but the last)."""
+    total = 0
+    for i, d in enumerate(reversed(body)):
+        total += int(d) * (3 if i % 2 == 0 else 1)
+    return str((10 - total % 10) % 10)
+
+
+def normalize_barcode(barcode):
+    """
+    Returns the key under which a barcode is indexed.
+
+    EAN-8, UPC-A, EAN-13 and GTIN-14 codes are all zero-padded to GTIN-14, so
+    06782900, 6782900 and 00000006782900 (or 067800002467 and 0067800002467)
+    map to the same key. Codes that only validate once a check digit is
+    appended (a 7/11/12 digit body) get it appended. Anything that is not a
+    plain digit string (e.g. MANUAL_... codes) is matched case-insensitively.
+
+    8-digit codes are read as EAN-8, never expanded as UPC-E: the two can't
+    be told apart from the digits alone. So 06782900 (a valid EAN-8) stays
+    a different key from 067800002467, which has no UPC-E form anyway.
+    """
+    code = str(barcode if barcode is not None else '').strip()
+    if not (code.isascii() and code.isdigit()) or len(code) > 14:
+        return code.lower()
+    padded = code.zfill(14)
+    if gtin_check_digit(padded[:-1]) == padded[-1]:
+        return padded
+    if len(code) in (7, 11, 12):
+        return (code + gtin_check_digit(code)).zfill(14)
+    return padded
+
+
+def _check_digits(bodies):
+    # GS1 check digits of GTIN bodies given as int64s, all at once
+    total = np.zeros_like(bodies)
+    for position in range(13):
+        total += bodies // 10 ** position % 10 * (3 if position % 2 == 0 else 1)
+    return (10 - total % 10) % 10
+
+def normalize_barcodes(barcodes):
+    """normalize_barcode for a whole column at once; returns a Series of keys aligned with barcodes."""
+    codes = pd.Series(barcodes, dtype=object).fillna('').astype(str).str.strip()
+    numeric = codes.str.fullmatch(r'[0-9]{1,14}').to_numpy(dtype=bool)
+    keys = codes.copy()
+    keys[~numeric] = codes[~numeric].str.lower()
+    if numeric.any():
+        # As numbers, zero-padding is free: only the check digit needs computing
+        plain = codes[numeric]
+        values = plain.astype(np.int64).to_numpy()
+        append = _check_digits(values // 10) != values % 10
+        # A 7/11/12 digit body that only validates with a check digit appended
+        append[append] = plain[append].str.len().isin([7, 11, 12]).to_numpy()
+        values = np.where(append, values * 10 + _check_digits(values), values)
+        keys[numeric] = pd.Series(values, index=plain.index).astype(str).str.zfill(14)
+    return keys
+
+
+OPENFOODFACTS_URL = "https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
+UPCITEMDB_URL = "https://api.upcitemdb.com/prod/trial/lookup?upc={barcode}"
 
-def lookup_barcode(barcode):
+# Overall time budget of one lookup, and how long the top provider gets on its
+# own before the lower-priority ones are queried in parallel (hedging)
+LOOKUP_DEADLINE = 5.0
+HEDGE_DELAY = 0.25
+
+_session = None
+_session_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='barcode-lookup')
+# Separate pool for whole lookups in lookup_barcodes(), so batch lookups never
+# wait on provider calls queued behind themselves
+_batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='barcode-batch')
+# End (time.monotonic()) of the lookup a provider call on this thread belongs to
+_call = threading.local()
+
+
+def _http():
+    """Returns the shared keep-alive session used for all provider requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+class ProviderError(Exception):
+    """A provider could not answer (network error, rate limit, bad payload)."""
+
+
+def _remaining():
+    """Seconds left of the current lookup's deadline (LOOKUP_DEADLINE outside of one)."""
+    end = getattr(_call, 'end', None)
+    return LOOKUP_DEADLINE if end is None else end - time.monotonic()
+
+
+def _within(end, lookup, barcode):
+    # Runs a provider with the lookup's deadline visible to _get_json()
+    _call.end = end
     try:
-        url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
-        r = requests.get(url, timeout=5)
-        if r.status_code == 200:
-            d = r.json()
-            if d.get("status") == 1:
-                p = d["product"]
-                if p.get("product_name") and p.get("product_name").strip():
-                    return {
-                        "barcode": barcode,
-                        "name": p.get("product_name"),
-                        "brand": p.get("brands"),
-                        "category": p.get("categories"),
-                        "image_url": p.get("image_front_small_url")
-                    }
-    except Exception:
-        pass
-    
+        return lookup(barcode)
+    finally:
+        _call.end = None
+
+
+def _get_json(url):
+    # A request never outlives the lookup it was made for
+    timeout = _remaining()
+    if timeout <= 0:
+        raise ProviderError(f"Deadline passed before requesting {url}")
+    try:
+        r = _http().get(url, timeout=timeout)
+    except requests.RequestException as e:
+        raise ProviderError(str(e)) from e
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise ProviderError(f"HTTP {r.status_code} from {url}")
     try:
-        url = f"https://api.upcitemdb.com/prod/trial/lookup?upc={barcode}"
-        r = requests.get(url, timeout=5)
-        if r.status_code == 200:
-            d = r.json()
-            items = d.get("items", [])
-            if items:
-                p = items[0]
-                if p.get("title") and p.get("title").strip():
-                    return {
-                        "barcode": barcode,
-                        "name": p.get("title"),
-                        "brand": p.get("brand"),
-                        "category": p.get("category"),
-                        "image_url": p.get("images", [None])[0]
-                    }
-    except Exception:
+        return r.json()
+    except ValueError as e:
+        raise ProviderError(f"Invalid JSON from {url}") from e
+
+
+def lookup_openfoodfacts(barcode):
+    """Returns the product from Open Food Facts, None if it has none, or raises ProviderError."""
+    d = _get_json(OPENFOODFACTS_URL.format(barcode=barcode))
+    if d and d.get("status") == 1:
+        p = d["product"]
+        if p.get("product_name") and p.get("product_name").strip():
+            return {
+                "barcode": barcode,
+                "name": p.get("product_name"),
+                "brand": p.get("brands"),
+                "category": p.get("categories"),
+                "image_url": p.get("image_front_small_url")
+            }
+    return None
+
+
+def lookup_upcitemdb(barcode):
+    """Returns the product from UPCitemdb, None if it has none, or raises ProviderError."""
+    d = _get_json(UPCITEMDB_URL.format(barcode=barcode))
+    items = (d or {}).get("items", [])
+    if items:
+        p = items[0]
+        if p.get("title") and p.get("title").strip():
+            return {
+                "barcode": barcode,
+                "name": p.get("title"),
+                "brand": p.get("brand"),
+                "category": p.get("category"),
+                "image_url": (p.get("images") or [None])[0]
+            }
+    return None
+
+
+_providers = []
+_providers_lock = threading.Lock()
+
+
+def register_provider(name, lookup, priority=100):
+    """
+    Adds (or replaces) a product data source. lookup(barcode) must return a
+    product dict with at least 'name', None if the source doesn't know the
+    code, or raise if it couldn't answer. Lower priority values win.
+    """
+    with _providers_lock:
+        _providers[:] = [p for p in _providers if p[1] != name]
+        _providers.append((priority, name, lookup))
+        _providers.sort(key=lambda p: p[0])
+
+
+def unregister_provider(name):
+    with _providers_lock:
+        _providers[:] = [p for p in _providers if p[1] != name]
+
+
+def providers():
+    """Returns the registered provider names, highest priority first."""
+    with _providers_lock:
+        return [name for _, name, _ in _providers]
+
+
+register_provider('openfoodfacts', lookup_openfoodfacts, priority=10)
+register_provider('upcitemdb', lookup_upcitemdb, priority=20)
+
+
+@timed('lookup_providers')
+def _query_providers(barcode, deadline, hedge_delay):
+    """
+    Queries the providers concurrently and returns (product or {}, answered),
+    where answered is False if any provider failed or missed the deadline.
+
+    The top provider is asked first; if it hasn't produced a product within
+    hedge_delay, the others are asked in parallel. The answer of the highest
+    priority provider that has a product wins, but only providers that
+    finish before the deadline count, so a lookup takes at most deadline
+    seconds no matter how many providers there are.
+    """
+    with _providers_lock:
+        registered = list(_providers)
+    if not registered:
+        return {}, True
+    end = time.monotonic() + deadline
+    futures = [_executor.submit(_within, end, registered[0][2], barcode)]
+    try:
+        product = futures[0].result(timeout=min(hedge_delay, deadline))
+        if product:
+            return product, True
+    except Exception:  # slow or failed: hedge with the others
         pass
-    
-    return {}
\ No newline at end of file
+    futures += [_executor.submit(_within, end, lookup, barcode) for _, _, lookup in registered[1:]]
+
+    result, answered = {}, True
+    for future in futures:
+        try:
+            product = future.result(timeout=max(0.0, end - time.monotonic()))
+        except Exception:  # provider error or past the deadline
+            answered = False
+            continue
+        if product:
+            result = product
+            break
+    for future in futures:
+        future.cancel()
+    return result, answered
+
+
+@timed('lookup_barcode')
+def lookup_barcode(barcode, cache=None, deadline=LOOKUP_DEADLINE, hedge_delay=HEDGE_DELAY):
+    """
+    Looks barcode up in the registered product databases (see
+    register_provider) and returns the product found by the highest priority
+    one, or {} if none has it.
+
+    With a LookupCache, cached answers (including "not found") are returned
+    without any network call. A "not found" is only cached when every
+    provider actually answered, so outages are not remembered as misses.
+    """
+    if cache is not None:
+        hit, result = cache.get(barcode)
+        if hit:
+            return result
+
+    result, answered = _query_providers(barcode, deadline, hedge_delay)
+
+    if cache is not None and (result or answered):
+        cache.put(barcode, result)
+    return result
+
+
+def lookup_barcodes(barcodes, cache=None, deadline=LOOKUP_DEADLINE, hedge_delay=HEDGE_DELAY):
+    """
+    Looks up many barcodes concurrently with lookup_barcode(). Yields
+    (barcode, product or {}) pairs as the lookups finish, not in input order.
+    """
+    futures = {
+        _batch_executor.submit(lookup_barcode, barcode, cache, deadline, hedge_delay): barcode
+        for barcode in dict.fromkeys(barcodes)
+    }
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+        except Exception:
+            result = {}
+        yield futures[future], result
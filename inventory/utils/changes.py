@@ -0,0 +1,123 @@
+import collections
+import contextlib
+import threading
+import time
+
+from utils.serialization import dumps
+
+
+class ChangeFeed:
+    """
+    Recent row-level changes of one InventoryStore, numbered by a version
+    that goes up by one per event, for clients that follow the inventory
+    instead of refetching it (see GET /inventory/changes). Event types:
+    'upsert' (a new or edited product, whole row), 'quantity', 'synced',
+    'alert' (a product newly under or over stock) and 'reset' (the inventory
+    was reloaded or replaced: refetch it).
+
+    The last keep events are held in memory. A client that reconnects with
+    the last version it saw gets the events it missed, or a 'reset' if they
+    are gone. Events are only kept while clients listen, and for linger
+    seconds after the last one left (long polls and reconnects come back
+    within that). Otherwise the version still moves, so anyone resuming
+    from before then gets a reset.
+
+    Versions belong to one store instance (epoch). Behind several worker
+    processes each worker numbers its own feed; a client that reconnects to
+    another worker is told to reset rather than given wrong deltas.
+    """
+
+    def __init__(self, epoch, keep=10000, linger=60):
+        self.epoch = epoch
+        self.linger = linger
+        self.version = 0
+        self._events = collections.deque(maxlen=keep)
+        # Every event after this version is in _events
+        self._floor = 0
+        self._listeners = 0
+        self._last_left = float('-inf')
+        self._cond = threading.Condition()
+
+    def listening(self):
+        return self._listeners > 0 or time.monotonic() - self._last_left < self.linger
+
+    @contextlib.contextmanager
+    def listen(self):
+        """Keeps events recorded for the duration of the block."""
+        with self._cond:
+            self._listeners += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._listeners -= 1
+                self._last_left = time.monotonic()
+
+    def skip(self):
+        """
+        Moves the version past a change that is not recorded as events, so
+        that resuming from before it takes a reset.
+        """
+        with self._cond:
+            self.version += 1
+            self._floor = self.version
+            self._events.clear()
+            self._cond.notify_all()
+
+    def publish(self, events):
+        """Numbers events (dicts with a 'type') and wakes the clients waiting for them."""
+        with self._cond:
+            if not self.listening():
+                # The last listener may have gone while the events were being made
+                self.skip()
+                return
+            for event in events:
+                self.version += 1
+                event['version'] = self.version
+                if len(self._events) == self._events.maxlen:
+                    self._floor = self._events[0]['version']
+                self._events.append(event)
+            self._cond.notify_all()
+
+    def since(self, version):
+        """Events after version, oldest first, or None if they can't all be replayed."""
+        with self._cond:
+            if version < self._floor or version > self.version:
+                return None
+            # Versions in _events are consecutive, so the first one after version is at a known offset
+            start = version - self._events[0]['version'] + 1 if self._events else 0
+            return list(self._events)[max(start, 0):]
+
+    def wait(self, version, timeout):
+        """Blocks until there are events after version, or for timeout seconds. Returns True if there are."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version > version, timeout)
+
+    def position(self, last_event_id):
+        """
+        The version a client resumes from, given the id of the last event it
+        saw ('<epoch>-<version>', or a bare version of this epoch); None if
+        it has to start over.
+        """
+        epoch, _, version = str(last_event_id or '').strip().rpartition('-')
+        if epoch and epoch != self.epoch:
+            return None
+        try:
+            return int(version)
+        except ValueError:
+            return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'kept_events': len(self._events),
+                'listeners': self._listeners,
+            }
+
+
+def sse_event(event, epoch):
+    """One server-sent event: its id lets EventSource resume after the event."""
+    return (f"id: {epoch}-{event['version']}\nevent: {event['type']}\ndata: ".encode('utf-8')
+            + dumps(event) + b"\n\n")
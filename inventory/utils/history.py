@@ -0,0 +1,349 @@
+import atexit
+import csv
+import io
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from utils.barcode import normalize_barcode
+
+logger = logging.getLogger(__name__)
+
+# How hard SQLite syncs history commits: 'full' fsyncs every commit, 'normal'
+# (WAL) only at checkpoints, 'off' leaves it to the OS
+FSYNC_POLICIES = {'full': 'FULL', 'normal': 'NORMAL', 'off': 'OFF'}
+
+
+def parse_quantity(value):
+    """Returns value as an int stock level, or None if it isn't a number."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(value):
+    """
+    Returns value (an ISO 8601 date or timestamp string) as the naive local
+    ISO timestamp history rows are stored with, or None if it isn't one.
+    Timestamps with an offset are converted to local time.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+class HistoryStore:
+    """
+    Stock-level history (barcode, timestamp, quantity) in SQLite, indexed on
+    (normalized barcode, timestamp), so one product's history costs an index
+    range scan no matter how many scans the whole store has logged.
+
+    Rows of the legacy append-only CSV (data/stock_history.csv) are imported
+    on open. The imported byte offset is remembered, so rows that other
+    tools still append to the CSV are picked up on the next open.
+    """
+
+    def __init__(self, path, legacy_csv=None, fsync='normal'):
+        self.path = path
+        self.legacy_csv = legacy_csv
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Other worker processes may hold the write lock briefly; wait rather than fail
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={FSYNC_POLICIES[fsync]}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " id INTEGER PRIMARY KEY,"
+            " key TEXT NOT NULL,"
+            " barcode TEXT NOT NULL,"
+            " ts TEXT NOT NULL,"
+            " quantity INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS history_key_ts ON history (key, ts)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        if legacy_csv:
+            self.import_csv(legacy_csv)
+
+    def _meta(self, name, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def import_csv(self, csv_path):
+        """Imports rows appended to csv_path since the last import. Returns the number imported."""
+        if not os.path.exists(csv_path):
+            return 0
+        with self._lock:
+            # IMMEDIATE takes the write lock before the offset is read, so
+            # processes opening the store at once don't import rows twice
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                offset = int(self._meta(f"imported:{os.path.abspath(csv_path)}", 0))
+                with open(csv_path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+                # Only whole lines; a partial last line is picked up next time
+                end = data.rfind(b'\n') + 1
+                rows = []
+                for row in csv.reader(io.StringIO(data[:end].decode('utf-8', 'replace'))):
+                    # Expect each row to have at least 3 fields: barcode, date, quantity
+                    if len(row) >= 3 and parse_quantity(row[2]) is not None:
+                        rows.append((normalize_barcode(row[0]), row[0], row[1], parse_quantity(row[2])))
+                self._conn.executemany("INSERT INTO history (key, barcode, ts, quantity) VALUES (?, ?, ?, ?)", rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                    (f"imported:{os.path.abspath(csv_path)}", str(offset + end)),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # Leave the connection usable for the next transaction
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            return len(rows)
+
+    def append_many(self, events):
+        """Appends (barcode, timestamp, quantity) events in one transaction."""
+        rows = []
+        for barcode, timestamp, quantity in events:
+            quantity = parse_quantity(quantity)
+            if quantity is not None:
+                rows.append((normalize_barcode(barcode), str(barcode), timestamp, quantity))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT INTO history (key, barcode, ts, quantity) VALUES (?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # Leave the connection usable, so the writer's retry can succeed
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def append(self, barcode, timestamp, quantity):
+        return self.append_many([(barcode, timestamp, quantity)])
+
+    def query(self, barcode, since=None, until=None, limit=None):
+        """
+        Returns [{'date', 'quantity'}] for barcode (any EAN/UPC form) in
+        timestamp order. since/until are inclusive ISO timestamp bounds; with
+        a limit, the most recent rows are returned (still oldest first).
+        """
+        sql = "SELECT ts, quantity, id FROM history WHERE key = ?"
+        params = [normalize_barcode(barcode)]
+        if since:
+            sql += " AND ts >= ?"
+            params.append(since)
+        if until:
+            # A bare date includes the whole day
+            sql += " AND ts <= ?"
+            params.append(until + 'T99' if len(until) == 10 else until)
+        if limit:
+            sql = f"SELECT ts, quantity, id FROM ({sql} ORDER BY ts DESC, id DESC LIMIT ?) ORDER BY ts, id"
+            params.append(int(limit))
+        else:
+            sql += " ORDER BY ts, id"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{'date': ts, 'quantity': quantity} for ts, quantity, _ in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """
+    Single background thread that writes history events to a HistoryStore
+    in batches (group commit). Request handlers only submit() and return.
+
+    A batch is written once it holds batch_size events or flush_interval
+    seconds after its first event arrived, whichever comes first. flush()
+    waits for everything submitted so far to be written (read-your-writes),
+    and close(), also run at interpreter exit, drains the queue.
+
+    A batch that can't be written stays pending: it is retried ahead of the
+    next batch, or every retry_interval seconds while nothing else arrives,
+    so events are never counted as written before they are.
+    """
+
+    def __init__(self, store, batch_size=500, flush_interval=0.2, retry_interval=5.0):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._flush_now = threading.Event()
+        self._submitted = 0
+        self._written = 0
+        # Events taken off the queue so far, and write attempts made
+        self._taken = 0
+        self._attempts = 0
+        # Events whose write failed, oldest first, retried with the next batch
+        self._retry = []
+        self.batches = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, events):
+        """Queues (barcode, timestamp, quantity) events for writing."""
+        events = list(events)
+        if not events:
+            return
+        with self._cond:
+            self._submitted += len(events)
+            self._queue.put(events)
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every event submitted before the call is written. Events
+        whose write failed before are tried once more. Returns False on
+        timeout or if some of them still couldn't be written.
+        """
+        with self._cond:
+            target = self._submitted
+            if self._written >= target:
+                return True
+            attempts = self._attempts
+            self._flush_now.set()
+            self._queue.put([])  # wakes the writer if it is waiting to fill a batch
+            self._cond.wait_for(
+                lambda: self._written >= target or (self._attempts > attempts and self._taken >= target), timeout)
+            return self._written >= target
+
+    def close(self, timeout=10):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.retry_interval if self._retry else None)
+            except queue.Empty:
+                item = []
+            if item is _STOP:
+                break
+            batch = list(item)
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._flush_now.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.extend(item)
+            # Whatever is already queued goes into this batch too
+            while not stop:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.extend(item)
+            self._flush_now.clear()
+            if batch or self._retry:
+                self._write(batch)
+        if self._retry:
+            self._write([])
+        if self._retry:
+            logger.error("Dropping %d history events that could not be written", len(self._retry))
+
+    def _write(self, batch):
+        with self._cond:
+            self._taken += len(batch)
+        # Failed events go first, so events are always written in the order submitted
+        events = self._retry + batch
+        for attempt in range(3):
+            try:
+                self.store.append_many(events)
+                written = True
+                break
+            except Exception:
+                logger.exception("Writing %d history events failed (attempt %d)", len(events), attempt + 1)
+                time.sleep(0.1 * (attempt + 1))
+        else:
+            written = False
+        with self._cond:
+            if written:
+                self._written += len(events)
+                self._retry = []
+                self.batches += 1
+            else:
+                self.failed += len(batch)
+                self._retry = events
+            self._attempts += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'submitted': self._submitted,
+                'written': self._written,
+                'pending': self._submitted - self._written,
+                'retrying': len(self._retry),
+                'batches': self.batches,
+                'failed': self.failed,
+            }
+
+
+_stores = {}
+_writers = {}
+_stores_lock = threading.Lock()
+
+
+def get_history_store(path, legacy_csv=None, **options):
+    """
+    Returns the shared HistoryStore for path, creating (and importing
+    legacy_csv into) it on first use. options (fsync) only apply then.
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = HistoryStore(path, legacy_csv, **options)
+        return store
+
+
+def get_history_writer(store, **options):
+    """
+    Returns the shared HistoryWriter of store, starting it on first use.
+    options (batch_size, flush_interval) only apply then.
+    """
+    with _stores_lock:
+        writer = _writers.get(id(store))
+        if writer is None:
+            writer = _writers[id(store)] = HistoryWriter(store, **options)
+        return writer
+
+
+@atexit.register
+def _drain_writers():
+    # Nothing queued may be lost on shutdown
+    for writer in list(_writers.values()):
+        writer.close()
@@ -0,0 +1,232 @@
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional; originals are served in place of resized variants
+    Image = None
+
+from utils.result_cache import spool_and_hash
+
+logger = logging.getLogger(__name__)
+
+# Resized variants of every image: name -> longest edge in pixels
+IMAGE_VARIANTS = {'thumb': 96, 'display': 480}
+# Content-addressed files (originals and variants) never change once written
+HASHED_NAME = re.compile(r'^[0-9a-f]{32}(\.[a-z]+)?\.(jpg|png|gif|webp)$')
+
+
+def sniff_image_type(head):
+    """File extension for the image format that head (the first bytes) starts, or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def variant_name(name, variant):
+    """File name of an image's resized variant; GIFs are resized to PNG (first frame)."""
+    stem, ext = name.rsplit('.', 1)
+    return f"{stem}.{variant}.{'png' if ext == 'gif' else ext}"
+
+
+class ImageStore:
+    """
+    Product images stored under the SHA-256 of their content, so uploading
+    the same photo twice keeps one file. Resized variants (IMAGE_VARIANTS)
+    are made by a small thread pool after the upload has been answered,
+    never on the request thread; until a variant exists the original stands
+    in for it. Without Pillow installed only originals are kept.
+
+    External image URLs can be copied into the store the same way, so pages
+    stop hot-linking third-party CDNs.
+    """
+
+    def __init__(self, directory, url_prefix, variants=IMAGE_VARIANTS, workers=2, max_bytes=10 * 1024 * 1024):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip('/')
+        self.variants = dict(variants)
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.saved = 0
+        self.deduplicated = 0
+        self.variants_made = 0
+        self.remote_fetched = 0
+        self.remote_failed = 0
+        if Image is None and self.variants:
+            logger.warning("Pillow is not installed: no %s variants are made and every size serves "
+                           "the full original (pip install -r requirements.txt)", '/'.join(self.variants))
+
+    @property
+    def resizing(self):
+        """Whether variants are made at all (Pillow is installed)."""
+        return Image is not None and bool(self.variants)
+
+    def url(self, name):
+        return f"{self.url_prefix}/{name}"
+
+    def save(self, stream):
+        """
+        Stores the image read from stream and schedules its variants.
+        Returns its file name; raises ValueError if stream holds no
+        (supported) image or more than max_bytes.
+        """
+        spool, digest = spool_and_hash(stream)
+        with spool:
+            size = spool.seek(0, os.SEEK_END)
+            spool.seek(0)
+            if size > self.max_bytes:
+                raise ValueError(f"Image larger than {self.max_bytes} bytes")
+            ext = sniff_image_type(spool.read(16))
+            if ext is None:
+                raise ValueError("Not a PNG, JPEG, GIF or WebP image")
+            name = f"{digest[:32]}.{ext}"
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                with self._lock:
+                    self.deduplicated += 1
+            else:
+                spool.seek(0)
+                self._write(path, lambda f: shutil.copyfileobj(spool, f))
+                with self._lock:
+                    self.saved += 1
+        self.schedule_variants(name)
+        return name
+
+    def _write(self, path, write):
+        # write(file) into a temporary file next to path, then swap it in
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def schedule_variants(self, name):
+        """Makes the missing variants of name in the background (once at a time per image)."""
+        if not self.resizing:
+            return
+        with self._lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+        self._executor.submit(self._make_variants, name)
+
+    def _make_variants(self, name):
+        try:
+            with Image.open(os.path.join(self.directory, name)) as original:
+                image = ImageOps.exif_transpose(original)
+                for variant, edge in self.variants.items():
+                    target = variant_name(name, variant)
+                    path = os.path.join(self.directory, target)
+                    if os.path.exists(path):
+                        continue
+                    resized = image.copy()
+                    resized.thumbnail((edge, edge))
+                    if target.endswith('.jpg') and resized.mode != 'RGB':
+                        resized = resized.convert('RGB')
+                    image_format = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}[target.rsplit('.', 1)[1]]
+                    self._write(path, lambda f: resized.save(f, format=image_format, optimize=True))
+                    with self._lock:
+                        self.variants_made += 1
+        except Exception:
+            logger.exception("Resizing image %s failed", name)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def resolve(self, name, variant=None):
+        """
+        The file to serve for name, or for its variant: the variant when it
+        has been made, else the original (and the variant is scheduled).
+        """
+        if variant not in self.variants or '.' not in name or not os.path.isfile(os.path.join(self.directory, name)):
+            return name
+        target = variant_name(name, variant)
+        if os.path.exists(os.path.join(self.directory, target)):
+            return target
+        self.schedule_variants(name)
+        return name
+
+    def fetch(self, url, timeout=10):
+        """Copies the image at an external url into the store. Returns its file name, or None."""
+        try:
+            with requests.get(url, timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                body = io.BytesIO()
+                for block in response.iter_content(64 * 1024):
+                    body.write(block)
+                    if body.tell() > self.max_bytes:
+                        raise ValueError(f"Image larger than {self.max_bytes} bytes")
+            body.seek(0)
+            name = self.save(body)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Caching image %s failed: %s", url, e)
+            with self._lock:
+                self.remote_failed += 1
+            return None
+        with self._lock:
+            self.remote_fetched += 1
+        return name
+
+    def fetch_later(self, url, callback):
+        """fetch(url) in the background, then callback(local URL) if it worked."""
+        def run():
+            name = self.fetch(url)
+            if name is not None:
+                try:
+                    callback(self.url(name))
+                except Exception:
+                    logger.exception("Using cached image of %s failed", url)
+        self._executor.submit(run)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'resizing': self.resizing,
+                'resizing_disabled_reason': None if self.resizing else (
+                    'Pillow is not installed' if Image is None else 'no variants configured'),
+                'variants': self.variants,
+                'pending': len(self._pending),
+                'saved': self.saved,
+                'deduplicated': self.deduplicated,
+                'variants_made': self.variants_made,
+                'remote_fetched': self.remote_fetched,
+                'remote_failed': self.remote_failed,
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_image_store(directory, url_prefix, **options):
+    """
+    Returns the shared ImageStore for directory, creating it on first use.
+    options (variants, workers, max_bytes) only apply then.
+    """
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = ImageStore(directory, url_prefix, **options)
+        return store
@@ -0,0 +1,93 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from utils.analysis import SNIFF_BYTES, sniff_encoding
+from utils.inventory import INVENTORY_DTYPES, parse_dates
+
+IMPORT_EXTS = ('.csv', '.tsv', '.xls', '.xlsx', '.json')
+
+_TRUE_VALUES = {'true', '1', 'yes', 'y', 'on', 't'}
+_FALSE_VALUES = {'false', '0', 'no', 'n', 'off', 'f'}
+
+
+def read_table(stream, filename):
+    """
+    Reads an uploaded CSV/TSV/XLSX/JSON (array or lines) file into a
+    DataFrame of text, so product codes keep their leading zeros.
+    """
+    name = filename.lower()
+    if name.endswith(('.xls', '.xlsx')):
+        return pd.read_excel(stream, dtype=str, keep_default_na=False)
+    prefix = stream.read(SNIFF_BYTES)
+    stream.seek(0)
+    text = io.TextIOWrapper(stream, encoding=sniff_encoding(prefix), errors='replace', newline='')
+    try:
+        if name.endswith('.json'):
+            df = pd.read_json(text, lines=prefix.lstrip()[:1] != b'[', dtype=False)
+            return df.astype(object).where(df.notna(), '').astype(str)
+        sep = '\t' if name.endswith('.tsv') else ','
+        return pd.read_csv(text, sep=sep, dtype=str, keep_default_na=False)
+    finally:
+        text.detach()
+
+
+def coerce_import(df):
+    """
+    Validates and types imported rows whose columns are already named like
+    the inventory's, one column at a time. Blank cells stay missing (NA) so
+    that they leave stored values alone. Returns (rows, errors): the valid
+    rows, still labelled by position, and [{'row', 'error'}] for the others
+    (rows counted from 1, first problem of a row only).
+    """
+    # Index into messages of each row's first problem, -1 for none
+    problems = np.full(len(df), -1)
+    messages = []
+
+    def reject(invalid, message):
+        invalid = invalid & (problems < 0)
+        if invalid.any():
+            problems[invalid] = len(messages)
+            messages.append(message)
+
+    rows = {}
+    for column in df.columns:
+        dtype = INVENTORY_DTYPES.get(column)
+        if dtype is None:
+            continue
+        # Columns repeat few distinct values (categories, prices, dates...):
+        # every check and conversion runs once per distinct value
+        raw = df[column].fillna('') if df[column].hasnans else df[column]
+        codes, uniques = pd.factorize(raw.astype(str))
+        uniques = pd.Index(uniques, dtype=object).str.strip()
+        blank = (uniques == '')
+        if dtype in ('Int64', 'Float64'):
+            numbers = pd.to_numeric(uniques, errors='coerce')
+            retry = numbers.isna() & ~blank
+            if retry.any():
+                # Currency signs, spaces and the like around the number are fine
+                cleaned = pd.to_numeric(uniques[retry].str.replace(r'[^0-9.eE+\-]', '', regex=True), errors='coerce')
+                numbers = pd.Series(numbers).mask(retry, pd.Series(np.asarray(cleaned), index=np.flatnonzero(retry)))
+            numbers = pd.Series(numbers)
+            invalid = numbers.isna().to_numpy() & ~blank
+            values = (numbers.round() if dtype == 'Int64' else numbers).astype(dtype)
+        elif dtype == 'datetime64[ns]':
+            values = parse_dates(pd.Series(uniques))
+            invalid = values.isna().to_numpy() & ~blank
+        elif dtype == 'boolean':
+            lowered = uniques.str.lower()
+            truth = lowered.isin(_TRUE_VALUES)
+            invalid = ~(blank | truth | lowered.isin(_FALSE_VALUES))
+            values = pd.Series(pd.array(truth, dtype='boolean')).mask(blank)
+        else:
+            values = pd.Series(uniques).mask(blank)
+            invalid = np.zeros(len(uniques), dtype=bool)
+        reject(invalid[codes], f"invalid {column}" + (" (expected YYYY-MM-DD)" if dtype == 'datetime64[ns]' else ''))
+        if column == 'barcode':
+            reject(blank[codes], "missing barcode")
+        rows[column] = pd.Series(values.take(codes).array, index=df.index)
+    valid = problems < 0
+    rows = pd.DataFrame(rows, index=df.index)[valid]
+    errors = [{'row': int(i) + 1, 'error': messages[p]} for i, p in zip(df.index[~valid], problems[~valid])]
+    return rows, errors
@@ -1,63 +1,450 @@
+import numpy as np
 import pandas as pd
+import json
 import os
+import tempfile
+from collections import defaultdict
 from datetime import datetime
 
+from utils.metrics import timed
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # optional; without it no binary snapshot is kept and the CSV is parsed
+    pyarrow = None
+
+# Columns of an inventory and their types. Repeated strings are categorical,
+# numbers and flags use the nullable extension types and expiry is a date.
+INVENTORY_DTYPES = {
+    'barcode': 'object',
+    'name': 'object',
+    'category': 'category',
+    'quantity': 'Int64',
+    'cost': 'Float64',
+    'price': 'Float64',
+    'expiry': 'datetime64[ns]',
+    'threshold': 'Int64',
+    'distributor': 'category',
+    'manufacturer': 'category',
+    'synced': 'boolean',
+    'image_url': 'object',
+    'description': 'object'
+}
+INVENTORY_COLUMNS = list(INVENTORY_DTYPES)
+
+_TRUE_STRINGS = {'true', '1', 'yes', 'y', 'on', 't'}
+
+_NUMERIC_COLUMNS = [c for c, dtype in INVENTORY_DTYPES.items() if dtype in ('Int64', 'Float64')]
+
+def _by_unique(values, parse):
+    # Columns repeat few distinct values: parse each once and spread by code
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna(''), sort=False)
+    return parse(pd.Index(uniques, dtype=object)).take(codes)
+
+def parse_dates(values):
+    """YYYY-MM-DD (optionally followed by a time) to datetime64; anything else becomes NaT."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    days = _by_unique(values, lambda u: pd.to_datetime(u, format='%Y-%m-%d', exact=False, errors='coerce'))
+    return pd.Series(days, index=values.index if isinstance(values, pd.Series) else None)
+
+def parse_bools(values):
+    """'True'/'1'/'yes'/... to True, anything else to False, as a boolean column."""
+    truth = _by_unique(values, lambda u: u.astype(str).str.strip().str.lower().isin(_TRUE_STRINGS))
+    return pd.Series(pd.array(truth, dtype='boolean'), index=values.index if isinstance(values, pd.Series) else None)
+
+def enforce_schema(df):
+    """
+    Converts df's known columns to INVENTORY_DTYPES in place and returns it.
+    Missing numbers become 0, missing strings '', unparseable dates NaT;
+    columns outside the schema are kept as strings.
+    """
+    for column in df.columns:
+        dtype = INVENTORY_DTYPES.get(column, 'object')
+        values = df[column]
+        if dtype in ('Int64', 'Float64'):
+            values = pd.to_numeric(values, errors='coerce').fillna(0)
+            df[column] = (values.round() if dtype == 'Int64' else values).astype(dtype)
+        elif dtype == 'boolean':
+            if pd.api.types.is_bool_dtype(values):
+                df[column] = values.fillna(False).astype('boolean')
+            else:
+                # astype(bool) would make every non-empty string, "False" included, True
+                df[column] = parse_bools(values)
+        elif dtype == 'datetime64[ns]':
+            df[column] = parse_dates(values)
+        elif dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype) or values.hasnans:
+                df[column] = values.astype(object).fillna('').astype(str).astype('category')
+        elif values.dtype != object or values.hasnans:
+            df[column] = values.astype(object).fillna('').astype(str)
+    return df
+
+def plain_frame(df):
+    """
+    Returns df with plain values for JSON/CSV/SQL output: dates as YYYY-MM-DD
+    strings and missing values as '' (as the old fillna('') gave).
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            days = values.to_numpy().astype('datetime64[D]').astype(str)
+            values = pd.Series(days, index=df.index).where(values.notna().to_numpy(), '')
+        elif values.hasnans:
+            values = values.astype(object).where(values.notna(), '')
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def plain_row(df, label):
+    """
+    plain_frame(df.loc[[label]]) as a dict, built from the row's scalars:
+    far cheaper for one row than selecting and converting a frame.
+    """
+    row = {}
+    for column in df.columns:
+        value = df.at[label, column]
+        if pd.isna(value):
+            value = ''
+        elif isinstance(value, pd.Timestamp):
+            value = str(value.to_datetime64().astype('datetime64[D]'))
+        elif hasattr(value, 'item'):
+            value = value.item()  # numpy scalar to the Python value to_dict() gives
+        row[column] = value
+    return row
+
+def set_cell(df, label, column, value):
+    """Sets one cell, converting value to the column's type (adding a category if new)."""
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        value = '' if value is None else str(value)
+        if value not in values.cat.categories:
+            df[column] = values.cat.add_categories([value])
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        value = parse_dates([value]).iloc[0]
+    df.at[label, column] = value
+
+def set_cells(df, labels, column, values):
+    """set_cell for many rows at once: values (a Series) go to column at labels."""
+    current = df[column]
+    if isinstance(current.dtype, pd.CategoricalDtype):
+        values = values.astype(str)
+        missing = pd.Index(values.unique()).difference(current.cat.categories)
+        if len(missing):
+            df[column] = current = current.cat.add_categories(missing)
+        values = pd.Categorical(values, categories=current.cat.categories)
+    elif pd.api.types.is_datetime64_any_dtype(current):
+        values = parse_dates(values).array
+    else:
+        values = values.array
+    df.loc[labels, column] = values
+
+def append_rows(df, new_df):
+    """
+    Concatenates new_df (schema enforced) below df, keeping categorical
+    columns categorical by extending df's categories with any new values.
+    """
+    new_df = enforce_schema(new_df)
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and column in new_df.columns:
+            values = new_df[column].astype(str)
+            missing = pd.Index(values.unique()).difference(df[column].cat.categories)
+            if len(missing):
+                df[column] = df[column].cat.add_categories(missing)
+            new_df[column] = pd.Categorical(values, categories=df[column].cat.categories)
+    return pd.concat([df, new_df])
+
+def changed_rows(before, after):
+    """
+    Boolean mask over the rows of after: True where the row differs from the
+    row at the same position in before, or is past its end. Both frames must
+    have the same columns; missing values equal missing values.
+    """
+    n = len(before)
+    changed = pd.Series(True, index=range(len(after)))
+    same = pd.Series(True, index=range(n))
+    for column in after.columns:
+        old, new = before[column].array, after[column].array[:n]
+        # Categories may differ between the frames: compare the values
+        if isinstance(old.dtype, pd.CategoricalDtype):
+            old = old.astype(object)
+        if isinstance(new.dtype, pd.CategoricalDtype):
+            new = new.astype(object)
+        equal = pd.array(old == new, dtype='boolean').fillna(False).to_numpy(dtype=bool)
+        same &= equal | (pd.isna(old) & pd.isna(new))
+    changed.iloc[:n] = ~same.to_numpy()
+    return changed.to_numpy()
+
+@timed('load_inventory')
 def load_inventory(file_path):
     if os.path.exists(file_path):
-        # Read with dtype=str to prevent pandas from inferring types,
-        # then explicitly convert where needed.
-        df = pd.read_csv(file_path, dtype=str).fillna('')
-        
-        # Convert numeric columns after loading as string
-        for col in ['quantity', 'threshold']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-        for col in ['cost', 'price']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0).astype(float)
-        for col in ['synced']:
-            if col in df.columns:
-                df[col] = df[col].astype(bool) # Convert 'True'/'False' strings to actual booleans
-        return df
-    return pd.DataFrame(columns=[
-        'barcode','name','category','quantity','cost','price','expiry',
-        'threshold','distributor','manufacturer','synced','image_url','description'
-    ]).astype({
-        'barcode': 'str',
-        'name': 'str',
-        'category': 'str',
-        'quantity': 'int',
-        'cost': 'float',
-        'price': 'float',
-        'expiry': 'str',
-        'threshold': 'int',
-        'distributor': 'str',
-        'manufacturer': 'str',
-        'synced': 'bool',
-        'image_url': 'str',
-        'description': 'str'
-    })
+        # Numbers are parsed by the C reader (empty -> NaN), repeated strings
+        # read straight into categories and everything else kept as text, so
+        # barcodes keep their leading zeros; the schema does the rest
+        header = pd.read_csv(file_path, nrows=0).columns
+        dtypes = {c: INVENTORY_DTYPES.get(c, 'object') for c in header if c not in _NUMERIC_COLUMNS}
+        dtypes = {c: 'category' if d == 'category' else str for c, d in dtypes.items()}
+        na_values = {c: [''] for c in header if c in _NUMERIC_COLUMNS}
+        df = pd.read_csv(file_path, dtype=dtypes, keep_default_na=False, na_values=na_values)
+        return enforce_schema(df)
+    return enforce_schema(pd.DataFrame(columns=INVENTORY_COLUMNS))
 
 
 
+@timed('save_inventory')
 def save_inventory(file_path, df):
-    df.to_csv(file_path, index=False)
-
-def get_alerts(df):
-    now = datetime.utcnow().date()
-    alerts = {'expiry': [], 'understock': [], 'overstock': []}
-    for _, row in df.iterrows():
-        try:
-            exp = datetime.strptime(row['expiry'], '%Y-%m-%d').date()
-            days = (exp - now).days
-            if days in (7, 3, 1):
-                alerts['expiry'].append({'barcode': row['barcode'], 'days_to_expiry': days})
-        except Exception as e:
-            pass
-        qty = int(float(row.get('quantity', 0)))
-        thr = int(float(row.get('threshold', 0)))
-        if thr > 0 and qty <= thr:
-            alerts['understock'].append({'barcode': row['barcode'], 'quantity': qty, 'threshold': thr})
-        if thr > 0 and qty > thr * 10:
-            alerts['overstock'].append({'barcode': row['barcode'], 'quantity': qty, 'threshold': thr})
+    plain_frame(df).to_csv(file_path, index=False)
+
+def binary_snapshot_path(file_path):
+    return f"{file_path}.feather"
+
+def save_binary_snapshot(file_path, df, source_signature):
+    """
+    Writes df next to file_path as Arrow/Feather, a typed format that is
+    loaded as data only, tagged with the signature of the CSV it mirrors so
+    a stale one is never loaded. Does nothing without pyarrow: the data
+    directory is writable, so nothing that can run code on load (like a
+    pickle) is ever read from it.
+    """
+    if pyarrow is None:
+        return
+    path = binary_snapshot_path(file_path)
+    _replace_file(path, lambda tmp_path: df.reset_index(drop=True).to_feather(tmp_path))
+    # Written last: until then the old tag names the old CSV and nothing matches
+    _replace_file(f"{path}.json", lambda tmp_path: _write_json(tmp_path, {'source': list(source_signature)}))
+
+def _write_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+def _replace_file(path, write):
+    # write(tmp_path) into a unique temp file, then swap it in atomically
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@timed('load_binary_snapshot')
+def load_binary_snapshot(file_path, source_signature):
+    """Returns the binary snapshot of file_path if it matches source_signature, else None (always without pyarrow)."""
+    if pyarrow is None:
+        return None
+    path = binary_snapshot_path(file_path)
+    try:
+        with open(f"{path}.json") as f:
+            if tuple(json.load(f)['source']) != tuple(source_signature or ()):
+                return None
+        return pd.read_feather(path, memory_map=True)
+    except (OSError, ValueError, KeyError):
+        return None
+
+# Days-before-expiry on which an expiry alert fires, and how many times the
+# reorder threshold a quantity must exceed to count as overstock
+EXPIRY_WINDOWS = (7, 3, 1)
+OVERSTOCK_MULTIPLIER = 10
+# A reorder alert fires when stock at the product's daily usage runs out within this many days
+REORDER_DAYS = 7
+
+_EPOCH = pd.Timestamp('1970-01-01')
+# The columns of a row its alerts depend on
+ALERT_COLUMNS = ('barcode', 'expiry', 'quantity', 'threshold')
+
+
+def _alert_columns(df):
+    """
+    Parses the columns alerts depend on in one vectorized pass: expiry as a
+    day number (days since 1970-01-01, NaN if missing/invalid) and quantity
+    and threshold as ints.
+    """
+    if 'expiry' in df.columns:
+        expiry = pd.to_datetime(df['expiry'], format='%Y-%m-%d', errors='coerce')
+        expiry_day = (expiry - _EPOCH).dt.days
+    else:
+        expiry_day = pd.Series(float('nan'), index=df.index)
+    columns = [expiry_day]
+    for col in ['quantity', 'threshold']:
+        if col in df.columns:
+            columns.append(pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int))
+        else:
+            columns.append(pd.Series(0, index=df.index))
+    return columns
+
+
+def _alert_values(row):
+    """
+    _alert_columns() for a single row (a Series or dict), computed from its
+    scalars: (expiry day or None, quantity, threshold).
+    """
+    expiry = row.get('expiry')
+    day = None
+    if expiry is not None and not isinstance(expiry, pd.Timestamp):
+        expiry = pd.to_datetime(expiry, format='%Y-%m-%d', errors='coerce')
+    if expiry is not None and expiry is not pd.NaT:
+        day = (expiry - _EPOCH).days
+    values = [day]
+    for col in ('quantity', 'threshold'):
+        value = row.get(col, 0)
+        if not isinstance(value, (int, np.integer)) or isinstance(value, (bool, np.bool_)):
+            value = pd.to_numeric(value, errors='coerce')
+            value = 0 if pd.isna(value) else value
+        values.append(int(value))
+    return values
+
+
+def _today_day():
+    return (pd.Timestamp(datetime.utcnow().date()) - _EPOCH).days
+
+
+def _reorder_alerts(barcode, qty, usage, reorder_days):
+    """
+    Products whose stock lasts reorder_days or less at their daily usage,
+    soonest stockout first. barcode, qty and usage are Series on the same index.
+    """
+    days = qty.clip(lower=0) / usage.where(usage > 0)
+    days = days[days <= reorder_days].sort_values(kind='stable')
+    return [
+        {'barcode': barcode[label], 'quantity': int(qty[label]), 'daily_usage': round(float(usage[label]), 2),
+         'days_to_stockout': round(float(d), 1)}
+        for label, d in days.items()
+    ]
+
+
+@timed('get_alerts')
+def get_alerts(df, expiry_windows=EXPIRY_WINDOWS, overstock_multiplier=OVERSTOCK_MULTIPLIER, usage=None,
+               reorder_days=REORDER_DAYS):
+    """
+    Expiry, understock and overstock alerts of an inventory frame. With usage
+    (daily units consumed, a Series on df's index), also predictive 'reorder'
+    alerts for products that run out within reorder_days.
+    """
+    alerts = {'expiry': [], 'understock': [], 'overstock': [], 'reorder': []}
+    if df.empty:
+        return alerts
+    expiry_day, qty, thr = _alert_columns(df)
+    days = expiry_day - _today_day()
+    expiring = days.isin(list(expiry_windows))
+    alerts['expiry'] = [
+        {'barcode': b, 'days_to_expiry': int(d)}
+        for b, d in zip(df['barcode'][expiring], days[expiring])
+    ]
+    understock = (thr > 0) & (qty <= thr)
+    overstock = (thr > 0) & (qty > thr * overstock_multiplier)
+    for kind, mask in (('understock', understock), ('overstock', overstock)):
+        alerts[kind] = [
+            {'barcode': b, 'quantity': int(q), 'threshold': int(t)}
+            for b, q, t in zip(df['barcode'][mask], qty[mask], thr[mask])
+        ]
+    if usage is not None:
+        alerts['reorder'] = _reorder_alerts(df['barcode'], qty, usage.reindex(df.index), reorder_days)
     return alerts
+
+
+class AlertIndex:
+    """
+    Precomputed alert state for an inventory frame, kept up to date one row
+    at a time with update() instead of rescanning the frame per request.
+
+    Rows are bucketed by expiry day, so expiry alerts for any set of windows
+    are a few dict lookups; understock/overstock rows are kept as sets.
+    alerts() output is cached until a row changes or the day rolls over.
+    """
+
+    def __init__(self, df, overstock_multiplier=OVERSTOCK_MULTIPLIER):
+        self.overstock_multiplier = overstock_multiplier
+        self._rows = {}
+        self._by_expiry = defaultdict(set)
+        self._understock = set()
+        self._overstock = set()
+        self._cached = None
+        self._cache_key = None
+        if not df.empty:
+            expiry_day, qty, thr = _alert_columns(df)
+            for label, barcode, day, q, t in zip(df.index, df['barcode'], expiry_day, qty, thr):
+                self._add(label, barcode, None if day != day else int(day), int(q), int(t))
+
+    def _add(self, label, barcode, day, qty, thr):
+        self._rows[label] = (barcode, day, qty, thr)
+        if day is not None:
+            self._by_expiry[day].add(label)
+        if thr > 0 and qty <= thr:
+            self._understock.add(label)
+        if thr > 0 and qty > thr * self.overstock_multiplier:
+            self._overstock.add(label)
+
+    def _remove(self, label):
+        barcode, day, qty, thr = self._rows.pop(label)
+        if day is not None:
+            self._by_expiry[day].discard(label)
+        self._understock.discard(label)
+        self._overstock.discard(label)
+
+    def _kinds(self, label):
+        return {kind for kind, labels in (('understock', self._understock), ('overstock', self._overstock))
+                if label in labels}
+
+    def update(self, label, row):
+        """
+        Recomputes the alert state of one row (a Series or dict of the row's
+        columns). Returns the understock/overstock alerts the row newly raised.
+        """
+        before = self._kinds(label)
+        if label in self._rows:
+            self._remove(label)
+        self._add(label, row['barcode'], *_alert_values(row))
+        self._cached = None
+        barcode, _, qty, thr = self._rows[label]
+        return [{'kind': kind, 'barcode': barcode, 'quantity': qty, 'threshold': thr}
+                for kind in sorted(self._kinds(label) - before)]
+
+    def set_overstock_multiplier(self, multiplier):
+        if multiplier == self.overstock_multiplier:
+            return
+        self.overstock_multiplier = multiplier
+        self._overstock = {
+            label for label, (_, _, qty, thr) in self._rows.items()
+            if thr > 0 and qty > thr * multiplier
+        }
+        self._cached = None
+
+    def alerts(self, expiry_windows=EXPIRY_WINDOWS, usage=None, reorder_days=REORDER_DAYS):
+        """
+        Same output as get_alerts() on the indexed frame, rows in frame order.
+        usage maps row labels to daily usage; reorder alerts are not cached.
+        """
+        today = _today_day()
+        key = (today, tuple(expiry_windows))
+        if self._cached is None or self._cache_key != key:
+            self._cached, self._cache_key = self._alerts(today, expiry_windows), key
+        alerts = dict(self._cached)
+        if usage is not None:
+            usage = pd.Series(usage, dtype=float).sort_index()
+            usage = usage[[label in self._rows for label in usage.index]]
+            rows = [self._rows[label] for label in usage.index]
+            alerts['reorder'] = _reorder_alerts(
+                pd.Series([row[0] for row in rows], index=usage.index, dtype=object),
+                pd.Series([row[2] for row in rows], index=usage.index, dtype='int64'),
+                usage, reorder_days,
+            )
+        return alerts
+
+    def _alerts(self, today, expiry_windows):
+        expiring = sorted(
+            (label, window)
+            for window in set(expiry_windows)
+            for label in self._by_expiry.get(today + window, ())
+        )
+        alerts = {
+            'expiry': [{'barcode': self._rows[label][0], 'days_to_expiry': window} for label, window in expiring],
+            'understock': [],
+            'overstock': [],
+            'reorder': [],
+        }
+        for kind, labels in (('understock', self._understock), ('overstock', self._overstock)):
+            for label in sorted(labels):
+                barcode, _, qty, thr = self._rows[label]
+                alerts[kind].append({'barcode': barcode, 'quantity': qty, 'threshold': thr})
+        return alerts
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+
+
+def _json_default(value):
+    # numpy scalars coming out of DataFrame rows
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def read_journal(path):
+    """
+    Yields the records of a journal file in order. Stops at the first line
+    that does not parse, which is where a crash cut the last write short.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+def file_identity(st):
+    return (st.st_dev, st.st_ino)
+
+
+def tail_journal(f, offset):
+    """
+    Reads the complete records written to the open journal file f after
+    offset. Returns (records, offset just past the last complete record).
+    """
+    f.seek(offset)
+    records = []
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+        offset += len(line)
+    return records, offset
+
+
+class MutationJournal:
+    """
+    Append-only, fsynced log of row-level inventory mutations (JSON lines).
+
+    append() writes records straight away; commit() waits until they are on
+    disk. Concurrent committers share fsyncs: whoever finds no fsync in
+    flight syncs everything written so far, and the others wait for it
+    (group commit), so N concurrent requests cost about one fsync, not N.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rotated_path = f"{path}.compacting"
+        self._cond = threading.Condition()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self.records = sum(1 for _ in read_journal(path))
+        self.fsyncs = 0
+
+    def identity(self):
+        """(device, inode) of the file appends currently go to."""
+        with self._cond:
+            return file_identity(os.fstat(self._fd))
+
+    def size(self):
+        with self._cond:
+            return os.fstat(self._fd).st_size
+
+    def truncate(self, size):
+        """Cuts off a torn tail left by a writer that crashed mid-append."""
+        with self._cond:
+            os.ftruncate(self._fd, size)
+
+    def reopen(self):
+        """
+        Reopens path if another process rotated the journal away underneath
+        the open descriptor. Returns True if it did.
+        """
+        with self._cond:
+            while self._syncing:
+                self._cond.wait()
+            try:
+                if file_identity(os.stat(self.path)) == file_identity(os.fstat(self._fd)):
+                    return False
+            except FileNotFoundError:
+                pass
+            os.fsync(self._fd)
+            self._synced = self._written
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.records = 0
+            return True
+
+    def append(self, records):
+        """Writes records to the journal and returns a ticket to pass to commit()."""
+        data = b''.join(
+            json.dumps(r, separators=(',', ':'), default=_json_default).encode('utf-8') + b'\n'
+            for r in records
+        )
+        with self._cond:
+            os.write(self._fd, data)
+            self._written += 1
+            self.records += len(records)
+            return self._written
+
+    def commit(self, ticket):
+        """Blocks until the append that returned ticket has been fsynced."""
+        with self._cond:
+            while self._synced < ticket:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target, fd = self._written, self._fd
+                self._cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._synced = max(self._synced, target)
+                self.fsyncs += 1
+
+    def rotate(self):
+        """
+        Moves the current journal aside (to rotated_path) and starts an empty
+        one. Returns the rotated path; the caller deletes it once a snapshot
+        containing its records is in place.
+        """
+        with self._cond:
+            while self._syncing:
+                self._cond.wait()
+            if os.path.exists(self.rotated_path):
+                raise RuntimeError(f"{self.rotated_path} still exists; recover it before compacting again")
+            os.fsync(self._fd)
+            self._synced = self._written
+            self._cond.notify_all()
+            os.close(self._fd)
+            os.replace(self.path, self.rotated_path)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.records = 0
+            return self.rotated_path
+
+    def close(self):
+        with self._cond:
+            while self._syncing:
+                self._cond.wait()
+            os.close(self._fd)
@@ -0,0 +1,31 @@
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # e.g. Windows: locks are no-ops, so run a single worker process
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False, blocking=True):
+    """
+    Holds an flock() on path (created if missing) for the duration of the
+    block; shared locks exclude only exclusive ones. Yields True once held,
+    or False straight away if blocking is False and another holder has it.
+
+    Every call opens its own descriptor, so threads of one process exclude
+    each other just like separate processes do.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(fd, flags if blocking else flags | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+    finally:
+        os.close(fd)
@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.barcode import normalize_barcode
+
+
+class LookupCache:
+    """
+    Persistent cache of external barcode lookups, stored in SQLite so it
+    survives restarts.
+
+    Found products live for ttl seconds. "Not found" answers are cached too,
+    for the shorter negative_ttl, so rescanning an unknown code doesn't hit
+    the providers (and the UPCitemdb trial quota) every time. Once more than
+    max_entries are stored, the least recently used ones are evicted.
+    Entries are keyed by normalize_barcode(), so EAN/UPC variants share one.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, negative_ttl=6 * 3600, max_entries=50000):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookups ("
+            " barcode TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " found INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lookups_last_used ON lookups (last_used)")
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, barcode):
+        """Returns (True, result) for a live entry, else (False, None). result is {} for a cached miss."""
+        key = normalize_barcode(barcode)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, found, expires_at FROM lookups WHERE barcode = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            result, found, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM lookups WHERE barcode = ?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            self._conn.execute("UPDATE lookups SET last_used = ? WHERE barcode = ?", (now, key))
+            if found:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return True, json.loads(result)
+
+    def put(self, barcode, result):
+        """Caches a lookup result; an empty/nameless result is cached as "not found"."""
+        key = normalize_barcode(barcode)
+        found = bool(result and result.get('name'))
+        now = time.time()
+        expires_at = now + (self.ttl if found else self.negative_ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lookups (barcode, result, found, expires_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(result or {}), int(found), expires_at, now),
+            )
+            evicted = self._conn.execute(
+                "DELETE FROM lookups WHERE barcode IN ("
+                " SELECT barcode FROM lookups ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self.evictions += max(evicted, 0)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM lookups")
+
+    def stats(self):
+        with self._lock:
+            entries, negative = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(found = 0), 0) FROM lookups"
+            ).fetchone()
+            return {
+                'file': self.path,
+                'entries': entries,
+                'negative_entries': negative,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_lookup_cache(path, **options):
+    """
+    Returns the shared LookupCache for path, creating it on first use.
+    options (ttl, negative_ttl, max_entries) only apply then.
+    """
+    key = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = LookupCache(path, **options)
+        return cache
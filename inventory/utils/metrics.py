@@ -0,0 +1,263 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Upper bounds of the latency buckets in seconds, and of the size buckets in bytes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (128, 1024, 8192, 65536, 524288, 4194304, 33554432)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, as Prometheus keeps them: constant memory
+    whatever the number of observations. Quantiles are estimated by linear
+    interpolation inside the bucket they fall in.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for k, v in labels)
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Process-wide registry of counters and histograms, keyed by metric name
+    and label set, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, namespace='inventory'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        """All metrics in Prometheus text format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(h.counts), h.count, h.sum, h.buckets)
+                                for key, h in self._histograms.items())
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {self.namespace}_{name} {self._help[name]}")
+                lines.append(f"# TYPE {self.namespace}_{name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{self.namespace}_{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), counts, count, total, buckets in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(buckets + (math.inf,), counts):
+                cumulative += n
+                le = labels + (('le', _number(bound)),)
+                lines.append(f"{self.namespace}_{name}_bucket{_labels(le)} {cumulative}")
+            lines.append(f"{self.namespace}_{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{self.namespace}_{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """{metric: [{labels, count, sum, p50, p95, p99}]} with estimated quantiles."""
+        with self._lock:
+            result = {}
+            for (name, labels), h in sorted(self._histograms.items()):
+                entry = {'labels': dict(labels), 'count': h.count, 'sum': h.sum}
+                entry.update((f"p{round(q * 100)}", h.quantile(q)) for q in QUANTILES)
+                result.setdefault(name, []).append(entry)
+            for (name, labels), value in sorted(self._counters.items()):
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
+metrics.describe('stage_seconds', "Time spent in named stages (load, save, alerts, lookups, serialization).")
+
+# Stage durations of the request being handled in this context: {stage: seconds}
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def begin_request():
+    """Starts collecting the stage durations of the current request."""
+    _request_stages.set({})
+
+
+def request_stages():
+    """Stage durations recorded for the current request so far ({} outside requests)."""
+    return _request_stages.get() or {}
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times the block as stage name, in the stage histogram and the current request's stages."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('stage_seconds', elapsed, {'stage': name})
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """Decorator form of stage(name)."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for individual requests: one background thread
+    takes a stack sample of every registered thread each interval seconds
+    (sys._current_frames), so unprofiled code runs at full speed and the
+    cost does not grow with call counts. Samples are kept as collapsed
+    stacks ("outer;inner;leaf count"), the input format of flame graph tools.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._thread = None
+
+    def begin(self):
+        """Starts sampling the calling thread."""
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self):
+        """Stops sampling the calling thread; returns its Counter of collapsed stacks."""
+        with self._lock:
+            return self._samples.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+def write_profile(directory, name, samples, header, keep=200):
+    """
+    Writes collapsed-stack samples to directory/name with header lines
+    (as '# ' comments) on top, and removes the oldest profiles beyond keep.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        for line in header:
+            f.write(f"# {line}\n")
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    profiles = sorted((e for e in os.scandir(directory) if e.name.endswith('.txt')),
+                      key=lambda e: e.stat().st_mtime)
+    for entry in profiles[:-keep]:
+        os.remove(entry.path)
+    return path
+
+
+_profilers = {}
+_profilers_lock = threading.Lock()
+
+
+def get_profiler(interval=0.005):
+    """Returns the shared SamplingProfiler for interval, starting it on first use."""
+    with _profilers_lock:
+        profiler = _profilers.get(interval)
+        if profiler is None:
+            profiler = _profilers[interval] = SamplingProfiler(interval)
+        return profiler
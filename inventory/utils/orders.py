@@ -1,23 +1,269 @@
 import pandas as pd
 from datetime import datetime
+import csv
+import io
 import os
+import threading
+import time
+
+from utils.barcode import normalize_barcode
+from utils.journal import file_identity
+from utils.locking import file_lock
+
+ORDER_COLUMNS = ['order_id', 'barcode', 'quantity', 'timestamp', 'status', 'po_id']
+# Orders in these states are still expected to arrive
+OPEN_STATUSES = {'placed'}
 
 def load_orders(file_path):
     if os.path.exists(file_path):
         return pd.read_csv(file_path, dtype=str)
-    return pd.DataFrame(columns=[
-        'order_id','barcode','quantity','timestamp','status'
-    ])
+    return pd.DataFrame(columns=ORDER_COLUMNS)
 
 def save_orders(file_path, df):
     df.to_csv(file_path, index=False)
 
-def create_order(data):
-    order_id = str(int(datetime.utcnow().timestamp()))
+
+def order_id_key(order_id):
+    """Sort key (milliseconds, sequence) of an order ID; legacy whole-second IDs included."""
+    order_id = str(order_id)
+    try:
+        if '-' in order_id:
+            ms, seq = order_id.split('-', 1)
+            return int(ms), int(seq)
+        return int(order_id) * 1000, 0
+    except ValueError:
+        return -1, 0
+
+
+class OrderIdGenerator:
+    """
+    Time-ordered, unique order IDs: "<epoch milliseconds>-<sequence>".
+    IDs never go backwards, even if the clock does: within one millisecond
+    (or while the clock lags the last ID) the sequence part is incremented,
+    rolling over into the next millisecond after 999. IDs sort as strings.
+    """
+
+    def __init__(self, last_id=None):
+        self._lock = threading.Lock()
+        self._ms, self._seq = -1, 0
+        if last_id:
+            self.observe(last_id)
+
+    def observe(self, order_id):
+        # Continue after an existing ID (e.g. the last one in the log)
+        ms, seq = order_id_key(order_id)
+        with self._lock:
+            if (ms, seq) > (self._ms, self._seq):
+                self._ms, self._seq = ms, seq
+
+    def next(self):
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now > self._ms:
+                self._ms, self._seq = now, 0
+            elif self._seq < 999:
+                self._seq += 1
+            else:
+                self._ms, self._seq = self._ms + 1, 0
+            return f"{self._ms:013d}-{self._seq:03d}"
+
+
+_ids = OrderIdGenerator()
+
+def create_order(data, order_id=None):
+    now = datetime.utcnow()
     return {
-        'order_id': order_id,
-        'barcode': data.get('barcode',''),
+        'order_id': order_id or _ids.next(),
+        'barcode': str(data.get('barcode','')),
         'quantity': str(data.get('quantity',0)),
-        'timestamp': datetime.utcnow().isoformat(),
-        'status': 'placed'
-    }
\ No newline at end of file
+        'timestamp': now.isoformat(),
+        'status': 'placed',
+        'po_id': str(data.get('po_id', '')),
+    }
+
+
+class OrderStore:
+    """
+    Append-only order log on top of the orders CSV.
+
+    Placing orders appends their rows (one fsynced write per call) instead of
+    rewriting the file, so it costs the same however long the history is.
+    A status change is appended as a new row for the same order_id; when the
+    log is read, the last row of an order wins.
+
+    All orders are kept in memory with indexes by normalized barcode and by
+    status, so "open orders for this product" is a set intersection.
+
+    Safe to share between processes: appends hold an exclusive flock on
+    <file>.lock and every call first reads the rows other processes
+    appended since (so IDs also stay unique across processes).
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock_path = f"{file_path}.lock"
+        self._lock = threading.Lock()
+        self._ids = OrderIdGenerator()
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._reset()
+        self._catch_up()
+
+    def _reset(self):
+        self._orders = {}
+        self._by_barcode = {}
+        self._by_status = {}
+        self._columns = ORDER_COLUMNS
+        self._file_id = None
+        self._offset = 0
+
+    def _catch_up(self):
+        # Reads rows appended since the last call (by any process); caller holds the lock
+        try:
+            st = os.stat(self.file_path)
+        except FileNotFoundError:
+            return
+        if self._file_id is not None and (file_identity(st) != self._file_id or st.st_size < self._offset):
+            # The file was replaced (e.g. a legacy rewrite): start over
+            self._reset()
+        if st.st_size == self._offset:
+            return
+        with open(self.file_path, 'rb') as f:
+            self._file_id = file_identity(os.fstat(f.fileno()))
+            f.seek(self._offset)
+            data = f.read()
+        # Only whole lines; a row being written right now is read next time
+        end = data.rfind(b'\n') + 1
+        rows = csv.reader(io.StringIO(data[:end].decode('utf-8', 'replace'), newline=''))
+        if self._offset == 0:
+            # Legacy files lack po_id; keep writing rows in the file's own column order
+            self._columns = next(rows, None) or ORDER_COLUMNS
+        for values in rows:
+            row = dict(zip(self._columns, values))
+            if row.get('order_id'):
+                self._index(row)
+                self._ids.observe(row['order_id'])
+        self._offset += end
+
+    def _index(self, order):
+        order = {column: order.get(column) or '' for column in ORDER_COLUMNS}
+        previous = self._orders.get(order['order_id'])
+        if previous is not None:
+            self._by_status.get(previous['status'], set()).discard(previous['order_id'])
+            self._by_barcode.get(normalize_barcode(previous['barcode']), set()).discard(previous['order_id'])
+        self._orders[order['order_id']] = order
+        self._by_status.setdefault(order['status'], set()).add(order['order_id'])
+        self._by_barcode.setdefault(normalize_barcode(order['barcode']), set()).add(order['order_id'])
+        return order
+
+    def _append(self, orders):
+        # Caller holds the lock and the file lock
+        missing = [c for c in ORDER_COLUMNS if c not in self._columns]
+        new_file = not os.path.exists(self.file_path) or os.path.getsize(self.file_path) == 0
+        if new_file:
+            self._columns = ORDER_COLUMNS
+        elif missing:
+            # A legacy file without the newer columns: rewrite it once with them
+            self._columns = list(self._columns) + missing
+            tmp_path = f"{self.file_path}.tmp"
+            save_orders(tmp_path, pd.DataFrame(list(self._orders.values()), columns=self._columns))
+            os.replace(tmp_path, self.file_path)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self._columns, extrasaction='ignore')
+        if new_file:
+            writer.writeheader()
+        writer.writerows(orders)
+        with open(self.file_path, 'a', newline='', encoding='utf-8') as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        # Nobody else appends while the file lock is held, so the file ends at our rows
+        self._file_id, self._offset = file_identity(st), st.st_size
+
+    def place(self, lines, po_id=None):
+        """
+        Places one order per line ({'barcode', 'quantity'}) with a single
+        append. Lines placed together share a po_id (by default the first
+        line's order_id). Returns the new orders.
+        """
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up()
+            orders = [create_order(line, self._ids.next()) for line in lines]
+            if len(orders) > 1 or po_id:
+                for order in orders:
+                    order['po_id'] = str(po_id or orders[0]['order_id'])
+            self._append(orders)
+            for order in orders:
+                self._index(order)
+            return orders
+
+    def set_status(self, order_id, status):
+        """Records a new status for an order. Returns the updated order, or None if unknown."""
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up()
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            order = dict(order, status=status)
+            self._append([order])
+            return self._index(order)
+
+    def replace(self, orders):
+        """Replaces the whole log with orders (dicts with ORDER_COLUMNS), as one new file."""
+        with self._lock, file_lock(self.lock_path):
+            tmp_path = f"{self.file_path}.tmp"
+            save_orders(tmp_path, pd.DataFrame(list(orders), columns=ORDER_COLUMNS))
+            os.replace(tmp_path, self.file_path)
+            self._reset()
+            self._catch_up()
+
+    def get(self, order_id):
+        with self._lock:
+            self._catch_up()
+            order = self._orders.get(order_id)
+            return dict(order) if order else None
+
+    def query(self, barcode=None, status=None, open_only=False, limit=None):
+        """
+        Returns orders matching every given filter, oldest first (IDs are
+        time-ordered); with a limit, the most recent ones.
+        """
+        with self._lock:
+            self._catch_up()
+            selections = []
+            if barcode:
+                selections.append(self._by_barcode.get(normalize_barcode(barcode), set()))
+            if status:
+                selections.append(self._by_status.get(status, set()))
+            if open_only:
+                selections.append(set().union(*(self._by_status.get(s, set()) for s in OPEN_STATUSES)))
+            if selections:
+                ids = set.intersection(*sorted(selections, key=len))
+            else:
+                ids = self._orders.keys()
+            ids = sorted(ids, key=order_id_key)
+            if limit:
+                ids = ids[-limit:]
+            return [dict(self._orders[i]) for i in ids]
+
+    def stats(self):
+        with self._lock:
+            self._catch_up()
+            return {
+                'file': self.file_path,
+                'orders': len(self._orders),
+                'by_status': {s: len(ids) for s, ids in self._by_status.items() if ids},
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_order_store(file_path):
+    """Returns the shared OrderStore for file_path, loading it on first use."""
+    key = os.path.abspath(file_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = OrderStore(file_path)
+        return store
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+
+def spool_and_hash(stream, block_size=1024 * 1024):
+    """
+    Copies stream to an anonymous temporary file, hashing it on the way.
+    Returns (file rewound to the start, sha256 hex digest), so the content
+    is only read from the request once.
+    """
+    digest = hashlib.sha256()
+    spool = tempfile.TemporaryFile()
+    try:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            spool.write(block)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of JSON results on disk (one file per key),
+    for results that are expensive to compute but small to keep, such as
+    the analysis of an uploaded sales export.
+
+    Entries are evicted least recently used first (file mtime is bumped on
+    every hit) once the files add up to more than max_bytes. Sizes are read
+    from the directory on every put, so the budget holds for all the worker
+    processes sharing it, not per process.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Key -> size of the entries on disk, as of the last scan
+        self._sizes = {key: size for key, (_, size) in self._scan().items()}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(content_hash, **params):
+        """Cache key for content_hash analyzed with params (JSON-serializable)."""
+        material = json.dumps({'content': content_hash, 'params': params}, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _scan(self):
+        # Key -> (mtime, size) of every entry on disk, whichever process wrote it
+        entries = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    try:
+                        st = entry.stat()
+                    except OSError:  # evicted by another process meanwhile
+                        continue
+                    entries[entry.name[:-5]] = (st.st_mtime, st.st_size)
+        return entries
+
+    def get(self, key):
+        """Returns the cached result for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = json.loads(f.read())
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        data = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = self._scan()
+        self._sizes = {key: size for key, (_, size) in entries.items()}
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        for _, key in sorted((mtime, key) for key, (mtime, _) in entries.items()):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+                self.evictions += 1
+            except OSError:  # another process evicted it first
+                pass
+            total -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._sizes.clear()
+
+    def stats(self):
+        with self._lock:
+            self._sizes = {key: size for key, (_, size) in self._scan().items()}
+            return {
+                'directory': self.directory,
+                'entries': len(self._sizes),
+                'bytes': sum(self._sizes.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_result_cache(directory, **options):
+    """
+    Returns the shared ResultCache for directory, creating it on first use.
+    options (max_bytes) only apply then.
+    """
+    key = os.path.abspath(directory)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ResultCache(directory, **options)
+        return cache
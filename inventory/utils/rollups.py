@@ -0,0 +1,262 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.barcode import normalize_barcode
+from utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths in seconds. Weeks start on Monday: 1970-01-01 was a Thursday,
+# so week boundaries are shifted by three days
+BUCKETS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+_WEEK_OFFSET = 3 * 86400
+
+
+def bucket_starts(seconds, bucket):
+    """Start (in seconds since 1970) of the bucket each of seconds falls in."""
+    offset = _WEEK_OFFSET if bucket == 'week' else 0
+    return (seconds + offset) // BUCKETS[bucket] * BUCKETS[bucket] - offset
+
+
+def bucket_labels(starts, bucket):
+    """Bucket starts as stored: 'YYYY-MM-DDTHH:MM:SS' for hours, 'YYYY-MM-DD' for days and weeks."""
+    return np.datetime_as_string(np.asarray(starts, dtype='datetime64[s]'), unit='s' if bucket == 'hour' else 'D')
+
+
+def _seconds(timestamps):
+    # Offsets are converted to UTC; naive timestamps (what the app logs) are taken as they are
+    parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), errors='coerce', utc=True).dt.tz_localize(None)
+    return parsed.to_numpy().astype('datetime64[s]').astype(np.int64), parsed.isna().to_numpy()
+
+
+class StockRollups:
+    """
+    Hourly, daily and weekly aggregates of the stock history per product,
+    kept in tables next to the history itself: the quantity at the end of
+    the bucket, its low and high, the net change over the bucket and the
+    units consumed (drops in stock; restocks don't count). Charts read a
+    few buckets instead of every scan, and daily consumption gives each
+    product a usage rate and a days-until-stockout estimate.
+
+    update() rolls up only the history rows added since the last update (by
+    id), up to batch_rows at a time, vectorized across all products. The
+    position is stored with the aggregates in the same transaction, so
+    worker processes sharing the database never count a row twice.
+
+    A product's changes are taken between consecutive scans. A scan that
+    arrives late (e.g. from an offline batch), older than the product's
+    latest one, lands in its bucket's low/high but counts no change.
+    """
+
+    def __init__(self, path, batch_rows=200_000):
+        self.path = path
+        self.batch_rows = batch_rows
+        self._lock = threading.Lock()
+        self._updated_at = float('-inf')
+        self._usage = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Aggregates can always be caught up from the history; no need to fsync each update
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollup ("
+            " bucket TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " start TEXT NOT NULL,"
+            " opening INTEGER NOT NULL,"
+            " last INTEGER NOT NULL,"
+            " last_seconds INTEGER NOT NULL,"
+            " low INTEGER NOT NULL,"
+            " high INTEGER NOT NULL,"
+            " consumed INTEGER NOT NULL,"
+            " samples INTEGER NOT NULL,"
+            " PRIMARY KEY (bucket, key, start)) WITHOUT ROWID"
+        )
+        # Latest scan per product, the starting point of its next change
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollup_latest ("
+            " key TEXT PRIMARY KEY, seconds INTEGER NOT NULL, quantity INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    def _position(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'rollup:last_id'").fetchone()
+        return int(row[0]) if row else 0
+
+    @timed('history_rollup')
+    def update(self):
+        """Rolls up the history rows added since the last update. Returns how many there were."""
+        total = 0
+        with self._lock:
+            while True:
+                # IMMEDIATE takes the write lock before the position is read
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    count = self._roll_up_batch()
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                total += count
+                if count < self.batch_rows:
+                    break
+            self._updated_at = time.monotonic()
+            if total:
+                self._usage.clear()
+        return total
+
+    def refresh(self, max_age):
+        """update(), unless the last one ran less than max_age seconds ago."""
+        if time.monotonic() - self._updated_at >= max_age:
+            self.update()
+
+    def _roll_up_batch(self):
+        position = self._position()
+        rows = self._conn.execute(
+            "SELECT id, key, ts, quantity FROM history WHERE id > ? ORDER BY id LIMIT ?",
+            (position, self.batch_rows),
+        ).fetchall()
+        if not rows:
+            return 0
+        end = rows[-1][0]
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('rollup:last_id', ?)", (str(end),))
+
+        events = pd.DataFrame(rows, columns=['id', 'key', 'ts', 'quantity'])
+        events['seconds'], invalid = _seconds(events['ts'])
+        if invalid.any():
+            logger.warning("Skipping %d history rows with unreadable timestamps", int(invalid.sum()))
+            events = events[~invalid]
+        if events.empty:
+            return len(rows)
+        events = events.sort_values(['key', 'seconds', 'id'], kind='stable', ignore_index=True)
+
+        # Each scan's change is taken from the scan before it: within the
+        # batch, or the product's latest scan from earlier batches
+        latest = pd.DataFrame(self._conn.execute(
+            "SELECT key, seconds, quantity FROM rollup_latest"
+            " WHERE key IN (SELECT key FROM history WHERE id > ? AND id <= ?)", (position, end)
+        ).fetchall(), columns=['key', 'seconds', 'quantity']).set_index('key')
+        first = events['key'].ne(events['key'].shift()).to_numpy()
+        previous = events['quantity'].shift().to_numpy(dtype=float)
+        carried = latest.reindex(events['key'][first])
+        in_order = carried['seconds'].le(events['seconds'][first].to_numpy()).to_numpy()
+        previous[first] = np.where(in_order, carried['quantity'].to_numpy(dtype=float), np.nan)
+        # The first scan of a product, or a late one, counts no change
+        events['previous'] = np.where(np.isnan(previous), events['quantity'], previous).astype(np.int64)
+        events['consumed'] = (events['previous'] - events['quantity']).clip(lower=0)
+
+        for bucket in BUCKETS:
+            events['start'] = bucket_starts(events['seconds'].to_numpy(), bucket)
+            totals = events.groupby(['key', 'start'], sort=False).agg(
+                opening=('previous', 'first'), last=('quantity', 'last'), last_seconds=('seconds', 'last'),
+                low=('quantity', 'min'), high=('quantity', 'max'), consumed=('consumed', 'sum'),
+                samples=('quantity', 'size'),
+            ).reset_index()
+            self._conn.executemany(
+                "INSERT INTO rollup (bucket, key, start, opening, last, last_seconds, low, high, consumed, samples)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (bucket, key, start) DO UPDATE SET"
+                " last = CASE WHEN excluded.last_seconds >= rollup.last_seconds THEN excluded.last ELSE rollup.last END,"
+                " last_seconds = max(rollup.last_seconds, excluded.last_seconds),"
+                " low = min(rollup.low, excluded.low), high = max(rollup.high, excluded.high),"
+                " consumed = rollup.consumed + excluded.consumed, samples = rollup.samples + excluded.samples",
+                zip([bucket] * len(totals), totals['key'].tolist(),
+                    bucket_labels(totals['start'].to_numpy(), bucket).tolist(),
+                    *(totals[column].tolist() for column in
+                      ('opening', 'last', 'last_seconds', 'low', 'high', 'consumed', 'samples'))),
+            )
+
+        newest = events.groupby('key', sort=False).last()
+        self._conn.executemany(
+            "INSERT INTO rollup_latest (key, seconds, quantity) VALUES (?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET seconds = excluded.seconds, quantity = excluded.quantity"
+            " WHERE excluded.seconds >= rollup_latest.seconds",
+            zip(newest.index.tolist(), newest['seconds'].tolist(), newest['quantity'].tolist()),
+        )
+        return len(rows)
+
+    def query(self, barcode, bucket='day', since=None, until=None, limit=None):
+        """
+        Returns [{'date', 'quantity', 'low', 'high', 'change', 'consumed',
+        'samples'}] for barcode (any EAN/UPC form), one per bucket that has
+        scans, oldest first. date is the bucket start and quantity the level
+        at its end. since/until (ISO dates or timestamps) select the buckets
+        overlapping them; with a limit, the most recent buckets are returned.
+        Raises ValueError for an unknown bucket or unreadable bound.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        sql = ("SELECT start, last, low, high, last - opening, consumed, samples FROM rollup"
+               " WHERE bucket = ? AND key = ?")
+        params = [bucket, normalize_barcode(barcode)]
+        for bound, op in ((since, '>='), (until, '<=')):
+            if bound:
+                seconds, invalid = _seconds([bound])
+                if invalid[0]:
+                    raise ValueError(f"Unreadable date: {bound}")
+                sql += f" AND start {op} ?"
+                params.append(bucket_labels(bucket_starts(seconds, bucket), bucket)[0])
+        if limit:
+            sql = f"SELECT * FROM ({sql} ORDER BY start DESC LIMIT ?) ORDER BY start"
+            params.append(int(limit))
+        else:
+            sql += " ORDER BY start"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {'date': start, 'quantity': last, 'low': low, 'high': high, 'change': change,
+             'consumed': consumed, 'samples': samples}
+            for start, last, low, high, change, consumed, samples in rows
+        ]
+
+    def usage(self, days=28, now=None):
+        """
+        Average daily consumption per product over the last days days (or
+        since its first scan, if later), as a Series indexed by normalized
+        barcode. Products that consumed nothing are left out. Cached until
+        update() rolls up new rows.
+        """
+        now = pd.Timestamp(now or datetime.now())
+        cache_key = (days, now.floor('h'))
+        if cache_key in self._usage:
+            return self._usage[cache_key]
+        window_start = (now - pd.Timedelta(days=days)).normalize()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, SUM(consumed), MIN(start) FROM rollup WHERE bucket = 'day' AND start >= ?"
+                " GROUP BY key HAVING SUM(consumed) > 0",
+                (window_start.strftime('%Y-%m-%d'),),
+            ).fetchall()
+        frame = pd.DataFrame(rows, columns=['key', 'consumed', 'first'])
+        first = pd.to_datetime(frame['first'], format='%Y-%m-%d')
+        elapsed = ((now - first).dt.total_seconds() / 86400).clip(lower=1)
+        usage = pd.Series((frame['consumed'] / elapsed).to_numpy(), index=frame['key'].to_numpy(), dtype=float)
+        self._usage = {cache_key: usage}
+        return usage
+
+    def stats(self):
+        with self._lock:
+            buckets = dict(self._conn.execute("SELECT bucket, COUNT(*) FROM rollup GROUP BY bucket").fetchall())
+            return {'rolled_up_to_id': self._position(), 'buckets': buckets}
+
+
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+
+def get_history_rollups(history_store, **options):
+    """
+    Returns the shared StockRollups of a HistoryStore (whose database holds
+    them), creating it on first use. options (batch_rows) only apply then.
+    """
+    with _rollups_lock:
+        rollups = _rollups.get(history_store.path)
+        if rollups is None:
+            rollups = _rollups[history_store.path] = StockRollups(history_store.path, **options)
+        return rollups
@@ -0,0 +1,186 @@
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+# Field -> weight of a query term matching a token of that field
+SEARCH_FIELDS = {
+    'name': 3.0,
+    'category': 1.5,
+    'manufacturer': 1.0,
+    'distributor': 1.0,
+    'description': 0.5,
+}
+
+# Score multipliers for the three kinds of term match
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.7
+FUZZY_MATCH = 0.5
+
+MAX_EXPANSIONS = 64  # prefix/fuzzy vocabulary tokens kept per query term
+FUZZY_CANDIDATES = 256  # tokens sharing most trigrams that are checked for typos
+FUZZY_MIN_SIMILARITY = 0.45  # trigram Jaccard similarity accepted as a fuzzy match
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Lower-cases, strips accents and splits text into alphanumeric tokens."""
+    if text is None or text != text:  # None or NaN
+        return []
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(text)
+
+
+def trigrams(token):
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    """Levenshtein distance between a and b, or max_distance + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchIndex:
+    """
+    Incrementally maintained inverted index over product text fields.
+
+    Postings map each token to {doc_id: field weight}. A sorted vocabulary
+    serves prefix matches and a trigram -> tokens map serves fuzzy matches,
+    so a query only touches the postings of the terms it matches instead of
+    every product. add()/remove() update the index in place.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = fields or SEARCH_FIELDS
+        self._postings = defaultdict(dict)
+        self._doc_tokens = {}
+        self._vocab = []
+        self._trigrams = defaultdict(set)
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def add(self, doc_id, record):
+        """Indexes (or re-indexes) a product; record maps field name -> text."""
+        self.remove(doc_id)
+        weights = {}
+        for field, weight in self.fields.items():
+            for token in set(tokenize(record.get(field))):
+                weights[token] = weights.get(token, 0.0) + weight
+        for token, weight in weights.items():
+            postings = self._postings[token]
+            if not postings:
+                insort(self._vocab, token)
+                for gram in trigrams(token):
+                    self._trigrams[gram].add(token)
+            postings[doc_id] = weight
+        self._doc_tokens[doc_id] = tuple(weights)
+
+    def remove(self, doc_id):
+        for token in self._doc_tokens.pop(doc_id, ()):
+            postings = self._postings[token]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._vocab[bisect_left(self._vocab, token)]
+                for gram in trigrams(token):
+                    self._trigrams[gram].discard(token)
+
+    def _expand(self, term):
+        """Returns {vocabulary token: match multiplier} for one query term."""
+        matches = {}
+        if term in self._postings:
+            matches[term] = EXACT_MATCH
+        if len(term) >= 2:
+            i = bisect_left(self._vocab, term)
+            while i < len(self._vocab) and len(matches) < MAX_EXPANSIONS:
+                token = self._vocab[i]
+                if not token.startswith(term):
+                    break
+                matches.setdefault(token, PREFIX_MATCH)
+                i += 1
+        # Typo tolerance for words only; numeric terms are codes, not typos.
+        # Short words share few trigrams, so a small edit distance also counts.
+        if len(term) >= 3 and not term.isdigit():
+            grams = trigrams(term)
+            max_typos = 1 if len(term) <= 5 else 2
+            shared = defaultdict(int)
+            for gram in grams:
+                for token in self._trigrams.get(gram, ()):
+                    shared[token] += 1
+            fuzzy = []
+            for token, n in heapq.nlargest(FUZZY_CANDIDATES, shared.items(), key=lambda kv: kv[1]):
+                if token in matches:
+                    continue
+                similarity = n / (len(grams) + len(trigrams(token)) - n)
+                if similarity < FUZZY_MIN_SIMILARITY:
+                    typos = edit_distance(term, token, max_typos)
+                    if typos > max_typos:
+                        continue
+                    similarity = max(similarity, 1 - typos / len(term))
+                fuzzy.append((similarity, token))
+            for similarity, token in heapq.nlargest(MAX_EXPANSIONS - len(matches), fuzzy):
+                matches[token] = FUZZY_MATCH * similarity
+        return matches
+
+    def search(self, query, limit=50):
+        """
+        Returns up to limit doc ids matching every term of query, best first.
+        A term matches a token exactly, as a prefix or by trigram similarity.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        expansions = []
+        for term in terms:
+            matches = self._expand(term)
+            if not matches:
+                return []
+            size = sum(len(self._postings[token]) for token in matches)
+            expansions.append((size, matches))
+        # Start from the most selective term and only score its candidates
+        expansions.sort(key=lambda e: e[0])
+        scores = None
+        for _, matches in expansions:
+            term_scores = {}
+            if scores is None:
+                # Largest multiplier first, so later tokens only fill in missing docs
+                for token, factor in sorted(matches.items(), key=lambda kv: -kv[1]):
+                    postings = self._postings[token]
+                    if not term_scores:
+                        term_scores = {doc_id: weight * factor for doc_id, weight in postings.items()}
+                        continue
+                    for doc_id, weight in postings.items():
+                        score = weight * factor
+                        if score > term_scores.get(doc_id, 0.0):
+                            term_scores[doc_id] = score
+                scores = term_scores
+                continue
+            postings = [(self._postings[token], factor) for token, factor in matches.items()]
+            for doc_id, total in scores.items():
+                best = 0.0
+                for docs, factor in postings:
+                    weight = docs.get(doc_id)
+                    if weight is not None and weight * factor > best:
+                        best = weight * factor
+                if best:
+                    term_scores[doc_id] = total + best
+            scores = term_scores
+            if not scores:
+                return []
+        best = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+        return [doc_id for doc_id, _ in best]
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+from utils.inventory import plain_frame
+from utils.metrics import timed
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; responses are gzipped instead
+    brotli = None
+
+
+def _default(value):
+    # numpy scalars and other stragglers from DataFrames
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+@timed('dumps')
+def dumps(obj):
+    """Encodes obj as compact JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+@timed('frame_json')
+def frame_json(df, lines=False):
+    """
+    Encodes a DataFrame as a JSON list of row objects (or JSON lines) in one
+    columnar pass, without building a Python dict per row. Missing values
+    become '' and dates YYYY-MM-DD (see plain_frame).
+    """
+    df = plain_frame(df)
+    if df.empty:
+        return b'' if lines else b'[]'
+    body = df.to_json(orient='records', lines=lines, force_ascii=False, date_format='iso').encode('utf-8')
+    if lines and not body.endswith(b'\n'):
+        body += b'\n'
+    return body
+
+
+def records_json(df, envelope=None, key='items'):
+    """frame_json(df), or an envelope object with the rows spliced in under key."""
+    body = frame_json(df)
+    if not envelope:
+        return body
+    head = dumps(envelope)
+    return head[:-1] + b',"' + key.encode('utf-8') + b'":' + body + b'}'
+
+
+def choose_encoding(accept_encodings):
+    """Picks 'br' or 'gzip' from a werkzeug Accept-Encoding header, or None."""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+@timed('compress')
+def compress(body, encoding, level=6):
+    if encoding == 'br':
+        # Brotli quality runs 0-11; map the gzip-style 1-9 level onto it
+        return brotli.compress(body, quality=min(11, level))
+    return gzip.compress(body, compresslevel=level)
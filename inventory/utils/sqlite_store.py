@@ -0,0 +1,377 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from utils.barcode import normalize_barcode
+from utils.inventory import INVENTORY_COLUMNS, enforce_schema, plain_frame, plain_row
+from utils.orders import ORDER_COLUMNS, OPEN_STATUSES, OrderIdGenerator, create_order, order_id_key
+from utils.store import InventoryStore, _coerce
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    barcode TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    quantity INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    price REAL NOT NULL DEFAULT 0,
+    expiry TEXT NOT NULL DEFAULT '',
+    threshold INTEGER NOT NULL DEFAULT 0,
+    distributor TEXT NOT NULL DEFAULT '',
+    manufacturer TEXT NOT NULL DEFAULT '',
+    synced INTEGER NOT NULL DEFAULT 0,
+    image_url TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS products_key ON products (key);
+CREATE INDEX IF NOT EXISTS products_category ON products (category);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    barcode TEXT NOT NULL,
+    quantity TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    status TEXT NOT NULL,
+    po_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS orders_key_status ON orders (key, status);
+CREATE INDEX IF NOT EXISTS orders_status ON orders (status);
+"""
+
+_PRODUCT_COLUMNS = ', '.join(['id', 'key'] + INVENTORY_COLUMNS)
+_PRODUCT_PLACEHOLDERS = ', '.join('?' * (len(INVENTORY_COLUMNS) + 2))
+
+
+def connect(db_path):
+    """Opens db_path in WAL mode (readers never block the writer) with the schema in place."""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _plain(value):
+    # numpy scalars -> Python values sqlite3 can bind
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _product_row(label, row):
+    values = [_plain(row.get(column, '')) for column in INVENTORY_COLUMNS]
+    return (int(label), normalize_barcode(row.get('barcode', ''))) + tuple(values)
+
+
+def read_products(conn):
+    """Returns the products table as an inventory DataFrame labelled by row id."""
+    df = pd.read_sql_query(f"SELECT id, {', '.join(INVENTORY_COLUMNS)} FROM products ORDER BY id", conn, index_col='id')
+    df.index.name = None
+    return enforce_schema(df)
+
+
+def write_products(conn, df):
+    """Replaces the products table with df (labels become row ids); caller runs the transaction."""
+    conn.execute("DELETE FROM products")
+    conn.executemany(
+        f"INSERT INTO products ({_PRODUCT_COLUMNS}) VALUES ({_PRODUCT_PLACEHOLDERS})",
+        (_product_row(label, row) for label, row in zip(df.index, plain_frame(df).to_dict(orient='records'))),
+    )
+
+
+class SQLiteInventoryStore(InventoryStore):
+    """
+    InventoryStore kept in an SQLite database instead of CSV snapshot + journal.
+
+    Reads are served from the same in-memory frame and indexes. Each write
+    runs in one IMMEDIATE transaction (which also serializes writers across
+    processes) and touches only its rows: a stock adjustment is one UPDATE
+    by primary key. Every write also appends its records to a changes table,
+    which other processes tail to stay current; PRAGMA data_version tells
+    them cheaply when there is anything to read. Only the latest
+    keep_changes records are kept; a process that falls further behind
+    reloads the table.
+    """
+
+    def __init__(self, db_path, keep_changes=10000):
+        super().__init__(db_path, compact_interval=0)
+        self.keep_changes = keep_changes
+        self._conn = connect(db_path)
+        self._position = 0
+        self._data_version = None
+
+    def _stat_signature(self, path=None):
+        # Change detection goes through the changes table, not file stats
+        return None
+
+    def _read_data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _catch_up(self):
+        data_version = self._read_data_version()
+        if data_version == self._data_version:
+            return True
+        rows = self._conn.execute("SELECT seq, record FROM changes WHERE seq > ? ORDER BY seq", (self._position,)).fetchall()
+        if rows and rows[0][0] != self._position + 1:
+            # Pruned past our position
+            return False
+        records = [json.loads(record) for _, record in rows]
+        if any(record['op'] == 'reset' for record in records):
+            return False
+        if records:
+            self._apply_all(records)
+            self._position = rows[-1][0]
+            self.tailed += len(records)
+            self.version += 1
+        self._data_version = data_version
+        return True
+
+    def _reload(self):
+        # Products and the change position are read in one transaction so they agree
+        nested = self._conn.in_transaction
+        previous = self._df
+        if not nested:
+            self._conn.execute("BEGIN")
+        try:
+            self._data_version = self._read_data_version()
+            self._df = read_products(self._conn)
+            self._tail = None
+            self._position = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        finally:
+            if not nested:
+                self._conn.execute("COMMIT")
+        self.version += 1
+        self._rebuild_index()
+        self._search = None
+        self._alerts = None
+        self._products = {}
+        self._publish_replaced(previous)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._current()
+                yield
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                # The frame may hold changes that were just rolled back
+                self._df = None
+                self._tail = None
+                raise
+
+    def _log(self, records):
+        self._apply_all(records)
+        for record in records:
+            label = self._label(record.get('barcode') or record.get('row', {}).get('barcode', ''))
+            if label is None:
+                continue
+            if record['op'] == 'upsert':
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO products ({_PRODUCT_COLUMNS}) VALUES ({_PRODUCT_PLACEHOLDERS})",
+                    _product_row(label, plain_row(self._frame_of(label), label)),
+                )
+            elif record['op'] == 'quantity':
+                self._conn.execute("UPDATE products SET quantity = ? WHERE id = ?", (_coerce('quantity', record['quantity']), int(label)))
+            elif record['op'] == 'synced':
+                self._conn.execute("UPDATE products SET synced = ? WHERE id = ?", (int(_coerce('synced', record['synced'])), int(label)))
+        self._append_changes(records)
+        self.version += 1
+        return None
+
+    def _append_changes(self, records):
+        cursor = self._conn.executemany(
+            "INSERT INTO changes (record) VALUES (?)",
+            [(json.dumps(record, default=_plain),) for record in records],
+        )
+        self._position += cursor.rowcount
+        if self._position % 1000 < len(records):
+            self._conn.execute("DELETE FROM changes WHERE seq <= ?", (self._position - self.keep_changes,))
+
+    def _commit(self, ticket):
+        # The transaction committed when _writing() ended
+        pass
+
+    def compact(self, force=False, replace_with=None):
+        """Checkpoints the WAL into the database file (or replaces every product)."""
+        if replace_with is not None:
+            with self._writing():
+                self._merge_tail()
+                previous = self._df
+                # The index is rebuilt from the replacement below, so appended entries aren't needed
+                replacement = enforce_schema(replace_with(self._df)[0] if callable(replace_with) else replace_with.copy())
+                write_products(self._conn, replacement)
+                self._append_changes([{'op': 'reset'}])
+                self._df = replacement
+                self._rebuild_index()
+                self._search = None
+                self._alerts = None
+                self._products = {}
+                self.version += 1
+                self._publish_replaced(previous)
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compactions += 1
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['change_position'] = self._position
+        return stats
+
+
+class SQLiteOrderStore:
+    """
+    OrderStore with the orders in SQLite, indexed by (barcode, status) and
+    status, so queries read only matching rows. Same interface and IDs.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._ids = OrderIdGenerator()
+
+    @staticmethod
+    def _row(order):
+        return (order['order_id'], normalize_barcode(order['barcode'])) + tuple(str(order.get(c) or '') for c in ORDER_COLUMNS[1:])
+
+    def _insert(self, orders):
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO orders (order_id, key, {', '.join(ORDER_COLUMNS[1:])}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [self._row(order) for order in orders],
+        )
+
+    def place(self, lines, po_id=None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Continue after the newest ID, whichever process placed it
+                last = self._conn.execute("SELECT order_id FROM orders ORDER BY rowid DESC LIMIT 1").fetchone()
+                if last:
+                    self._ids.observe(last[0])
+                orders = [create_order(line, self._ids.next()) for line in lines]
+                if len(orders) > 1 or po_id:
+                    for order in orders:
+                        order['po_id'] = str(po_id or orders[0]['order_id'])
+                self._insert(orders)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return orders
+
+    def set_status(self, order_id, status):
+        with self._lock:
+            updated = self._conn.execute("UPDATE orders SET status = ? WHERE order_id = ?", (status, order_id)).rowcount
+        return self.get(order_id) if updated else None
+
+    def _select(self, where='', params=()):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders {where}", params).fetchall()
+        return [dict(zip(ORDER_COLUMNS, row)) for row in rows]
+
+    def get(self, order_id):
+        rows = self._select("WHERE order_id = ?", (order_id,))
+        return rows[0] if rows else None
+
+    def query(self, barcode=None, status=None, open_only=False, limit=None):
+        clauses, params = [], []
+        if barcode:
+            clauses.append("key = ?")
+            params.append(normalize_barcode(barcode))
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if open_only:
+            clauses.append(f"status IN ({', '.join('?' * len(OPEN_STATUSES))})")
+            params.extend(sorted(OPEN_STATUSES))
+        orders = self._select(f"WHERE {' AND '.join(clauses)}" if clauses else '', params)
+        orders.sort(key=lambda order: order_id_key(order['order_id']))
+        return orders[-limit:] if limit else orders
+
+    def replace(self, orders):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM orders")
+                self._insert(orders)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM orders GROUP BY status").fetchall()
+        return {'file': self.db_path, 'orders': sum(n for _, n in rows), 'by_status': dict(rows)}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_sqlite_store(db_path, **options):
+    """
+    Returns the shared SQLiteInventoryStore for db_path, creating it on first
+    use. options (keep_changes) only apply then.
+    """
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SQLiteInventoryStore(db_path, **options)
+        return store
+
+
+def get_sqlite_order_store(db_path):
+    key = ('orders', os.path.abspath(db_path))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SQLiteOrderStore(db_path)
+        return store
+
+
+def migrate_csv(inventory_file, orders_file, db_path):
+    """
+    One-shot copy of the CSV inventory (snapshot plus unfolded journal) and
+    order log into db_path, replacing what the database held. Returns
+    (products, orders, inventory columns that have no place in the schema).
+    """
+    from utils.orders import OrderStore
+
+    csv_store = InventoryStore(inventory_file, compact_interval=0)
+    df = csv_store.frame()
+    dropped = [c for c in df.columns if c not in INVENTORY_COLUMNS]
+    products = enforce_schema(df.reindex(columns=INVENTORY_COLUMNS))
+    products.index = pd.RangeIndex(len(products))
+    orders = OrderStore(orders_file).query() if os.path.exists(orders_file) else []
+
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        write_products(conn, products)
+        conn.execute("DELETE FROM orders")
+        conn.executemany(
+            f"INSERT OR REPLACE INTO orders (order_id, key, {', '.join(ORDER_COLUMNS[1:])}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [SQLiteOrderStore._row(order) for order in orders],
+        )
+        # Processes already serving from the database must reload
+        conn.execute("INSERT INTO changes (record) VALUES (?)", (json.dumps({'op': 'reset'}),))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return len(products), len(orders), dropped
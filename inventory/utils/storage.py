@@ -0,0 +1,61 @@
+import pandas as pd
+
+from utils.orders import ORDER_COLUMNS, get_order_store
+from utils.sqlite_store import get_sqlite_order_store, get_sqlite_store
+from utils.store import get_store
+
+
+class CSVBackend:
+    """
+    Inventory in a CSV snapshot plus mutation journal (InventoryStore),
+    orders in an append-only CSV log (OrderStore).
+    """
+
+    name = 'csv'
+
+    def __init__(self, inventory_file, orders_file, **store_options):
+        self.inventory_file = inventory_file
+        self.orders_file = orders_file
+        self.store_options = store_options
+
+    def inventory_store(self):
+        return get_store(self.inventory_file, **self.store_options)
+
+    def order_store(self):
+        return get_order_store(self.orders_file)
+
+    def load_inventory(self):
+        """Returns a copy of the current inventory."""
+        return self.inventory_store().frame().copy()
+
+    def save_inventory(self, df):
+        """Replaces the whole inventory with df."""
+        self.inventory_store().save(df)
+
+    def load_orders(self):
+        """Returns the current state of every order as a DataFrame."""
+        return pd.DataFrame(self.order_store().query(), columns=ORDER_COLUMNS)
+
+    def save_orders(self, df):
+        """Replaces every order with the rows of df."""
+        self.order_store().replace(df.fillna('').to_dict(orient='records'))
+
+
+class SQLiteBackend(CSVBackend):
+    """
+    Inventory and orders in one SQLite database (WAL mode), with indexed
+    barcode/category and (barcode, status) columns and single-row
+    transactional writes (see SQLiteInventoryStore).
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path, **store_options):
+        self.db_path = db_path
+        self.store_options = store_options
+
+    def inventory_store(self):
+        return get_sqlite_store(self.db_path, **self.store_options)
+
+    def order_store(self):
+        return get_sqlite_order_store(self.db_path)
@@ -0,0 +1,875 @@
+import atexit
+import contextlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from utils.barcode import normalize_barcode, normalize_barcodes
+from utils.changes import ChangeFeed
+from utils import inventory
+from utils.inventory import (ALERT_COLUMNS, EXPIRY_WINDOWS, OVERSTOCK_MULTIPLIER, REORDER_DAYS, AlertIndex,
+                             append_rows, changed_rows, enforce_schema, load_binary_snapshot,
+                             load_inventory, plain_frame, plain_row, save_binary_snapshot, save_inventory, set_cell,
+                             set_cells)
+from utils.journal import MutationJournal, file_identity, read_journal, tail_journal
+from utils.locking import file_lock
+from utils.metrics import timed
+from utils.search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# A reload or replacement that changes more rows than this is put on the
+# change feed as one reset rather than row by row
+RELOAD_EVENTS_MAX = 1000
+
+# Product dicts kept for get()/get_many(); the oldest are dropped past this
+PRODUCT_CACHE_MAX = 20_000
+
+# New products collect in a small tail frame that is concatenated onto the
+# catalog once it holds this many rows, or when the whole frame is read
+APPEND_TAIL_MAX = 500
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'y', 'on')
+    return bool(value)
+
+
+def _coerce(column, value):
+    if column in ('quantity', 'threshold'):
+        return int(float(value)) if value not in (None, '') else 0
+    if column in ('cost', 'price'):
+        return float(value) if value not in (None, '') else 0.0
+    if column == 'synced':
+        return _to_bool(value)
+    return str(value) if value is not None else ''
+
+
+class InventoryStore:
+    """
+    Process-wide, in-memory copy of the inventory file.
+
+    The typed DataFrame is parsed once and kept resident. It is re-read only
+    when the file's mtime/size changes on disk (i.e. it was edited outside the
+    app). Callers must treat the frame returned by frame() as read-only and
+    change products through upsert()/adjust_quantity()/set_synced().
+
+    Mutations are not written back as a whole CSV. Each one becomes a small
+    record in an append-only journal next to the file (see MutationJournal),
+    fsynced before the request returns, so a write costs the same whatever
+    the catalog size. A background thread folds the journal into a new
+    snapshot of the CSV (written to a temp file and renamed into place) once
+    it grows past compact_records; on load the journal is replayed on top of
+    the snapshot. Records carry absolute values (e.g. the new quantity, not
+    only the delta), so replaying one twice is harmless.
+
+    A normalized barcode -> row label index (see normalize_barcode) is kept in
+    step with every load and mutation, so product lookups are a dict access.
+    The full-text SearchIndex and the AlertIndex are built on first use and
+    then updated in place, only for the rows a mutation touches.
+
+    version counts changes to the content (mutations and reloads); together
+    with a per-instance epoch it makes the etag() of the current inventory.
+    Every applied record, whether written here or tailed from another
+    process, is also reported row by row on the changes feed (ChangeFeed).
+
+    Several processes (e.g. gunicorn workers) can share the files. Reads stay
+    lock-free: each one checks the journal's size and applies whatever
+    records other processes appended since (tailing it). Writes hold an
+    exclusive flock on <file>.lock, catch up first and only then compute
+    their records, so e.g. two concurrent stock adjustments in different
+    workers both count. Rotating the journal happens under that lock too;
+    a process that finds the journal rotated, or the snapshot replaced,
+    reloads under a shared lock. One process at a time compacts, guarded by
+    <file>.compact.lock.
+    """
+
+    def __init__(self, file_path, journal_path=None, compact_records=1000, compact_interval=10,
+                 binary_snapshot=False):
+        self.file_path = file_path
+        self.journal_path = journal_path or f"{file_path}.journal"
+        self.lock_path = f"{file_path}.lock"
+        self.compact_lock_path = f"{file_path}.compact.lock"
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self.compact_records = compact_records
+        self.compact_interval = compact_interval
+        self.binary_snapshot = binary_snapshot
+        if binary_snapshot and inventory.pyarrow is None:
+            logger.warning("pyarrow is not installed: no binary snapshot is kept, %s is parsed on every load", file_path)
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._journal = None
+        self._journal_id = None
+        self._journal_offset = 0
+        self._file_locked = False
+        self._compactor = None
+        self._df = None
+        # Rows appended since the tail was last concatenated onto _df
+        self._tail = None
+        self._signature = None
+        self._index = {}
+        # Normalized codes stored in several forms -> all their row labels
+        self._shadowed = {}
+        self._search = None
+        self._alerts = None
+        # Row label -> JSON-ready product dict, dropped when the row changes
+        self._products = {}
+        self._epoch = uuid.uuid4().hex[:12]
+        self.changes = ChangeFeed(self._epoch)
+        # Alerts raised by rows applied since the last _publish()
+        self._raised = []
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.replayed = 0
+        self.tailed = 0
+        self.compactions = 0
+
+    def _stat_signature(self, path=None):
+        try:
+            st = os.stat(path or self.file_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _rebuild_index(self):
+        keys = normalize_barcodes(self._df['barcode']).to_numpy()
+        # First row wins for duplicate codes, like the old .index[0] lookups
+        self._index = dict(zip(keys[::-1], self._df.index[::-1]))
+        self._shadowed = {}
+        if len(self._index) < len(keys):
+            labels = pd.Series(self._df.index, index=keys)
+            duplicated = labels[labels.index.duplicated(keep=False)]
+            self._shadowed = {key: list(group) for key, group in duplicated.groupby(level=0, sort=False)}
+            logger.warning(
+                "%d barcodes are stored in several forms of the same code; a lookup by another form finds "
+                "the first row, each row is still found by its exact stored form: %s",
+                len(self._shadowed),
+                '; '.join(' = '.join(str(self._df.at[label, 'barcode']) for label in group)
+                          for group in list(self._shadowed.values())[:20]),
+            )
+
+    def _label(self, barcode):
+        # Row label of barcode; among rows whose codes normalize alike, the one stored in exactly this form
+        key = normalize_barcode(barcode)
+        shadowed = self._shadowed.get(key)
+        if shadowed:
+            code = str(barcode).strip()
+            for label in shadowed:
+                if str(self._df.at[label, 'barcode']).strip() == code:
+                    return label
+        return self._index.get(key)
+
+    def frame(self):
+        """
+        Returns the cached inventory DataFrame, reloading it if the file changed
+        and applying journal records other processes appended since last time.
+        """
+        with self._lock:
+            self._current()
+            self._merge_tail()
+            return self._df
+
+    def _current(self):
+        # frame() without concatenating the tail: for lookups and writes,
+        # which find rows through _frame_of()
+        signature = self._stat_signature()
+        with self._lock:
+            if self._df is None:
+                self.misses += 1
+                self._reload()
+            elif signature != self._signature or not self._catch_up():
+                self.reloads += 1
+                self._reload()
+            else:
+                self.hits += 1
+            return self._df
+
+    def _frame_of(self, label):
+        # Tail labels continue after every label of _df
+        if self._tail is not None and label >= self._tail.index[0]:
+            return self._tail
+        return self._df
+
+    def _merge_tail(self):
+        if self._tail is not None:
+            self._df = append_rows(self._df, self._tail)
+            self._tail = None
+
+    @contextlib.contextmanager
+    def _file_lock(self, shared=False):
+        # Caller holds self._lock. Nested use (a reload inside a write) keeps
+        # the lock already held rather than deadlocking on it.
+        if self._file_locked:
+            yield
+            return
+        with file_lock(self.lock_path, shared=shared):
+            self._file_locked = True
+            try:
+                yield
+            finally:
+                self._file_locked = False
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """
+        Serializes a mutation across threads and processes: holds the store
+        lock and the exclusive file lock, with the frame caught up with every
+        record written so far.
+        """
+        with self._lock, self._file_lock():
+            self._current()
+            if self._journal.size() > self._journal_offset:
+                # No one else can be appending now: a crashed writer's torn record
+                self._journal.truncate(self._journal_offset)
+            yield
+
+    def _catch_up(self):
+        """
+        Applies the records appended to the journal since it was last read.
+        Returns False if the journal was rotated away, which takes a reload.
+        """
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return False
+        if file_identity(st) != self._journal_id:
+            return False
+        if st.st_size == self._journal_offset:
+            return True
+        with open(self.journal_path, 'rb') as f:
+            if file_identity(os.fstat(f.fileno())) != self._journal_id:
+                return False
+            records, self._journal_offset = tail_journal(f, self._journal_offset)
+        if records:
+            self._apply_all(records)
+            self._journal.records += len(records)
+            self.tailed += len(records)
+            self.version += 1
+        return True
+
+    def _reload(self):
+        # Journal rotation holds the exclusive lock, so snapshot and journal(s)
+        # read under the shared one fit together
+        with self._file_lock(shared=True):
+            self._load(self._stat_signature())
+
+    def _load(self, signature):
+        # Snapshot first, then whatever the journal(s) recorded since it was taken
+        if self._journal is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+            self._journal = MutationJournal(self.journal_path)
+        else:
+            self._journal.reopen()
+        previous = self._df
+        self._df = self._read_snapshot(signature)
+        self._tail = None
+        self._signature = signature
+        self.version += 1
+        self._rebuild_index()
+        self._search = None
+        self._alerts = None
+        self._products = {}
+        # Left behind by a compaction that is still running or died; the
+        # compactor folds it into the snapshot
+        records = list(read_journal(self._journal.rotated_path))
+        with open(self._journal.path, 'rb') as f:
+            self._journal_id = file_identity(os.fstat(f.fileno()))
+            current, self._journal_offset = tail_journal(f, 0)
+        self._apply_all(records + current, publish=False)
+        self._journal.records = len(current)
+        self.replayed += len(records) + len(current)
+        self._publish_replaced(previous)
+
+    def _read_snapshot(self, signature):
+        # The typed binary copy of the CSV skips parsing; it is only used
+        # while it was written from this very CSV (same signature)
+        if not self.binary_snapshot or signature is None:
+            return load_inventory(self.file_path)
+        df = load_binary_snapshot(self.file_path, signature)
+        if df is None:
+            df = load_inventory(self.file_path)
+            save_binary_snapshot(self.file_path, df, signature)
+        return df
+
+    def _refresh_row(self, label):
+        # Bring the secondary indexes in line with the row's new values
+        self._products.pop(label, None)
+        if self._search is not None:
+            self._search.add(label, self._search_record(label))
+        if self._alerts is not None:
+            df = self._frame_of(label)
+            row = {column: df.at[label, column] for column in ALERT_COLUMNS if column in df.columns}
+            self._raised.extend(self._alerts.update(label, row))
+
+    def _append_rows(self, rows):
+        """
+        Appends new products (normalized barcode -> row dict) to the tail with
+        a single concat. Concatenating onto the catalog copies all of it (some
+        20 ms at 20k rows, 80 ms at 200k), so that is done once per
+        APPEND_TAIL_MAX new rows, or when the whole frame is read, rather
+        than for every product added.
+        """
+        first = next(iter(rows.values()))
+        base = self._df if self._tail is None else self._tail
+        # Columns the rows don't set (e.g. stray CSV headers) are left empty
+        new_df = pd.DataFrame(list(rows.values()), columns=base.columns if not base.empty else list(first.keys()))
+        # New labels continue after the largest one, so existing labels never change
+        if self._tail is not None:
+            start = int(self._tail.index[-1]) + 1
+        else:
+            start = int(self._df.index.max()) + 1 if len(self._df) else 0
+        new_df.index = pd.RangeIndex(start, start + len(new_df))
+        self._tail = enforce_schema(new_df) if self._tail is None else append_rows(self._tail, new_df)
+        for key, label in zip(rows, new_df.index):
+            self._index[key] = label
+            self._refresh_row(label)
+        if len(self._tail) >= APPEND_TAIL_MAX:
+            self._merge_tail()
+
+    def _apply_all(self, records, publish=True):
+        """
+        Applies records in order. Consecutive new products are collected and
+        appended with one concat rather than one per row. Unless publish is
+        False (replaying on load), the changes are then put on the feed.
+        """
+        if publish and self._alerts is None and self.changes.listening():
+            # Alert events come from the AlertIndex seeing rows cross a threshold
+            self._merge_tail()
+            self._alerts = AlertIndex(self._df)
+        new_rows = {}
+        for record in records:
+            if record['op'] == 'upsert':
+                key = normalize_barcode(record['row']['barcode'])
+                if key in new_rows:
+                    new_rows[key].update((k, v) for k, v in record['row'].items() if k != 'barcode')
+                    continue
+                if key not in self._index:
+                    new_rows[key] = dict(record['row'])
+                    continue
+            elif normalize_barcode(record['barcode']) in new_rows:
+                self._append_rows(new_rows)
+                new_rows = {}
+            self._apply(record)
+        if new_rows:
+            self._append_rows(new_rows)
+        if publish:
+            self._publish(records)
+        else:
+            self._raised = []
+
+    def _publish(self, records):
+        """Puts applied records on the change feed, as events naming rows by their stored barcode."""
+        raised, self._raised = self._raised, []
+        if not self.changes.listening():
+            self.changes.skip()
+            return
+        events, upserted = [], {}
+        for record in records:
+            op = record['op']
+            label = self._label(record['row']['barcode'] if op == 'upsert' else record['barcode'])
+            if label is None:
+                continue
+            if op == 'upsert':
+                upserted[label] = None
+                events.append({'type': 'upsert', 'label': label})
+            elif op == 'quantity':
+                events.append({'type': 'quantity', 'barcode': self._frame_of(label).at[label, 'barcode'],
+                               'quantity': int(record['quantity']), 'delta': int(record.get('delta') or 0)})
+            elif op == 'synced':
+                events.append({'type': 'synced', 'barcode': self._frame_of(label).at[label, 'barcode'],
+                               'synced': bool(record['synced'])})
+        if upserted:
+            # One frame-to-dicts conversion for the upserted rows of the catalog, one for the tail
+            products = {}
+            for df in (self._df, self._tail):
+                labels = [label for label in upserted if df is not None and self._frame_of(label) is df]
+                if labels:
+                    products.update(zip(labels, plain_frame(df.loc[labels]).to_dict(orient='records')))
+            for event in events:
+                if event['type'] == 'upsert':
+                    product = products[event.pop('label')]
+                    event.update(barcode=product['barcode'], product=product)
+        events += [dict(alert, type='alert') for alert in raised]
+        if events:
+            self.changes.publish(events)
+
+    def _publish_replaced(self, previous):
+        """
+        Puts a reload or replacement of the frame (previous is the one before)
+        on the change feed: as upserts of the rows that differ, or as a reset
+        if rows went away or moved, or too many changed. Another process
+        compacting the journal, for one, makes every other process reload the
+        same content: processes apply the same journal in the same order, so
+        rows keep their positions and only the changed or appended ones are sent.
+        """
+        if not self.changes.listening():
+            self.changes.skip()
+            return
+        events = [{'type': 'reset'}]
+        if (previous is not None and len(previous) <= len(self._df)
+                and list(previous.columns) == list(self._df.columns)
+                and (previous['barcode'].to_numpy() == self._df['barcode'].to_numpy()[:len(previous)]).all()):
+            changed = changed_rows(previous, self._df)
+            if changed.sum() <= RELOAD_EVENTS_MAX:
+                events = [{'type': 'upsert', 'barcode': product['barcode'], 'product': product}
+                          for product in plain_frame(self._df[changed]).to_dict(orient='records')]
+        if events:
+            self.changes.publish(events)
+
+    def _apply(self, record):
+        """Applies one journal record to the in-memory frame and indexes. Returns its row label."""
+        op = record['op']
+        if op == 'upsert':
+            row = record['row']
+            label = self._label(row['barcode'])
+            if label is None:
+                key = normalize_barcode(row['barcode'])
+                self._append_rows({key: row})
+                return self._index[key]
+            df = self._frame_of(label)
+            for column, value in row.items():
+                # Keep the stored barcode form; only known columns are updated
+                if column != 'barcode' and column in df.columns:
+                    set_cell(df, label, column, value)
+        else:
+            label = self._label(record['barcode'])
+            if label is None:
+                return None
+            # Typed values, also for records journaled as strings by other writers
+            if op == 'quantity':
+                self._frame_of(label).at[label, 'quantity'] = _coerce('quantity', record['quantity'])
+            elif op == 'synced':
+                self._frame_of(label).at[label, 'synced'] = _coerce('synced', record['synced'])
+        self._refresh_row(label)
+        return label
+
+    def _log(self, records):
+        """Journals and applies records; the caller is _writing(). Returns a ticket for _journal.commit()."""
+        ticket = self._journal.append(records)
+        # Only writers holding the file lock append, so the journal ends here
+        self._journal_offset = self._journal.size()
+        self._apply_all(records)
+        self.version += 1
+        self._start_compactor()
+        return ticket
+
+    @timed('journal_commit')
+    def _commit(self, ticket):
+        # Called after the locks are released: waits for the journal fsync
+        self._journal.commit(ticket)
+
+    def _write_snapshot(self, df):
+        tmp_path = f"{self.file_path}.tmp"
+        save_inventory(tmp_path, df)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        # os.replace keeps the inode, so the temp file's signature is the snapshot's
+        signature = self._stat_signature(tmp_path)
+        with self._lock:
+            os.replace(tmp_path, self.file_path)
+            self._signature = signature
+        if self.binary_snapshot:
+            save_binary_snapshot(self.file_path, df, signature)
+
+    def compact(self, force=False, replace_with=None):
+        """
+        Folds the journal into a fresh snapshot of the inventory file.
+        Writers are only blocked while the journal is rotated and the frame
+        copied, not while the snapshot is written. Unless forced, it gives
+        way if another process is compacting. Returns True if it ran.
+        replace_with (a DataFrame, or a function of the current one returning
+        the new one and the {normalized barcode: label} index entries of the
+        rows it appended, without touching the store) replaces the whole
+        inventory first.
+        """
+        with self._compact_lock, file_lock(self.compact_lock_path, blocking=force) as acquired:
+            if not acquired:
+                return False
+            with self._writing():
+                self._merge_tail()
+                if replace_with is not None:
+                    previous = self._df
+                    if callable(replace_with):
+                        df, appended = replace_with(self._df)
+                        self._df = enforce_schema(df)
+                        # Only once the frame holding the new rows is in place
+                        self._index.update(appended)
+                    else:
+                        self._df = enforce_schema(replace_with.copy())
+                        self._rebuild_index()
+                    self._search = None
+                    self._alerts = None
+                    self._products = {}
+                    self.version += 1
+                    self._publish_replaced(previous)
+                leftover = os.path.exists(self._journal.rotated_path)
+                if not force and not leftover and self._journal.records == 0:
+                    return False
+                if leftover:
+                    # A compaction died before finishing; the frame has its records
+                    self._write_snapshot(self._df.copy())
+                    os.remove(self._journal.rotated_path)
+                rotated = self._journal.rotate()
+                self._journal_id = self._journal.identity()
+                self._journal_offset = 0
+                df = self._df.copy()
+            self._write_snapshot(df)
+            os.remove(rotated)
+            self.compactions += 1
+            return True
+
+    def _start_compactor(self):
+        if self._compactor is None and self.compact_interval:
+            self._compactor = threading.Thread(target=self._compact_loop, name='inventory-compactor', daemon=True)
+            self._compactor.start()
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            if self._journal.records >= self.compact_records or os.path.exists(self._journal.rotated_path):
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception("Inventory journal compaction failed")
+
+    def save(self, df):
+        """Replaces the whole inventory with df and writes it out as a new snapshot."""
+        self.compact(force=True, replace_with=df)
+
+    def invalidate(self):
+        with self._lock:
+            self._df = None
+            self._tail = None
+            self._signature = None
+            self._journal_id = None
+            self._index = {}
+            self._shadowed = {}
+            self._search = None
+            self._alerts = None
+            self._products = {}
+            self.version += 1
+
+    def etag(self):
+        """Returns a token that changes whenever the inventory content does."""
+        with self._lock:
+            self._current()
+            return f"{self._epoch}-{self.version}"
+
+    def find(self, barcode):
+        """Returns the row label of the product with this barcode, or None."""
+        with self._lock:
+            self._current()
+            return self._label(barcode)
+
+    def get(self, barcode):
+        """Returns the product with this barcode as a JSON-ready dict, or None."""
+        return self.get_many([barcode]).get(barcode)
+
+    def rows(self, labels):
+        """Returns a copy of the rows with these labels, in that order."""
+        with self._lock:
+            return self.frame().loc[list(labels)]
+
+    def _product(self, label):
+        # Built from the row's scalars on a miss; callers get their own copy
+        product = self._products.get(label)
+        if product is None:
+            if len(self._products) >= PRODUCT_CACHE_MAX:
+                del self._products[next(iter(self._products))]
+            product = self._products[label] = plain_row(self._frame_of(label), label)
+        return dict(product)
+
+    def get_many(self, barcodes):
+        """
+        Resolves many barcodes through the index and the cache of product
+        dicts. Returns {barcode: product dict} for the barcodes that are in stock.
+        """
+        with self._lock:
+            self._current()
+            found = {}
+            for barcode in barcodes:
+                label = self._label(barcode)
+                if label is not None:
+                    found[barcode] = self._product(label)
+            return found
+
+    def _selection(self, filters=None, sort=None, descending=False, low_stock=False):
+        # Row labels matching filters ({column: value}, case-insensitive equality), in sort order
+        df = self._df
+        if not filters and not sort and not low_stock:
+            # Every row in insertion order: no per-call work over the catalog
+            return df.index
+        mask = pd.Series(True, index=df.index)
+        for column, value in (filters or {}).items():
+            mask &= df[column].astype(str).str.lower() == str(value).lower()
+        if low_stock:
+            # Same rule as the understock alert
+            quantity = pd.to_numeric(df['quantity'], errors='coerce').fillna(0)
+            threshold = pd.to_numeric(df['threshold'], errors='coerce').fillna(0)
+            mask &= (threshold > 0) & (quantity <= threshold)
+        labels = df.index[mask.to_numpy()]
+        if sort:
+            column = df.loc[labels, sort]
+            if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column):
+                key = column
+            else:
+                numeric = pd.to_numeric(column.astype(str), errors='coerce')
+                key = numeric if numeric.notna().all() else column.astype(str).str.lower()
+            labels = key.sort_values(ascending=not descending, kind='stable').index
+        return labels
+
+    def list_products(self, fields=None, filters=None, sort=None, descending=False, low_stock=False,
+                      offset=0, limit=None, after=None):
+        """
+        Returns one page of products as (total matching, DataFrame of the page,
+        next cursor or None). fields projects the columns returned. Pages are taken
+        by offset, or, in the default (insertion) order, after the row label a
+        previous page returned as its cursor, which stays stable while
+        products are added.
+        """
+        with self._lock:
+            self.frame()
+            labels = self._selection(filters, sort, descending, low_stock)
+            total = len(labels)
+            if after is not None and not sort:
+                # Labels grow with insertion order, so the page start is a binary search
+                if labels.is_monotonic_increasing:
+                    labels = labels[labels.searchsorted(after, side='right'):]
+                else:
+                    labels = labels[labels > after]
+            else:
+                labels = labels[offset:]
+            page = labels[:limit] if limit is not None else labels
+            columns = fields or list(self._df.columns)
+            # Rows first: selecting columns of the whole frame first would copy it
+            rows = self._df.loc[page][columns]
+            more = limit is not None and len(labels) > len(page)
+            cursor = int(page[-1]) if more and not sort else None
+            return total, rows, cursor
+
+    def iter_products(self, fields=None, filters=None, sort=None, descending=False, low_stock=False,
+                      chunk_rows=1000):
+        """
+        Yields the matching products as DataFrames of chunk_rows rows, without
+        materializing the whole list. The selection is taken up front; each
+        chunk is read under the lock, so rows are never half-updated.
+        """
+        with self._lock:
+            self.frame()
+            labels = self._selection(filters, sort, descending, low_stock)
+            columns = fields or list(self._df.columns)
+        for start in range(0, len(labels), chunk_rows):
+            with self._lock:
+                # A reload from disk in between may have dropped rows
+                chunk_labels = labels[start:start + chunk_rows]
+                chunk = self._df.loc[chunk_labels[chunk_labels.isin(self._df.index)]][columns]
+            yield chunk
+
+    def columns(self):
+        return list(self.frame().columns)
+
+    def _search_record(self, label):
+        df = self._frame_of(label)
+        return {field: df.at[label, field] for field in self._search.fields if field in df.columns}
+
+    def search(self, query, limit=50):
+        """Returns the row labels of the products best matching query, best first."""
+        with self._lock:
+            self.frame()
+            if self._search is None:
+                self._search = SearchIndex()
+                for label in self._df.index:
+                    self._search.add(label, self._search_record(label))
+            return self._search.search(query, limit)
+
+    @timed('get_alerts')
+    def alerts(self, expiry_windows=EXPIRY_WINDOWS, overstock_multiplier=OVERSTOCK_MULTIPLIER, usage=None,
+               reorder_days=REORDER_DAYS):
+        """
+        Returns get_alerts() output for the inventory, served from the
+        AlertIndex. usage is daily consumption by normalized barcode (see
+        StockRollups.usage), for reorder alerts.
+        """
+        with self._lock:
+            self.frame()
+            if self._alerts is None:
+                self._alerts = AlertIndex(self._df, overstock_multiplier)
+            else:
+                self._alerts.set_overstock_multiplier(overstock_multiplier)
+            if usage is not None:
+                usage = {self._index[key]: rate for key, rate in usage.items() if key in self._index}
+            return self._alerts.alerts(expiry_windows, usage, reorder_days)
+
+    def _current_quantity(self, label):
+        current = pd.to_numeric(self._frame_of(label).at[label, 'quantity'], errors='coerce')
+        return int(current) if pd.notna(current) else 0
+
+    def upsert(self, product):
+        """
+        Updates the product matching product['barcode'] with the given fields,
+        or appends it as a new row. Returns True if a new row was created.
+        """
+        return self.upsert_many([product])[0]['created']
+
+    def merge(self, rows):
+        """
+        Upserts every row of rows (a DataFrame with a barcode column and any
+        inventory columns; missing values leave stored ones alone) with one
+        column-wise merge, written out as a single new snapshot. Of rows with
+        the same barcode the last one wins. Returns (inserted, updated).
+        """
+        counts = {}
+
+        def merged(df):
+            incoming = rows.set_axis(normalize_barcodes(rows['barcode']).to_numpy())
+            incoming = incoming[~incoming.index.duplicated(keep='last')]
+            labels = pd.Series(incoming.index.map(self._index.get), index=incoming.index)
+            found = labels.notna().to_numpy()
+            df = df.copy()
+            updates, targets = incoming[found], labels[found].astype(int)
+            for column in incoming.columns:
+                if column != 'barcode' and column in df.columns:
+                    given = updates[column].notna().to_numpy()
+                    if given.any():
+                        set_cells(df, targets[given].to_numpy(), column, updates[column][given])
+            new = incoming[~found].reindex(columns=df.columns if len(df.columns) else incoming.columns)
+            appended = {}
+            if len(new):
+                if 'category' in new.columns:
+                    new['category'] = new['category'].astype(object).fillna('Uncategorized')
+                start = int(df.index.max()) + 1 if len(df) else 0
+                new.index = pd.RangeIndex(start, start + len(new))
+                df = append_rows(df, new)
+                # Existing rows keep their labels and barcodes; only new ones join the index
+                appended = dict(zip(incoming.index[~found], new.index))
+            counts.update(inserted=len(new), updated=int(found.sum()))
+            return df, appended
+
+        self.compact(force=True, replace_with=merged)
+        return counts['inserted'], counts['updated']
+
+    def upsert_many(self, products):
+        """
+        Upserts a batch of products as one journal write (one fsync) and, for
+        new products, one concat. A product may carry an 'adjustment' that is
+        added to its quantity after its fields are applied (e.g. received
+        units). Returns [{'barcode', 'created', 'quantity'}] in input order.
+        """
+        with self._writing():
+            df = self._current()
+            records, results, quantities = [], [], {}
+            for product in products:
+                barcode = str(product['barcode'])
+                key = normalize_barcode(barcode)
+                label = self._index.get(key)
+                created = label is None and key not in quantities
+                if created:
+                    row = {
+                        'barcode': barcode,
+                        'name': str(product.get('name', '')),
+                        'category': str(product.get('category', 'Uncategorized')),
+                        'quantity': _coerce('quantity', product.get('quantity', 0)),
+                        'cost': _coerce('cost', product.get('cost', 0.0)),
+                        'price': _coerce('price', product.get('price', 0.0)),
+                        'expiry': str(product.get('expiry', '')),
+                        'threshold': _coerce('threshold', product.get('threshold', 0)),
+                        'distributor': str(product.get('distributor', '')),
+                        'manufacturer': str(product.get('manufacturer', '')),
+                        'synced': _coerce('synced', product.get('synced', False)),
+                        'image_url': str(product.get('image_url', '')),
+                        'description': str(product.get('description', ''))
+                    }
+                else:
+                    row = {k: _coerce(k, v) for k, v in product.items() if k in df.columns}
+                    row['barcode'] = barcode
+                records.append({'op': 'upsert', 'row': row})
+                if 'quantity' in row:
+                    quantities[key] = row['quantity']
+                elif key not in quantities:
+                    quantities[key] = self._current_quantity(label)
+                adjustment = int(product.get('adjustment') or 0)
+                if adjustment:
+                    quantities[key] = max(0, quantities[key] + adjustment)
+                    records.append({'op': 'quantity', 'barcode': barcode, 'delta': adjustment, 'quantity': quantities[key]})
+                results.append({'barcode': barcode, 'created': created, 'quantity': quantities[key]})
+            if not records:
+                return results
+            ticket = self._log(records)
+        self._commit(ticket)
+        return results
+
+    def adjust_quantity(self, barcode, adjustment):
+        """Adds adjustment to the product's quantity (floored at 0). Returns the new quantity, or None."""
+        with self._writing():
+            label = self.find(barcode)
+            if label is None:
+                return None
+            new_qty = max(0, self._current_quantity(label) + adjustment)
+            ticket = self._log([{'op': 'quantity', 'barcode': str(barcode), 'delta': adjustment, 'quantity': new_qty}])
+        self._commit(ticket)
+        return new_qty
+
+    def set_synced(self, barcode, synced=True):
+        """Sets the product's synced flag. Returns False if the barcode is unknown."""
+        with self._writing():
+            if self.find(barcode) is None:
+                return False
+            ticket = self._log([{'op': 'synced', 'barcode': str(barcode), 'synced': bool(synced)}])
+        self._commit(ticket)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'file': self.file_path,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'version': self.version,
+                'rows': (0 if self._df is None else len(self._df)) + (0 if self._tail is None else len(self._tail)),
+                'indexed_barcodes': len(self._index),
+                # Rows that share their normalized code with an earlier row
+                'shadowed_rows': sum(len(labels) - 1 for labels in self._shadowed.values()),
+                'indexed_documents': 0 if self._search is None else len(self._search),
+                'journal_records': 0 if self._journal is None else self._journal.records,
+                'journal_fsyncs': 0 if self._journal is None else self._journal.fsyncs,
+                'replayed_records': self.replayed,
+                'tailed_records': self.tailed,
+                'compactions': self.compactions,
+                'change_feed': self.changes.stats(),
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(file_path, **options):
+    """
+    Returns the shared InventoryStore for file_path, creating it on first use.
+    options (journal_path, compact_records, compact_interval) only apply then.
+    """
+    key = os.path.abspath(file_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = InventoryStore(file_path, **options)
+        return store
+
+
+@atexit.register
+def _compact_stores():
+    # Leave a clean snapshot behind on a normal shutdown
+    for store in list(_stores.values()):
+        if store._journal is not None and store._journal.records:
+            try:
+                store.compact()
+            except Exception:
+                logger.exception("Inventory journal compaction at exit failed")